@@ -6,11 +6,15 @@ __email__ = 'jackson.dedobbelaere@c3.ai'
 
 #!/usr/bin/env python3
 import argparse
+from c3DataMigration.c3Helpers import c3EnvMetadata
 from c3DataMigration.c3Helpers import c3FileSystem
 from c3DataMigration.c3Helpers import c3PythonClasses
 from c3DataMigration.c3Helpers import c3Request
+from c3DataMigration.c3Helpers import c3RetryPolicy
+from c3DataMigration.c3Helpers import c3RunJournal
 from c3DataMigration.c3Helpers import c3UsageStats
 from c3DataMigration.c3Helpers import c3UtilityMethods
+from c3DataMigration.c3Helpers import c3Watermarks
 from c3DataMigration.c3MigrationMethods import c3DataDownload
 from c3DataMigration.c3MigrationMethods import c3DataUpload
 from c3DataMigration.c3MigrationMethods import c3DataRefreshCalcFields
@@ -97,6 +101,27 @@ def uploadDataToC3Env (
     masterRefreshDataSwitch=True,
     maxColumnPrintLength=None,
     promptUsersForWarnings=True,
+    initialPollTimeSeconds=1,
+    pollBackoffMultiplier=1.5,
+    maxRetrySleepSeconds=300,
+    maxRequestAttempts=10,
+    requestRetryBudget=1000,
+    connectionPoolSize=10,
+    numProcessWorkers=None,
+    schemaCacheTTLSeconds=24 * 60 * 60,
+    duplicateScanMemoryMB=256,
+    resumeFromJournal=True,
+    maxConcurrentUploads=8,
+    uploadChunkSizeMB=64,
+    compressOnTheFly=False,
+    keepZippedImportFiles=False,
+    compressionLevel=6,
+    compressionThreads=None,
+    reshardImportFiles=False,
+    importShardSizeMB=64,
+    maxImportShardRecords=250000,
+    overlapRemoveWithUpload=True,
+    handOffTypeByType=True,
     sendDeveloperData=True,
   ):
   checkMostUpdatedVersion()
@@ -109,21 +134,52 @@ def uploadDataToC3Env (
     batchSize               = batchSize,
     errorSleepTimeSeconds   = errorSleepTimeSeconds,
     refreshPollTimeSeconds  = refreshPollTimeSeconds,
+    initialPollTimeSeconds  = initialPollTimeSeconds,
+    pollBackoffMultiplier   = pollBackoffMultiplier,
+    maxRetrySleepSeconds    = maxRetrySleepSeconds,
+    maxRequestAttempts      = maxRequestAttempts,
+    requestRetryBudget      = requestRetryBudget,
     maxColumnPrintLength    = maxColumnPrintLength,
     masterRemoveDataSwitch  = masterRemoveDataSwitch,
     masterUploadDataSwitch  = masterUploadDataSwitch,
     masterRefreshDataSwitch = masterRefreshDataSwitch,
     promptUsersForWarnings  = promptUsersForWarnings,
+    connectionPoolSize      = connectionPoolSize,
+    numProcessWorkers       = numProcessWorkers,
+    schemaCacheTTLSeconds   = schemaCacheTTLSeconds,
+    duplicateScanMemoryMB   = duplicateScanMemoryMB,
+    resumeFromJournal       = resumeFromJournal,
+    maxConcurrentUploads    = maxConcurrentUploads,
+    uploadChunkSizeMB       = uploadChunkSizeMB,
+    compressOnTheFly        = compressOnTheFly,
+    keepZippedImportFiles   = keepZippedImportFiles,
+    compressionLevel        = compressionLevel,
+    compressionThreads      = compressionThreads,
+    reshardImportFiles      = reshardImportFiles,
+    importShardSizeMB       = importShardSizeMB,
+    maxImportShardRecords   = maxImportShardRecords,
+    overlapRemoveWithUpload = overlapRemoveWithUpload,
+    handOffTypeByType       = handOffTypeByType,
     sendDeveloperData       = sendDeveloperData,
     outerAPICall            = 'uploadAPI'
   )
 
+  c3Request.configureSession(p.connectionPoolSize)
+  c3RetryPolicy.configureRetryPolicy(p.errorSleepTimeSeconds, p.maxRetrySleepSeconds, p.maxRequestAttempts, p.requestRetryBudget)
   c3UsageStats.UploadAPI.logStart(environmentArguments, p)
+  c3RunJournal.openRunJournal(r, p, p.dataUploadFolder, p.resumeFromJournal)
   c3FileSystem.wipeLocalDirectory(p, errorOutputFolder, p.promptUsersForWarnings)
+  removeTypes = [x[0] for x in p.dataTypeImports if ((p.masterRemoveDataSwitch == True) and (x[1]['removeData'] == True))]
+  c3EnvMetadata.runPreflight(r, p, [(x, '1 == 1') for x in removeTypes])
   c3UtilityMethods.enableQueues(r, p, p.promptUsersForWarnings)
-  c3DataRemove.removeDataFromEnv(r, p)
-  c3DataUpload.uploadDataToEnv(r, p)
-  c3DataRefreshCalcFields.refreshDataOnEnv(r, p, p.dataTypeImports)
+  if (p.overlapRemoveWithUpload == True):
+    c3DataRemove.startRemoveDataFromEnv(r, p)
+  else:
+    c3DataRemove.removeDataFromEnv(r, p)
+  refreshMapping = c3DataUpload.uploadDataToEnv(r, p)
+  c3DataRemove.finishRemoveDataFromEnv(r, p)
+  c3DataRefreshCalcFields.refreshDataOnEnv(r, p, p.dataTypeImports, refreshMapping)
+  c3RunJournal.finishRunJournal()
   c3UsageStats.UploadAPI.logFinish(r, p)
 
 
@@ -137,10 +193,26 @@ def downloadDataFromC3Env (
     dataDownloadFolder,
     errorOutputFolder=None,
     stripMetadataAndDerived=True,
+    streamJsonExtraction=True,
+    extractWhileFetching=False,
+    localDataFormat='prettyJson',
     masterRefreshDataSwitch=True,
     masterDownloadDataSwitch=True,
     maxColumnPrintLength=None,
     promptUsersForWarnings=True,
+    initialPollTimeSeconds=1,
+    pollBackoffMultiplier=1.5,
+    maxRetrySleepSeconds=300,
+    maxRequestAttempts=10,
+    requestRetryBudget=1000,
+    connectionPoolSize=10,
+    numProcessWorkers=None,
+    schemaCacheTTLSeconds=24 * 60 * 60,
+    duplicateScanMemoryMB=256,
+    resumeFromJournal=True,
+    maxConcurrentDownloads=8,
+    exportFileSizeMB=64,
+    incrementalDownload=False,
     sendDeveloperData=True,
   ):
   checkMostUpdatedVersion()
@@ -152,19 +224,43 @@ def downloadDataFromC3Env (
     errorOutputFolder        = errorOutputFolder,
     errorSleepTimeSeconds    = errorSleepTimeSeconds,
     refreshPollTimeSeconds   = refreshPollTimeSeconds,
+    initialPollTimeSeconds   = initialPollTimeSeconds,
+    pollBackoffMultiplier    = pollBackoffMultiplier,
+    maxRetrySleepSeconds     = maxRetrySleepSeconds,
+    maxRequestAttempts       = maxRequestAttempts,
+    requestRetryBudget       = requestRetryBudget,
     stripMetadataAndDerived  = stripMetadataAndDerived,
+    streamJsonExtraction     = streamJsonExtraction,
+    extractWhileFetching     = extractWhileFetching,
+    localDataFormat          = localDataFormat,
     maxColumnPrintLength     = maxColumnPrintLength,
     masterRefreshDataSwitch  = masterRefreshDataSwitch,
     masterDownloadDataSwitch = masterDownloadDataSwitch,
     promptUsersForWarnings   = promptUsersForWarnings,
+    connectionPoolSize       = connectionPoolSize,
+    numProcessWorkers        = numProcessWorkers,
+    schemaCacheTTLSeconds    = schemaCacheTTLSeconds,
+    duplicateScanMemoryMB    = duplicateScanMemoryMB,
+    resumeFromJournal        = resumeFromJournal,
+    maxConcurrentDownloads   = maxConcurrentDownloads,
+    exportFileSizeMB         = exportFileSizeMB,
+    incrementalDownload      = incrementalDownload,
     sendDeveloperData        = sendDeveloperData,
     outerAPICall             = 'downloadAPI'
   )
 
+  c3Request.configureSession(p.connectionPoolSize)
+  c3RetryPolicy.configureRetryPolicy(p.errorSleepTimeSeconds, p.maxRetrySleepSeconds, p.maxRequestAttempts, p.requestRetryBudget)
   c3UsageStats.DownloadAPI.logStart(environmentArguments, p)
-  c3FileSystem.wipeLocalDirectory(p, dataDownloadFolder, p.promptUsersForWarnings)
+  resumingRun = c3RunJournal.openRunJournal(r, p, p.dataDownloadFolder, p.resumeFromJournal)
+  if ((not resumingRun) and (p.incrementalDownload != True)):
+    c3FileSystem.wipeLocalDirectory(p, dataDownloadFolder, p.promptUsersForWarnings)
   c3FileSystem.wipeLocalDirectory(p, errorOutputFolder, p.promptUsersForWarnings)
+  c3Watermarks.assignExportFilters(r, p)
+  downloadTypes = [x for x in p.dataTypeExports if ((p.masterDownloadDataSwitch == True) and (x[1]['downloadData'] == True))]
+  c3EnvMetadata.runPreflight(r, p, [(x[0], x[1]['exportFilter']) for x in downloadTypes], None, [(x[0], x[1]['exportFilter'], x[1]['include']) for x in downloadTypes if (x[1]['numRecordsPerFile'] == None)])
   c3UtilityMethods.enableQueues(r, p, p.promptUsersForWarnings)
   c3DataRefreshCalcFields.refreshDataOnEnv(r, p, p.dataTypeExports)
   c3DataDownload.downloadDataFromEnv(r, p)
+  c3RunJournal.finishRunJournal()
   c3UsageStats.DownloadAPI.logFinish(r, p)
@@ -0,0 +1,111 @@
+__author__ = 'Jackson DeDobbelaere'
+__credits__ = ['Jackson DeDobbelaere']
+__maintainer__ = 'Jackson DeDobbealere'
+__email__ = 'jackson.dedobbelaere@c3.ai'
+
+
+#!/usr/bin/env python3
+import json
+import zlib
+from c3DataMigration.c3Helpers import c3UtilityMethods
+
+
+
+
+_runMetadata = {}
+_typeSampleSize = 100
+
+
+
+
+def resetRunMetadata ():
+  _runMetadata.clear()
+
+
+
+
+def getRunMetadata (key, defaultValue=None):
+  return _runMetadata.get(key, defaultValue)
+
+
+
+
+def setRunMetadata (key, value):
+  _runMetadata[key] = value
+
+
+
+
+def popPreflightTypeCount (c3Type, filterString):
+  return _runMetadata.get('typeCounts', {}).pop((c3Type, filterString), None)
+
+
+
+
+def getPreflightTypeSample (c3Type, filterString):
+  return _runMetadata.get('typeSamples', {}).get((c3Type, filterString))
+
+
+
+
+def _measureTypeSample (sampleJson):
+  # Only the sizes are kept, the sampled records themselves are thrown away
+  if (sampleJson == None):
+    return None
+  sampleRecords = json.loads(sampleJson)
+  sampleBytes = json.dumps(sampleRecords).encode('utf-8')
+  return {
+    'numRecords':         len(sampleRecords),
+    'numBytes':           len(sampleBytes),
+    'numCompressedBytes': len(zlib.compress(sampleBytes, 6)),
+  }
+
+
+
+
+def _generatePreflightJS (queueNames, typeCountFilters, typeSampleSpecs):
+  jsExecCode = """
+    var fileSystem = FileSystem.inst();
+    var snapshot = {
+      c3Context: c3Context(),
+      fileSystemType: fileSystem.type().typeName(),
+      rootUrl: fileSystem.rootUrl(),
+      serverTime: new Date().toISOString(),
+      queuesPaused: {},
+      typeCounts: [],
+      typeSamples: [],
+    };
+  """
+  for queueName in queueNames:
+    jsExecCode += 'snapshot.queuesPaused.{0} = {0}.isPaused();\n'.format(queueName)
+  for c3Type, filterString in typeCountFilters:
+    jsExecCode += 'snapshot.typeCounts.push({0}.fetchCount({{ filter: {1} }}));\n'.format(c3Type, json.dumps(filterString))
+  for c3Type, filterString, include in typeSampleSpecs:
+    jsExecCode += 'var sample = {0}.fetch({{ filter: {1}, include: {2}, limit: {3} }}).objs || [];\n'.format(c3Type, json.dumps(filterString), json.dumps(include), _typeSampleSize)
+    jsExecCode += 'snapshot.typeSamples.push((sample.length > 0) ? JSON.stringify(sample) : null);\n'
+  jsExecCode += 'snapshot'
+
+  return jsExecCode
+
+
+
+
+def runPreflight (r, p, typeCountFilters, queueNames=None, typeSampleSpecs=None):
+  # Grabs everything the run needs to know about the env up front in a single JS.exec round trip
+  queueNames = c3UtilityMethods.queueNamesToEnableByDefault if (queueNames == None) else queueNames
+  typeCountFilters = list(dict.fromkeys(typeCountFilters))
+  typeSampleSpecs = list(dict.fromkeys(typeSampleSpecs or []))
+
+  resetRunMetadata()
+  jsExecCode = _generatePreflightJS(queueNames, typeCountFilters, typeSampleSpecs)
+  errorCodePrefix = 'Unsuccessful running preflight snapshot of env'
+  snapshot = c3UtilityMethods.executeJSOnEnv(r, p.errorSleepTimeSeconds, jsExecCode, errorCodePrefix)
+
+  setRunMetadata('c3Context', snapshot['c3Context'])
+  setRunMetadata('fileSystemType', snapshot['fileSystemType'])
+  setRunMetadata('rootUrl', snapshot['rootUrl'])
+  setRunMetadata('serverTime', snapshot['serverTime'])
+  setRunMetadata('queuesPaused', { x: (y == True) for x, y in snapshot['queuesPaused'].items() })
+  setRunMetadata('typeCounts', { x: int(y) for x, y in zip(typeCountFilters, snapshot['typeCounts']) })
+  setRunMetadata('typeSamples', { x[:2]: _measureTypeSample(y) for x, y in zip(typeSampleSpecs, snapshot['typeSamples']) })
+  c3UtilityMethods.printFormatExtraPeriods('Snapshotting env metadata', 'DONE', p.maxColumnPrintLength, True)
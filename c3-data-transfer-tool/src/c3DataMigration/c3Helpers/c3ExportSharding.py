@@ -0,0 +1,53 @@
+__author__ = 'Jackson DeDobbelaere'
+__credits__ = ['Jackson DeDobbelaere']
+__maintainer__ = 'Jackson DeDobbealere'
+__email__ = 'jackson.dedobbelaere@c3.ai'
+
+
+#!/usr/bin/env python3
+import math
+from c3DataMigration.c3Helpers import c3EnvMetadata
+
+
+
+
+_fallbackNumRecordsPerFile = 2000
+_minFileSizeBytes = 1024 * 1024
+
+
+
+
+def estimateExportBytes (c3Type, filterString, recordCount):
+  # Compressed size of the whole export, extrapolated from the records sampled during the preflight
+  typeSample = c3EnvMetadata.getPreflightTypeSample(c3Type, filterString)
+  if ((typeSample == None) or (typeSample['numRecords'] == 0)):
+    return None
+
+  return recordCount * typeSample['numCompressedBytes'] / typeSample['numRecords']
+
+
+
+
+def planNumFiles (p, dataTypeExport, recordCount):
+  c3Type = dataTypeExport[0]
+  numRecordsPerFile = dataTypeExport[1]['numRecordsPerFile']
+  if (recordCount <= 0):
+    return 1
+  if (numRecordsPerFile != None):
+    return max(math.ceil(recordCount / numRecordsPerFile), 1)
+
+  estimatedBytes = estimateExportBytes(c3Type, dataTypeExport[1]['exportFilter'], recordCount)
+  if (estimatedBytes == None):
+    return max(math.ceil(recordCount / _fallbackNumRecordsPerFile), 1)
+
+  targetFileSizeBytes = p.exportFileSizeMB * 1024 * 1024
+  numFiles = math.ceil(estimatedBytes / targetFileSizeBytes)
+
+  # Small exports still get split across the download threads, as long as the files stay worth a request of their own
+  numFiles = max(numFiles, min(p.maxConcurrentDownloads, math.floor(estimatedBytes / _minFileSizeBytes)))
+
+  # Whole waves of downloads, so the last few files are not fetched by one thread while the rest sit idle
+  if (numFiles > p.maxConcurrentDownloads):
+    numFiles = math.ceil(numFiles / p.maxConcurrentDownloads) * p.maxConcurrentDownloads
+
+  return min(max(numFiles, 1), recordCount)
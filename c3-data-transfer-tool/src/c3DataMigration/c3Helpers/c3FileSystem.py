@@ -6,38 +6,51 @@ __email__ = 'jackson.dedobbelaere@c3.ai'
 
 #!/usr/bin/env python3
 import gzip
+import hashlib
 import json
 import os
 import shutil
 import xml.etree.ElementTree as ET
+from datetime import datetime
 from pathlib import Path
 from progress.bar import IncrementalBar
 from reprint import output
+from c3DataMigration.c3Helpers import c3EnvMetadata
+from c3DataMigration.c3Helpers import c3ImportSharding
+from c3DataMigration.c3Helpers import c3JsonStream
+from c3DataMigration.c3Helpers import c3ParallelGzip
 from c3DataMigration.c3Helpers import c3Request
+from c3DataMigration.c3Helpers import c3ScanManifest
 from c3DataMigration.c3Helpers import c3UtilityMethods
 
 
 
 
 def getRemoteFileSystemInstance (r, p):
-  url = c3Request.generateTypeActionURL(r, 'FileSystem', 'inst')
-  errorCodePrefix = 'Unsuccessful retrieving instance of FileSystem'
-  request = c3Request.makeRequest(r, p.errorSleepTimeSeconds, url, None, errorCodePrefix)
-  fileSystemInstance = ET.ElementTree(ET.fromstring(request.text)).getroot().find('./type/name').text
+  fileSystemInstance = c3EnvMetadata.getRunMetadata('fileSystemType')
+  if (fileSystemInstance == None):
+    url = c3Request.generateTypeActionURL(r, 'FileSystem', 'inst')
+    errorCodePrefix = 'Unsuccessful retrieving instance of FileSystem'
+    request = c3Request.makeRequest(r, p.errorSleepTimeSeconds, url, None, errorCodePrefix)
+    fileSystemInstance = ET.ElementTree(ET.fromstring(request.text)).getroot().find('./type/name').text
+    c3EnvMetadata.setRunMetadata('fileSystemType', fileSystemInstance)
 
   return fileSystemInstance
 
 
 
 def getRemoteRootURL (r, p):
-  fileSystemInstance = getRemoteFileSystemInstance(r, p)
-  url = c3Request.generateTypeActionURL(r, fileSystemInstance, 'rootUrl')
-  payload = {
-    'this': {}
-  }
-  errorCodePrefix = 'Unsuccessful root url of FileSystem'
-  request = c3Request.makeRequest(r, p.errorSleepTimeSeconds, url, payload, errorCodePrefix)
-  rootURL = c3Request.parseXMLValueFromString(request.text, 'rootUrlResponse')
+  rootURL = c3EnvMetadata.getRunMetadata('rootUrl')
+  if (rootURL == None):
+    fileSystemInstance = getRemoteFileSystemInstance(r, p)
+    url = c3Request.generateTypeActionURL(r, fileSystemInstance, 'rootUrl')
+    payload = {
+      'this': {}
+    }
+    errorCodePrefix = 'Unsuccessful root url of FileSystem'
+    request = c3Request.makeRequest(r, p.errorSleepTimeSeconds, url, payload, errorCodePrefix)
+    rootURL = c3Request.parseXMLValueFromString(request.text, 'rootUrlResponse')
+    c3EnvMetadata.setRunMetadata('rootUrl', rootURL)
 
   return rootURL
 
@@ -118,47 +131,285 @@ def getLocalFilePathsWithinDirectory (directory, optionalFileExtension=None):
 
 
 
-def unzipC3JsonTypeFile (fullFilePath, stripMetadataAndDerived, fieldLabelMap, deleteZipFile=True):
-  records = []
-  try:
-    with gzip.open(fullFilePath, 'rb') as gzipFile:
-      gzipFileContents = gzipFile.read()
-      records = json.loads(gzipFileContents.decode('utf-8'))['data']
-  except:
-    with open(fullFilePath, 'rb') as gzipFile:
-      gzipFileContents = gzipFile.read()
-      records = json.loads(gzipFileContents.decode('utf-8'))['data']
+def _stripRecordsWhileStreaming (records, fieldLabelMap):
+  for record in records:
+    c3UtilityMethods.stripMetaAndDerivedFieldsFromRecords([record], fieldLabelMap)
+    yield record
+
+
+
+
+def _hashIdsWhileStreaming (records, idHashes):
+  for record in records:
+    idHashes.append(c3ScanManifest.hashId(record['id']))
+    yield record
+
 
+
+
+def _writeExtractedRecords (textChunks, stripMetadataAndDerived, fieldLabelMap, extractedJsonFile, idHashes, localDataFormat):
+  records = c3JsonStream.iterateJsonArrayRecords(textChunks, 'data')
   if (stripMetadataAndDerived == True):
-    c3UtilityMethods.stripMetaAndDerivedFieldsFromRecords(records, fieldLabelMap)
+    records = _stripRecordsWhileStreaming(records, fieldLabelMap)
+  c3JsonStream.writeLocalRecords(extractedJsonFile, _hashIdsWhileStreaming(records, idHashes), localDataFormat)
+
+
+
+
+def _streamUnzipC3JsonTypeFile (fullFilePath, stripMetadataAndDerived, fieldLabelMap, extractedJsonFile, idHashes, localDataFormat):
+  with c3JsonStream.openTextFile(fullFilePath) as gzipFile:
+    _writeExtractedRecords(c3JsonStream.readTextChunks(gzipFile), stripMetadataAndDerived, fieldLabelMap, extractedJsonFile, idHashes, localDataFormat)
+
+
+
 
+def _extractC3JsonTypeFile (fullFilePath, stripMetadataAndDerived, fieldLabelMap, streamRecords, localDataFormat, idBufferBytes=c3ScanManifest.ID_BUFFER_BYTES):
+  # Returns the content hash & id hashes of the extracted file, collected while it is written
+  contentHash = hashlib.sha1()
+  idHashes = c3ScanManifest.IdDigestWriter(idBufferBytes)
   with open(fullFilePath[:-len('.gz')], 'w') as extractedJsonFile:
-    json.dump(records, extractedJsonFile, sort_keys=True, indent=2)
-  
-  if (deleteZipFile == True):
-    deleteLocalFiles([fullFilePath])
+    hashingJsonFile = c3ScanManifest.HashingTextWriter(extractedJsonFile, contentHash)
+    if (streamRecords == True):
+      _streamUnzipC3JsonTypeFile(fullFilePath, stripMetadataAndDerived, fieldLabelMap, hashingJsonFile, idHashes, localDataFormat)
+      return contentHash, idHashes
 
+    records = []
+    try:
+      with gzip.open(fullFilePath, 'rb') as gzipFile:
+        gzipFileContents = gzipFile.read()
+        records = json.loads(gzipFileContents.decode('utf-8'))['data']
+    except:
+      with open(fullFilePath, 'rb') as gzipFile:
+        gzipFileContents = gzipFile.read()
+        records = json.loads(gzipFileContents.decode('utf-8'))['data']
 
+    if (stripMetadataAndDerived == True):
+      c3UtilityMethods.stripMetaAndDerivedFieldsFromRecords(records, fieldLabelMap)
+
+    idHashes.extend(c3ScanManifest.hashId(x['id']) for x in records)
+    c3JsonStream.writeLocalRecords(hashingJsonFile, records, localDataFormat)
+
+  return contentHash, idHashes
+
+
+
+
+def unzipAndScanC3JsonTypeFile (directory, c3Type, fullFilePath, stripMetadataAndDerived, fieldLabelMap, streamRecords=False, localDataFormat='prettyJson', idBufferBytes=c3ScanManifest.ID_BUFFER_BYTES):
+  # Extracts the .gz next to itself & hands back the scan manifest entry of the extracted file, so it never gets re-read
+  contentHash, idHashes = _extractC3JsonTypeFile(fullFilePath, stripMetadataAndDerived, fieldLabelMap, streamRecords, localDataFormat, idBufferBytes)
+  extractedFilePath = fullFilePath[:-len('.gz')]
+  deleteLocalFiles([fullFilePath])
+
+  return c3ScanManifest.createManifestEntry(directory, c3Type, extractedFilePath, os.stat(extractedFilePath), contentHash, idHashes)
+
+
+
+
+def extractC3JsonTypeStream (directory, c3Type, byteChunks, extractedFilePath, stripMetadataAndDerived, fieldLabelMap, localDataFormat='prettyJson', idBufferBytes=c3ScanManifest.ID_BUFFER_BYTES):
+  # Same output & scan manifest entry as unzipAndScanC3JsonTypeFile, straight from the (possibly gzipped) bytes of an export file
+  contentHash = hashlib.sha1()
+  idHashes = c3ScanManifest.IdDigestWriter(idBufferBytes)
+  with open(extractedFilePath, 'w') as extractedJsonFile:
+    textChunks = c3JsonStream.decodeTextChunks(c3JsonStream.decompressByteChunks(byteChunks))
+    _writeExtractedRecords(textChunks, stripMetadataAndDerived, fieldLabelMap, c3ScanManifest.HashingTextWriter(extractedJsonFile, contentHash), idHashes, localDataFormat)
+
+  return c3ScanManifest.createManifestEntry(directory, c3Type, extractedFilePath, os.stat(extractedFilePath), contentHash, idHashes)
+
+
+
+
+_workerFieldLabelMap = None
+def _initFieldLabelMapWorker (fieldLabelMap):
+  global _workerFieldLabelMap
+  _workerFieldLabelMap = fieldLabelMap # Shipped once per worker per type rather than once per file
+
+
+
+
+def _unzipAndScanC3JsonTypeFileWorker (directory, c3Type, fullFilePath, stripMetadataAndDerived, streamRecords, localDataFormat, idBufferBytes):
+  return unzipAndScanC3JsonTypeFile(directory, c3Type, fullFilePath, stripMetadataAndDerived, _workerFieldLabelMap, streamRecords, localDataFormat, idBufferBytes)
+
+
+
+
+def scanAndZipC3JsonTypeFile (directory, c3Type, fullFilePath, stripMetadataAndDerived, fieldLabelMap, compressionLevel=6, compressionThreads=1, idBufferBytes=c3ScanManifest.ID_BUFFER_BYTES):
+  # Counts, hashes ids, strips & gzips in the one read of the file, the .gz holds the records as one JSON array
+  with c3ParallelGzip.ParallelGzipFile(fullFilePath + '.gz', compressionLevel, compressionThreads) as gzipFile:
+    state = { 'separator': '[' }
+    def writeRecord (record):
+      if (stripMetadataAndDerived == True):
+        c3UtilityMethods.stripMetaAndDerivedFieldsFromRecords([record], fieldLabelMap)
+      gzipFile.write(state['separator'] + json.dumps(record))
+      state['separator'] = ', '
+
+    manifestEntry = c3ScanManifest.scanFile(directory, c3Type, fullFilePath, writeRecord, idBufferBytes)
+    gzipFile.write('[]' if (state['separator'] == '[') else ']')
+
+  return manifestEntry
+
+
+
+
+def iterateGzippedC3JsonTypeFile (fullFilePath, stripMetadataAndDerived, fieldLabelMap, chunkSizeBytes=c3JsonStream.CHUNK_SIZE, compressionLevel=6, compressionThreads=1):
+  # Same bytes (once decompressed) as scanAndZipC3JsonTypeFile writes, produced piece by piece for a streamed request body
+  compressor = c3ParallelGzip.ParallelGzipCompressor(compressionLevel, compressionThreads)
+  pendingChunks = []
+  pendingSize = 0
+  separator = '['
+
+  with c3JsonStream.openTextFile(fullFilePath) as jsonFile:
+    for record in c3JsonStream.iterateLocalRecords(c3JsonStream.readTextChunks(jsonFile)):
+      if (stripMetadataAndDerived == True):
+        c3UtilityMethods.stripMetaAndDerivedFieldsFromRecords([record], fieldLabelMap)
+      compressedChunk = compressor.compress((separator + json.dumps(record)).encode('utf-8'))
+      separator = ', '
+      if (len(compressedChunk) > 0):
+        pendingChunks.append(compressedChunk)
+        pendingSize += len(compressedChunk)
+      if (pendingSize >= chunkSizeBytes):
+        yield b''.join(pendingChunks)
+        pendingChunks = []
+        pendingSize = 0
+
+  pendingChunks.append(compressor.compress(b'[]' if (separator == '[') else b']'))
+  pendingChunks.append(compressor.flush())
+  yield b''.join(pendingChunks)
+
+
+
+
+def _scanAndZipC3JsonTypeFileWorker (directory, c3Type, fullFilePath, stripMetadataAndDerived, compressionLevel, compressionThreads, idBufferBytes):
+  return scanAndZipC3JsonTypeFile(directory, c3Type, fullFilePath, stripMetadataAndDerived, _workerFieldLabelMap, compressionLevel, compressionThreads, idBufferBytes)
+
+
+
+
+def reshardC3JsonTypeFiles (dataTypeFolder, filePaths, recordsPerShard, stripMetadataAndDerived, fieldLabelMap, compressionLevel=6, compressionThreads=1):
+  # Re-packs the records of every file into gzipped shards of recordsPerShard records each, in file order
+  shardFilePaths = []
+  shardFile = None
+  numRecordsInShard = 0
+  try:
+    for filePath in sorted(filePaths):
+      with c3JsonStream.openTextFile(filePath) as jsonFile:
+        for record in c3JsonStream.iterateLocalRecords(c3JsonStream.readTextChunks(jsonFile)):
+          if ((shardFile == None) or (numRecordsInShard >= recordsPerShard)):
+            if (shardFile != None):
+              shardFile.write(']')
+              shardFile.close()
+            shardFilePaths.append(c3ImportSharding.getShardFilePath(dataTypeFolder, len(shardFilePaths)))
+            shardFile = c3ParallelGzip.ParallelGzipFile(shardFilePaths[-1], compressionLevel, compressionThreads)
+            numRecordsInShard = 0
+          if (stripMetadataAndDerived == True):
+            c3UtilityMethods.stripMetaAndDerivedFieldsFromRecords([record], fieldLabelMap)
+          shardFile.write(('[' if (numRecordsInShard == 0) else ', ') + json.dumps(record))
+          numRecordsInShard += 1
+  finally:
+    if (shardFile != None):
+      shardFile.write(']')
+      shardFile.close()
+
+  return shardFilePaths
+
+
+
+
+def reshardFilesInDirectory (r, p, uploadsDirectory, dataTypes):
+  # Runs after scanFilesInDirectory, so the record counts & duplicate checks are already there
+  for dataType in dataTypes:
+    c3Type = dataType[0]
+    dataTypeFilesLocationFolder = '/'.join([uploadsDirectory, c3Type])
+    dataType[1]['gzipFiles'] = []
+
+    if (dataType[1]['uploadData'] != True):
+      c3UtilityMethods.printFormatExtraPeriods('Resharding ' + c3Type, 'UPLOAD FLAG IS FALSE', p.maxColumnPrintLength, True)
+      continue
+
+    fullFilePaths = dataType[1].get('files', [])
+    if (dataType[1].get('recordCount', 0) == 0):
+      c3UtilityMethods.printFormatExtraPeriods('Resharding ' + c3Type, 'NO IMPORT FILES', p.maxColumnPrintLength, True)
+      continue
+
+    fieldLabelMap = None
+    if (p.stripMetadataAndDerived == True):
+      fieldLabelMap = c3UtilityMethods.retrieveLabeledFields(r, c3Type, p.errorSleepTimeSeconds, p.schemaCacheTTLSeconds)
+
+    recordsPerShard = c3ImportSharding.planRecordsPerShard(p, fullFilePaths, dataType[1]['recordCount'])
+    dataType[1]['gzipFiles'] = reshardC3JsonTypeFiles(dataTypeFilesLocationFolder, fullFilePaths, recordsPerShard, p.stripMetadataAndDerived, fieldLabelMap, p.compressionLevel, c3ParallelGzip.resolveCompressionThreads(p.compressionThreads, 1))
+    suffix = '{:,}'.format(len(fullFilePaths)) + ' FILES -> ' + '{:,}'.format(len(dataType[1]['gzipFiles'])) + ' SHARDS OF ' + '{:,}'.format(recordsPerShard)
+    c3UtilityMethods.printFormatExtraPeriods('Resharding ' + c3Type, suffix, p.maxColumnPrintLength, True)
 
 
-def zipC3JsonTypeFile (fullFilePath, stripMetadataAndDerived, fieldLabelMap, deleteJSONFile=False):
-  records = []
-  with open(fullFilePath, 'r') as jsonFile:
-    records = json.load(jsonFile)
 
-  if (stripMetadataAndDerived == True):
-    c3UtilityMethods.stripMetaAndDerivedFieldsFromRecords(records, fieldLabelMap)
 
-  with gzip.open(fullFilePath + '.gz', 'w') as gzipFile:
-    gzipFile.write(json.dumps(records).encode('utf-8'))
+def _mayContainIds (directory, c3Type, manifest, filePath, idHashes):
+  # The scan manifest's id digest rules out most local files without opening them
+  manifestEntry = manifest.get(os.path.basename(filePath))
+  if ((manifestEntry == None) or (not c3ScanManifest.isManifestEntryCurrent(manifestEntry, os.stat(filePath)))):
+    return True
+  idDigestPath = c3ScanManifest.getIdDigestPath(directory, c3Type, manifestEntry)
+  return ((not os.path.exists(idDigestPath)) or c3ScanManifest.idDigestContainsAny(idDigestPath, idHashes, c3JsonStream.CHUNK_SIZE))
 
-  if (deleteJSONFile == True):
-    deleteLocalFiles([fullFilePath])
+
+
+
+def _removeRecordsWithIds (filePath, recordIds, localDataFormat):
+  numRemoved = [0]
+  def keepRecords (records):
+    for record in records:
+      if (record['id'] in recordIds):
+        numRemoved[0] += 1
+        continue
+      yield record
+
+  tempFilePath = filePath + '.tmp'
+  with c3JsonStream.openTextFile(filePath) as jsonFile:
+    with open(tempFilePath, 'w') as tempJsonFile:
+      numKept = c3JsonStream.writeLocalRecords(tempJsonFile, keepRecords(c3JsonStream.iterateLocalRecords(c3JsonStream.readTextChunks(jsonFile))), localDataFormat)
+
+  if (numRemoved[0] == 0):
+    deleteLocalFiles([tempFilePath])
+  elif (numKept == 0):
+    deleteLocalFiles([tempFilePath, filePath])
+  else:
+    os.replace(tempFilePath, filePath)
+
+  return numRemoved[0]
+
+
+
+
+def mergeDeltaFilesIntoDirectory (deltaDirectory, directory, c3Type, localDataFormat='prettyJson'):
+  # Records of the delta replace the local records with the same id, every other local record is left as is
+  deltaFilePaths = getLocalFilePathsWithinDirectory('/'.join([deltaDirectory, c3Type]), '.json')
+  dataTypeFolder = '/'.join([directory, c3Type])
+  Path(dataTypeFolder).mkdir(parents=True, exist_ok=True)
+
+  deltaIds = set()
+  for deltaFilePath in deltaFilePaths:
+    deltaIds.update(c3ScanManifest.iterateRecordIds(deltaFilePath))
+  deltaIdHashes = set(c3ScanManifest.hashId(x) for x in deltaIds)
+
+  numReplaced = 0
+  if (len(deltaIds) > 0):
+    manifest = c3ScanManifest.loadManifest(directory, c3Type)
+    for filePath in getLocalFilePathsWithinDirectory(dataTypeFolder, '.json'):
+      if (_mayContainIds(directory, c3Type, manifest, filePath, deltaIdHashes)):
+        numReplaced += _removeRecordsWithIds(filePath, deltaIds, localDataFormat)
+
+  fileNamePrefix = 'delta_' + datetime.now().strftime('%Y%m%d%H%M%S') + '_'
+  for deltaFilePath in deltaFilePaths:
+    os.replace(deltaFilePath, '/'.join([dataTypeFolder, fileNamePrefix + os.path.basename(deltaFilePath)]))
+
+  return len(deltaIds), numReplaced
 
 
 
 
 def unzipFilesInDirectory (r, p, downloadsDirectory, c3Types):
+  c3TypesWithFiles = [x for x in c3Types if (len(getLocalFilePathsWithinDirectory('/'.join([downloadsDirectory, x]), '.gz')) > 0)]
+  c3UtilityMethods.retrieveLabeledFieldsForTypes(r, c3TypesWithFiles, p.errorSleepTimeSeconds, p.schemaCacheTTLSeconds)
+
   for c3Type in c3Types:
     dataTypeFilesLocationFolder = '/'.join([downloadsDirectory, c3Type])
 
@@ -168,74 +419,89 @@ def unzipFilesInDirectory (r, p, downloadsDirectory, c3Types):
         c3UtilityMethods.printFormatExtraPeriods('Extracting ' + c3Type, 'NO EXPORT FILES', p.maxColumnPrintLength, True)
         continue
 
-      fieldLabelMap = c3UtilityMethods.retrieveLabeledFields(r, c3Type, p.errorSleepTimeSeconds)
+      fieldLabelMap = c3UtilityMethods.retrieveLabeledFields(r, c3Type, p.errorSleepTimeSeconds, p.schemaCacheTTLSeconds)
 
       result = c3UtilityMethods.printFormatExtraPeriods('Extracting ' + c3Type, ' |████████████████████████████████|', p.maxColumnPrintLength, False)
       progressBar = IncrementalBar(''.join(result[:2]), max=len(fullFilePaths))
-      for fullFilePath in fullFilePaths:
-        unzipC3JsonTypeFile(fullFilePath, p.stripMetadataAndDerived, fieldLabelMap, True)
-        [progressBar.next() for _ in range(1)]
+      idBufferBytes = c3ScanManifest.getIdBufferBytes(p.duplicateScanMemoryMB, p.numProcessWorkers)
+      listOfArgs = [(downloadsDirectory, c3Type, x, p.stripMetadataAndDerived, p.streamJsonExtraction, p.localDataFormat, idBufferBytes) for x in fullFilePaths]
+      manifestEntries = c3UtilityMethods.runInProcessPool(p.numProcessWorkers, _unzipAndScanC3JsonTypeFileWorker, listOfArgs, progressBar, _initFieldLabelMapWorker, (fieldLabelMap,))
       progressBar.finish()
+
+      # Scanning the download folder afterwards finds every file already in the manifest
+      manifest = c3ScanManifest.loadManifest(downloadsDirectory, c3Type)
+      manifest.update({ os.path.basename(x[:-len('.gz')]): y for x, y in zip(fullFilePaths, manifestEntries) })
+      c3ScanManifest.saveManifest(downloadsDirectory, c3Type, manifest)
     else:
       c3UtilityMethods.printFormatExtraPeriods('Extracting ' + c3Type, 'EXPORT JOB FAILED', p.maxColumnPrintLength, True)
 
 
 
 
-def zipFilesInDirectory (r, p, uploadsDirectory, dataTypes):
-  for dataType in dataTypes:
-    c3Type = dataType[0]
-    dataTypeFilesLocationFolder = '/'.join([uploadsDirectory, c3Type])
+def _confirmDuplicateIds (filePaths, candidateIdHashes):
+  # Id hashes can collide, so candidates are confirmed against the real ids of only the files that contain them
+  idCounts = {}
+  for filePath in filePaths:
+    for recordId in c3ScanManifest.iterateRecordIds(filePath):
+      if (c3ScanManifest.hashId(recordId) in candidateIdHashes):
+        idCounts[recordId] = idCounts.get(recordId, 0) + 1
 
-    if (dataType[1]['uploadData'] != True):
-      c3UtilityMethods.printFormatExtraPeriods('Zipping ' + c3Type, 'UPLOAD FLAG IS FALSE', p.maxColumnPrintLength, True)
-      continue
+  return [x for x, y in idCounts.items() if (y > 1)]
 
-    if (os.path.isdir(dataTypeFilesLocationFolder)):
-      fullFilePaths = getLocalFilePathsWithinDirectory(dataTypeFilesLocationFolder, '.json')
-      if (len(fullFilePaths) == 0):
-        c3UtilityMethods.printFormatExtraPeriods('Zipping ' + c3Type, 'NO IMPORT FILES', p.maxColumnPrintLength, True)
-        continue
 
-      fieldLabelMap = c3UtilityMethods.retrieveLabeledFields(r, c3Type, p.errorSleepTimeSeconds)
 
-      result = c3UtilityMethods.printFormatExtraPeriods('Zipping ' + c3Type, ' |████████████████████████████████|', p.maxColumnPrintLength, False)
-      progressBar = IncrementalBar(''.join(result[:2]), max=len(fullFilePaths))
-      for fullFilePath in fullFilePaths:
-        zipC3JsonTypeFile(fullFilePath, p.stripMetadataAndDerived, fieldLabelMap, False)
-        [progressBar.next() for _ in range(1)]
-      progressBar.finish()
-    else:
-      c3UtilityMethods.printFormatExtraPeriods('Zipping ' + c3Type, 'NO IMPORT FOLDER', p.maxColumnPrintLength, True)
 
+def _formatScanLine (c3Type, maxColumnPrintLength, fileCount, recordCount):
+  fileStringPartsStringArr = c3UtilityMethods.printFormatExtraPeriods('Files:', '{:,}'.format(fileCount), 13, False)
+  fileString = fileStringPartsStringArr[0] + (' ' * len(fileStringPartsStringArr[1])) + fileStringPartsStringArr[2]
+  totalRecordPartsStringArr = c3UtilityMethods.printFormatExtraPeriods('Records:', '{:,}'.format(recordCount), 19, False)
+  totalRecordString = totalRecordPartsStringArr[0] + (' ' * len(totalRecordPartsStringArr[1])) + totalRecordPartsStringArr[2]
+  suffixString = fileString + ' / ' +  totalRecordString
+  return ''.join(c3UtilityMethods.printFormatExtraPeriods('Scanning ' + c3Type, suffixString, maxColumnPrintLength, False))
+
+
+
+
+def _getDuplicateIdsFromManifest (directory, c3Type, filePaths, manifest, memoryCeilingMB):
+  memoryCeilingBytes = int(memoryCeilingMB * 1024 * 1024)
+  idDigestPathsByFile = { x: c3ScanManifest.getIdDigestPath(directory, c3Type, manifest[os.path.basename(x)]) for x in filePaths if (os.path.basename(x) in manifest) }
+  dupes = c3ScanManifest.findDuplicateIdHashes(list(idDigestPathsByFile.values()), memoryCeilingBytes)
+
+  duplicateIds = []
+  if (len(dupes) > 0):
+    filePathsWithDupes = [x for x, y in idDigestPathsByFile.items() if c3ScanManifest.idDigestContainsAny(y, dupes, memoryCeilingBytes)]
+    duplicateIds = _confirmDuplicateIds(filePathsWithDupes, dupes)
+
+  return duplicateIds
 
 
 
-def getCountOfRecordsAndDuplicatesAcrossFiles (c3Type, maxColumnPrintLength, filePaths, outputLines):
-  def _printHelper (idx, total):
-    fileStringPartsStringArr = c3UtilityMethods.printFormatExtraPeriods('Files:', '{:,}'.format(idx), 13, False)
-    fileString = fileStringPartsStringArr[0] + (' ' * len(fileStringPartsStringArr[1])) + fileStringPartsStringArr[2]
-    totalRecordPartsStringArr = c3UtilityMethods.printFormatExtraPeriods('Records:', '{:,}'.format(total), 19, False)
-    totalRecordString = totalRecordPartsStringArr[0] + (' ' * len(totalRecordPartsStringArr[1])) + totalRecordPartsStringArr[2]
-    suffixString = fileString + ' / ' +  totalRecordString
-    outputLines[-1] = ''.join(c3UtilityMethods.printFormatExtraPeriods('Scanning ' + c3Type, suffixString, maxColumnPrintLength, False))
 
-  seen, dupes = set(), set()
+def _exitIfDuplicateIds (p, c3Type, duplicateIds, outputLines=None):
+  string = 'Exiting script. ' + c3Type + ' has duplicate ids: ' + str(duplicateIds)
+  errorLines = c3UtilityMethods.printFormatWrapMaxColumnLength(string, p.maxColumnPrintLength, (outputLines == None))
+  if (outputLines != None):
+    for errorLine in errorLines:
+      outputLines.append(errorLine)
+  exit(0)
+
+
+
+
+def getCountOfRecordsAndDuplicatesAcrossFiles (c3Type, maxColumnPrintLength, filePaths, outputLines, directory, memoryCeilingMB=256):
+  oldManifest = c3ScanManifest.loadManifest(directory, c3Type)
+  newManifest = {}
   total = 0
-  _printHelper(0, 0)
+  outputLines[-1] = _formatScanLine(c3Type, maxColumnPrintLength, 0, 0)
   for idx, filePath in enumerate(filePaths):
     if (os.path.exists(filePath) and Path(filePath).is_file()):
-      with open(filePath) as jsonFile:
-        jsonContents = json.load(jsonFile)
-        total += len(jsonContents)
-        for x in jsonContents:
-          if x['id'] in seen:
-            dupes.add(x['id'])
-          else:
-            seen.add(x['id'])
-      _printHelper(idx + 1, total)
+      manifestEntry = c3ScanManifest.getScanManifestEntry(directory, c3Type, oldManifest, filePath, c3ScanManifest.getIdBufferBytes(memoryCeilingMB, 1))
+      newManifest[os.path.basename(filePath)] = manifestEntry
+      total += manifestEntry['recordCount']
+      outputLines[-1] = _formatScanLine(c3Type, maxColumnPrintLength, idx + 1, total)
+  c3ScanManifest.saveManifest(directory, c3Type, newManifest)
 
-  return total, list(dupes)
+  return total, _getDuplicateIdsFromManifest(directory, c3Type, filePaths, newManifest, memoryCeilingMB)
 
 
 
@@ -258,15 +524,104 @@ def scanFilesInDirectory (p, dataTypes, directory, failScriptIfDuplicates=True):
       fullFilePaths = getLocalFilePathsWithinDirectory(dataTypeUploadFolder, '.json')
       gzipFilePaths = getLocalFilePathsWithinDirectory(dataTypeUploadFolder, '.gz')
       outputLines.append('')
-      totalRecordCount, duplicateIds = getCountOfRecordsAndDuplicatesAcrossFiles(c3Type, p.maxColumnPrintLength, fullFilePaths, outputLines)
+      totalRecordCount, duplicateIds = getCountOfRecordsAndDuplicatesAcrossFiles(c3Type, p.maxColumnPrintLength, fullFilePaths, outputLines, directory, p.duplicateScanMemoryMB)
 
       if ((len(duplicateIds) > 0) and failScriptIfDuplicates):
-        string = 'Exiting script. ' + c3Type + ' has duplicate ids: ' + str(duplicateIds)
-        errorLines = c3UtilityMethods.printFormatWrapMaxColumnLength(string, p.maxColumnPrintLength, False)
-        for errorLine in errorLines:
-          outputLines.append(errorLine)
-        exit(0)
+        _exitIfDuplicateIds(p, c3Type, duplicateIds, outputLines)
 
       dataType[1]['files'] = fullFilePaths
       dataType[1]['gzipFiles'] = gzipFilePaths
       dataType[1]['recordCount'] = totalRecordCount
+
+
+
+
+def _getGzipSettingsKey (stripMetadataAndDerived, fieldLabelMap, compressionLevel):
+  # Everything besides the file itself that changes what gets zipped from it
+  gzipSettings = [stripMetadataAndDerived, fieldLabelMap if (stripMetadataAndDerived == True) else None, compressionLevel]
+  return hashlib.sha1(json.dumps(gzipSettings, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+
+
+def _recordGzipFile (manifestEntry, gzipFilePath, gzipSettingsKey):
+  gzipFileStat = os.stat(gzipFilePath)
+  manifestEntry['gzip'] = {
+    'settingsKey': gzipSettingsKey,
+    'size':        gzipFileStat.st_size,
+    'mtimeNs':     gzipFileStat.st_mtime_ns,
+  }
+
+
+
+
+def _isGzipFileCurrent (manifestEntry, gzipFilePath, gzipSettingsKey):
+  # The .gz zipped last time is reused as long as the settings match & nothing touched it since
+  gzipEntry = manifestEntry.get('gzip')
+  if ((gzipEntry == None) or (gzipEntry['settingsKey'] != gzipSettingsKey) or (not os.path.exists(gzipFilePath))):
+    return False
+  gzipFileStat = os.stat(gzipFilePath)
+
+  return ((gzipEntry['size'] == gzipFileStat.st_size) and (gzipEntry['mtimeNs'] == gzipFileStat.st_mtime_ns))
+
+
+
+
+def scanAndZipFilesInDirectory (r, p, uploadsDirectory, dataTypes, failScriptIfDuplicates=True):
+  c3TypesWithFiles = [x[0] for x in dataTypes if ((x[1]['uploadData'] == True) and (len(getLocalFilePathsWithinDirectory('/'.join([uploadsDirectory, x[0]]), '.json')) > 0))]
+  c3UtilityMethods.retrieveLabeledFieldsForTypes(r, c3TypesWithFiles, p.errorSleepTimeSeconds, p.schemaCacheTTLSeconds)
+
+  for dataType in dataTypes:
+    c3Type = dataType[0]
+    dataTypeFilesLocationFolder = '/'.join([uploadsDirectory, c3Type])
+
+    if (dataType[1]['uploadData'] != True):
+      c3UtilityMethods.printFormatExtraPeriods('Scanning & zipping ' + c3Type, 'UPLOAD FLAG IS FALSE', p.maxColumnPrintLength, True)
+      continue
+
+    fullFilePaths = getLocalFilePathsWithinDirectory(dataTypeFilesLocationFolder, '.json')
+    dataType[1]['files'] = fullFilePaths
+    dataType[1]['recordCount'] = 0
+
+    # Only the .gz files of the .json files still in the folder can be reused
+    keptGzipFilePaths = set(x + '.gz' for x in fullFilePaths)
+    deleteLocalFiles([x for x in getLocalFilePathsWithinDirectory(dataTypeFilesLocationFolder, '.gz') if (x not in keptGzipFilePaths)])
+
+    if (len(fullFilePaths) == 0):
+      c3UtilityMethods.printFormatExtraPeriods('Scanning & zipping ' + c3Type, 'NO IMPORT FILES', p.maxColumnPrintLength, True)
+      continue
+
+    fieldLabelMap = c3UtilityMethods.retrieveLabeledFields(r, c3Type, p.errorSleepTimeSeconds, p.schemaCacheTTLSeconds)
+    gzipSettingsKey = _getGzipSettingsKey(p.stripMetadataAndDerived, fieldLabelMap, p.compressionLevel)
+
+    # Unchanged files keep their manifest entry & .gz, the rest get scanned & zipped again
+    oldManifest = c3ScanManifest.loadManifest(uploadsDirectory, c3Type)
+    manifest = {}
+    filePathsToZip = []
+    for filePath in fullFilePaths:
+      manifestEntry = c3ScanManifest.getCurrentManifestEntry(uploadsDirectory, c3Type, oldManifest, filePath)
+      if ((manifestEntry != None) and _isGzipFileCurrent(manifestEntry, filePath + '.gz', gzipSettingsKey)):
+        manifest[os.path.basename(filePath)] = manifestEntry
+      else:
+        filePathsToZip.append(filePath)
+
+    result = c3UtilityMethods.printFormatExtraPeriods('Scanning & zipping ' + c3Type, ' |████████████████████████████████|', p.maxColumnPrintLength, False)
+    progressBar = IncrementalBar(''.join(result[:2]), max=len(fullFilePaths))
+    progressBar.next(len(fullFilePaths) - len(filePathsToZip))
+    idBufferBytes = c3ScanManifest.getIdBufferBytes(p.duplicateScanMemoryMB, p.numProcessWorkers)
+    compressionThreads = c3ParallelGzip.resolveCompressionThreads(p.compressionThreads, p.numProcessWorkers)
+    listOfArgs = [(uploadsDirectory, c3Type, x, p.stripMetadataAndDerived, p.compressionLevel, compressionThreads, idBufferBytes) for x in filePathsToZip]
+    manifestEntries = c3UtilityMethods.runInProcessPool(p.numProcessWorkers, _scanAndZipC3JsonTypeFileWorker, listOfArgs, progressBar, _initFieldLabelMapWorker, (fieldLabelMap,))
+    progressBar.finish()
+
+    for filePath, manifestEntry in zip(filePathsToZip, manifestEntries):
+      _recordGzipFile(manifestEntry, filePath + '.gz', gzipSettingsKey)
+      manifest[os.path.basename(filePath)] = manifestEntry
+    c3ScanManifest.saveManifest(uploadsDirectory, c3Type, manifest)
+    dataType[1]['recordCount'] = sum(x['recordCount'] for x in manifest.values())
+    dataType[1]['gzipFiles'] = [x + '.gz' for x in fullFilePaths]
+    print(_formatScanLine(c3Type, p.maxColumnPrintLength, len(fullFilePaths), dataType[1]['recordCount']))
+
+    duplicateIds = _getDuplicateIdsFromManifest(uploadsDirectory, c3Type, fullFilePaths, manifest, p.duplicateScanMemoryMB)
+    if ((len(duplicateIds) > 0) and failScriptIfDuplicates):
+      _exitIfDuplicateIds(p, c3Type, duplicateIds)
@@ -0,0 +1,37 @@
+__author__ = 'Jackson DeDobbelaere'
+__credits__ = ['Jackson DeDobbelaere']
+__maintainer__ = 'Jackson DeDobbealere'
+__email__ = 'jackson.dedobbelaere@c3.ai'
+
+
+#!/usr/bin/env python3
+import math
+import os
+
+
+
+
+shardFileNamePrefix = 'shard_'
+_minShardSizeBytes = 1024 * 1024
+
+
+
+
+def planRecordsPerShard (p, filePaths, recordCount):
+  # Every shard gets the same number of records, enough shards that none goes over the byte or record cap
+  if (recordCount <= 0):
+    return 1
+  totalBytes = sum(os.path.getsize(x) for x in filePaths)
+
+  numShards = max(math.ceil(totalBytes / (p.importShardSizeMB * 1024 * 1024)), math.ceil(recordCount / p.maxImportShardRecords))
+
+  # Small types still get one shard per upload thread, so the import map-reduce has files to spread across its workers
+  numShards = max(numShards, min(p.maxConcurrentUploads, math.floor(totalBytes / _minShardSizeBytes)), 1)
+
+  return math.ceil(recordCount / min(numShards, recordCount))
+
+
+
+
+def getShardFilePath (dataTypeFolder, shardIdx):
+  return '/'.join([dataTypeFolder, shardFileNamePrefix + str(shardIdx) + '.json.gz'])
@@ -0,0 +1,70 @@
+__author__ = 'Jackson DeDobbelaere'
+__credits__ = ['Jackson DeDobbelaere']
+__maintainer__ = 'Jackson DeDobbealere'
+__email__ = 'jackson.dedobbelaere@c3.ai'
+
+
+#!/usr/bin/env python3
+import asyncio
+
+
+
+
+def isBatchJobRunning (c3TypeToBatchJob):
+  return ((c3TypeToBatchJob[1]['id'] != None) and (c3TypeToBatchJob[1]['status'] in ['submitted', 'running']))
+
+
+
+
+async def _monitorBatchJobsAsync (p, c3TypeToBatchJobMapping, pollJobs, renderStatuses, onJobComplete, scheduleJobs):
+  loop = asyncio.get_event_loop()
+  pollSchedules = {} # batchJobId -> [nextPollTime, currentInterval]
+  pendingCallbacks = []
+
+  while True:
+    # scheduleJobs may append new jobs to the mapping, which is re-read every time around
+    moreJobsToCome = (scheduleJobs != None) and (await loop.run_in_executor(None, scheduleJobs))
+    jobsStillRunning = [x for x in c3TypeToBatchJobMapping if isBatchJobRunning(x)]
+    if (len(jobsStillRunning) == 0):
+      if (not moreJobsToCome):
+        break
+      await asyncio.sleep(p.initialPollTimeSeconds)
+      renderStatuses()
+      continue
+
+    # Every job starts out polled quickly and backs off towards refreshPollTimeSeconds the longer it runs
+    for c3TypeToBatchJob in jobsStillRunning:
+      if (c3TypeToBatchJob[1]['id'] not in pollSchedules):
+        pollSchedules[c3TypeToBatchJob[1]['id']] = [loop.time() + p.initialPollTimeSeconds, p.initialPollTimeSeconds]
+
+    nextPollTime = min(pollSchedules[x[1]['id']][0] for x in jobsStillRunning)
+    await asyncio.sleep(max(nextPollTime - loop.time(), 0))
+
+    # Jobs coming due within the fastest interval ride along on the same batched request
+    pollWindowEnd = loop.time() + p.initialPollTimeSeconds
+    jobsToPoll = [x for x in jobsStillRunning if (pollSchedules[x[1]['id']][0] <= pollWindowEnd)]
+    await loop.run_in_executor(None, pollJobs, jobsToPoll)
+
+    for c3TypeToBatchJob in jobsToPoll:
+      pollSchedule = pollSchedules[c3TypeToBatchJob[1]['id']]
+      pollSchedule[1] = min(pollSchedule[1] * p.pollBackoffMultiplier, p.refreshPollTimeSeconds)
+      pollSchedule[0] = loop.time() + pollSchedule[1]
+      if ((onJobComplete != None) and (not isBatchJobRunning(c3TypeToBatchJob))):
+        pendingCallbacks.append(loop.run_in_executor(None, onJobComplete, c3TypeToBatchJob))
+
+    renderStatuses()
+
+  if (len(pendingCallbacks) > 0):
+    await asyncio.gather(*pendingCallbacks)
+
+
+
+
+def monitorBatchJobs (p, c3TypeToBatchJobMapping, pollJobs, renderStatuses, onJobComplete=None, scheduleJobs=None):
+  # scheduleJobs, if given, gets called before every poll & returns True while it still has jobs to kick off
+  loop = asyncio.new_event_loop()
+  try:
+    loop.run_until_complete(_monitorBatchJobsAsync(p, c3TypeToBatchJobMapping, pollJobs, renderStatuses, onJobComplete, scheduleJobs))
+  finally:
+    loop.close()
+
@@ -0,0 +1,235 @@
+__author__ = 'Jackson DeDobbelaere'
+__credits__ = ['Jackson DeDobbelaere']
+__maintainer__ = 'Jackson DeDobbealere'
+__email__ = 'jackson.dedobbelaere@c3.ai'
+
+
+#!/usr/bin/env python3
+import codecs
+import gzip
+import itertools
+import json
+import re
+import zlib
+
+
+
+
+CHUNK_SIZE = 1024 * 1024
+LOCAL_DATA_FORMATS = ['prettyJson', 'compactJson', 'ndjson']
+_jsonDecoder = json.JSONDecoder()
+_whitespaceRegex = re.compile(r'[ \t\n\r]*')
+_numberTailRegex = re.compile(r'[0-9.eE+-]*')
+
+
+
+
+def openTextFile (fullFilePath):
+  with open(fullFilePath, 'rb') as f:
+    magicBytes = f.read(2)
+
+  if (magicBytes == b'\x1f\x8b'):
+    return gzip.open(fullFilePath, 'rt', encoding='utf-8')
+  return open(fullFilePath, 'r', encoding='utf-8')
+
+
+
+
+def readTextChunks (textFile, chunkSize=CHUNK_SIZE):
+  return iter(lambda: textFile.read(chunkSize), '')
+
+
+
+
+def decompressByteChunks (byteChunks):
+  # Gzipped bodies (including several concatenated gzip members) get decompressed, anything else passes through as is
+  byteChunks = iter(byteChunks)
+  firstChunk = b''
+  while (len(firstChunk) < 2):
+    chunk = next(byteChunks, None)
+    if (chunk == None):
+      break
+    firstChunk += chunk
+
+  if (firstChunk[:2] != b'\x1f\x8b'):
+    yield firstChunk
+    yield from byteChunks
+    return
+
+  decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+  pendingBytes = firstChunk
+  while True:
+    while (len(pendingBytes) > 0):
+      yield decompressor.decompress(pendingBytes)
+      if (decompressor.eof):
+        pendingBytes = decompressor.unused_data
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+      else:
+        pendingBytes = b''
+    chunk = next(byteChunks, None)
+    if (chunk == None):
+      break
+    pendingBytes = chunk
+  yield decompressor.flush()
+
+
+
+
+def decodeTextChunks (byteChunks):
+  decoder = codecs.getincrementaldecoder('utf-8')()
+  for chunk in byteChunks:
+    yield decoder.decode(chunk)
+  yield decoder.decode(b'', final=True)
+
+
+
+
+def iterateJsonArrayRecords (textChunks, fieldName=None):
+  # Yields the elements of a top level JSON array (or of the array under fieldName in a top level object)
+  # one at a time, so only the record being decoded and one chunk of text are held in memory.
+  textChunks = iter(textChunks)
+  state = { 'buffer': '', 'pos': 0 }
+
+  def fill ():
+    chunk = next(textChunks, None)
+    if (chunk == None):
+      return False
+    state['buffer'] = state['buffer'][state['pos']:] + chunk
+    state['pos'] = 0
+    return True
+
+  def peek ():
+    while True:
+      state['pos'] = _whitespaceRegex.match(state['buffer'], state['pos']).end()
+      if (state['pos'] < len(state['buffer'])):
+        return state['buffer'][state['pos']]
+      if (not fill()):
+        return ''
+
+  def expect (characters):
+    character = peek()
+    if (character not in characters):
+      raise ValueError('Expected one of "' + characters + '" but found "' + character + '" while streaming JSON')
+    state['pos'] += 1
+    return character
+
+  def decodeValue ():
+    peek()
+    while True:
+      try:
+        value, end = _jsonDecoder.raw_decode(state['buffer'], state['pos'])
+        isNumber = (isinstance(value, (int, float)) and (not isinstance(value, bool)))
+        if ((not isNumber) or (_numberTailRegex.match(state['buffer'], end).end() < len(state['buffer'])) or (not fill())): # A number may continue in the next chunk
+          state['pos'] = end
+          return value
+      except json.JSONDecodeError:
+        if (not fill()):
+          raise
+
+  def iterateArray ():
+    expect('[')
+    if (peek() == ']'):
+      state['pos'] += 1
+      return
+    while True:
+      yield decodeValue()
+      if (expect(',]') == ']'):
+        return
+
+  if (fieldName == None):
+    yield from iterateArray()
+    return
+
+  expect('{')
+  if (peek() == '}'):
+    raise KeyError(fieldName)
+  while True:
+    key = decodeValue()
+    expect(':')
+    if (key == fieldName):
+      yield from iterateArray()
+      return
+    decodeValue()
+    if (expect(',}') == '}'):
+      raise KeyError(fieldName)
+
+
+
+
+def _iterateJsonLinesRecords (textChunks):
+  pendingText = ''
+  for chunk in textChunks:
+    lines = (pendingText + chunk).split('\n')
+    pendingText = lines.pop()
+    for line in lines:
+      if (line.strip() != ''):
+        yield json.loads(line)
+  if (pendingText.strip() != ''):
+    yield json.loads(pendingText)
+
+
+
+
+def iterateLocalRecords (textChunks):
+  # Local data files are read whichever of the LOCAL_DATA_FORMATS they were written in,
+  # a JSON array starts with '[' & newline delimited JSON starts with a record
+  textChunks = iter(textChunks)
+  leadingChunks = []
+  for chunk in textChunks:
+    leadingChunks.append(chunk)
+    if (chunk.strip() != ''):
+      break
+
+  leadingText = ''.join(leadingChunks)
+  if (leadingText.lstrip().startswith('[')):
+    yield from iterateJsonArrayRecords(itertools.chain([leadingText], textChunks))
+  else:
+    yield from _iterateJsonLinesRecords(itertools.chain([leadingText], textChunks))
+
+
+
+
+def writePrettyJsonArray (textFile, records):
+  # Byte for byte the same output as json.dump(records, textFile, sort_keys=True, indent=2)
+  recordCount = 0
+  for record in records:
+    textFile.write('[\n  ' if (recordCount == 0) else ',\n  ')
+    textFile.write(json.dumps(record, sort_keys=True, indent=2).replace('\n', '\n  '))
+    recordCount += 1
+  textFile.write('\n]' if (recordCount > 0) else '[]')
+
+  return recordCount
+
+
+
+
+def writeCompactJsonArray (textFile, records):
+  recordCount = 0
+  for record in records:
+    textFile.write('[' if (recordCount == 0) else ',')
+    textFile.write(json.dumps(record, separators=(',', ':')))
+    recordCount += 1
+  textFile.write(']' if (recordCount > 0) else '[]')
+
+  return recordCount
+
+
+
+
+def writeJsonLines (textFile, records):
+  recordCount = 0
+  for record in records:
+    textFile.write(json.dumps(record, separators=(',', ':')) + '\n')
+    recordCount += 1
+
+  return recordCount
+
+
+
+
+def writeLocalRecords (textFile, records, localDataFormat='prettyJson'):
+  if (localDataFormat == 'compactJson'):
+    return writeCompactJsonArray(textFile, records)
+  if (localDataFormat == 'ndjson'):
+    return writeJsonLines(textFile, records)
+  return writePrettyJsonArray(textFile, records)
@@ -0,0 +1,131 @@
+__author__ = 'Jackson DeDobbelaere'
+__credits__ = ['Jackson DeDobbelaere']
+__maintainer__ = 'Jackson DeDobbealere'
+__email__ = 'jackson.dedobbelaere@c3.ai'
+
+
+#!/usr/bin/env python3
+import collections
+import os
+import struct
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+
+
+
+BLOCK_SIZE = 128 * 1024
+_maxQueuedBlocksPerThread = 2
+
+
+
+
+def resolveCompressionThreads (compressionThreads, numConcurrentFiles):
+  # Left unset, the cores are split between the files compressed at the same time instead of handed to each of them
+  if (compressionThreads != None):
+    return compressionThreads
+
+  return max(1, (os.cpu_count() or 1) // max(numConcurrentFiles, 1))
+
+
+
+
+def _deflateBlock (block, compressionLevel, isLastBlock):
+  # A sync flush ends every block on a byte boundary, so the raw deflate blocks can be laid end to end in one gzip member
+  compressor = zlib.compressobj(compressionLevel, zlib.DEFLATED, -zlib.MAX_WBITS)
+  return compressor.compress(block) + compressor.flush(zlib.Z_FINISH if (isLastBlock == True) else zlib.Z_SYNC_FLUSH)
+
+
+
+
+def _gzipHeader (compressionLevel):
+  extraFlags = 2 if (compressionLevel == 9) else (4 if (compressionLevel == 1) else 0)
+  return b'\x1f\x8b\x08\x00' + struct.pack('<I', 0) + bytes([extraFlags, 255])
+
+
+
+
+class ParallelGzipCompressor:
+  # Drop in for zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS) that deflates BLOCK_SIZE blocks on
+  # several threads the way pigz does. zlib lets go of the GIL while it deflates, so the blocks really run in parallel.
+  def __init__ (self, compressionLevel=6, numThreads=1, blockSizeBytes=BLOCK_SIZE):
+    self.compressionLevel = compressionLevel
+    self.blockSizeBytes = blockSizeBytes
+    self.executor = ThreadPoolExecutor(max_workers=numThreads) if (numThreads > 1) else None
+    self.maxQueuedBlocks = max(1, numThreads) * _maxQueuedBlocksPerThread
+    self.queuedBlocks = collections.deque()
+    self.pendingBytes = bytearray()
+    self.crc = 0
+    self.numBytes = 0
+    self.headerWritten = False
+
+  def _queueBlock (self, block, isLastBlock):
+    if (self.executor == None):
+      self.queuedBlocks.append(_deflateBlock(block, self.compressionLevel, isLastBlock))
+    else:
+      self.queuedBlocks.append(self.executor.submit(_deflateBlock, block, self.compressionLevel, isLastBlock))
+
+  def _collectBlocks (self, waitForAll):
+    # Blocks come back in the order they were queued, waiting only once too many are in flight
+    compressedBlocks = []
+    if (self.headerWritten == False):
+      compressedBlocks.append(_gzipHeader(self.compressionLevel))
+      self.headerWritten = True
+    while (len(self.queuedBlocks) > 0):
+      queuedBlock = self.queuedBlocks[0]
+      if (isinstance(queuedBlock, bytes)):
+        compressedBlocks.append(self.queuedBlocks.popleft())
+      elif (waitForAll or queuedBlock.done() or (len(self.queuedBlocks) > self.maxQueuedBlocks)):
+        compressedBlocks.append(self.queuedBlocks.popleft().result())
+      else:
+        break
+
+    return b''.join(compressedBlocks)
+
+  def compress (self, data):
+    self.crc = zlib.crc32(data, self.crc)
+    self.numBytes += len(data)
+    self.pendingBytes += data
+    compressedBlocks = []
+    while (len(self.pendingBytes) > self.blockSizeBytes):
+      self._queueBlock(bytes(self.pendingBytes[:self.blockSizeBytes]), False)
+      del self.pendingBytes[:self.blockSizeBytes]
+      if (len(self.queuedBlocks) > self.maxQueuedBlocks): # A single big write must not queue all of its blocks at once
+        compressedBlocks.append(self._collectBlocks(False))
+    compressedBlocks.append(self._collectBlocks(False))
+
+    return b''.join(compressedBlocks)
+
+  def flush (self):
+    self._queueBlock(bytes(self.pendingBytes), True)
+    self.pendingBytes = bytearray()
+    compressedBytes = self._collectBlocks(True) + struct.pack('<II', self.crc, self.numBytes & 0xffffffff)
+    if (self.executor != None):
+      self.executor.shutdown()
+
+    return compressedBytes
+
+
+
+
+class ParallelGzipFile:
+  # Write-only text file that lands gzipped on disk, for use in place of gzip.open(path, 'wt')
+  def __init__ (self, fullFilePath, compressionLevel=6, numThreads=1):
+    self.file = open(fullFilePath, 'wb')
+    self.compressor = ParallelGzipCompressor(compressionLevel, numThreads)
+
+  def write (self, text):
+    self.file.write(self.compressor.compress(text.encode('utf-8')))
+    return len(text)
+
+  def close (self):
+    if (self.compressor != None):
+      self.file.write(self.compressor.flush())
+      self.compressor = None
+    self.file.close()
+
+  def __enter__ (self):
+    return self
+
+  def __exit__ (self, excType, excValue, traceback):
+    self.close()
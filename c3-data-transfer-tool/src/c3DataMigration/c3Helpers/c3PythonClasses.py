@@ -5,8 +5,10 @@ __email__ = 'jackson.dedobbelaere@c3.ai'
 
 
 #!/usr/bin/env python3
+import os
 from dataclasses import dataclass, field
 from datetime import datetime
+from c3DataMigration.c3Helpers import c3JsonStream
 
 
 
@@ -17,11 +19,21 @@ class APIParameters:
   errorOutputFolder:        str = ''
   batchSize:                int = 250
   errorSleepTimeSeconds:    int = 15
+  maxRetrySleepSeconds:     int = 300
+  maxRequestAttempts:       int = 10
+  requestRetryBudget:       int = 1000
   refreshPollTimeSeconds:   int = 15
+  initialPollTimeSeconds:   float = 1
+  pollBackoffMultiplier:    float = 1.5
   masterRefreshDataSwitch:  bool = True
   maxColumnPrintLength:     int = 150
   promptUsersForWarnings:   bool = True
   sendDeveloperData:        bool = True
+  connectionPoolSize:       int = 10
+  numProcessWorkers:        int = None
+  schemaCacheTTLSeconds:    int = 24 * 60 * 60
+  duplicateScanMemoryMB:    float = 256
+  resumeFromJournal:        bool = True
   initialTime:              datetime = datetime.now()
   outerAPICall:             str = ''
 
@@ -30,12 +42,29 @@ class APIParameters:
   dataUploadFolder:         str = ''
   masterRemoveDataSwitch:   bool = True
   masterUploadDataSwitch:   bool = True
+  maxConcurrentUploads:     int = 8
+  uploadChunkSizeMB:        float = 64
+  compressOnTheFly:         bool = False
+  keepZippedImportFiles:    bool = False
+  compressionLevel:         int = 6
+  compressionThreads:       int = None
+  reshardImportFiles:       bool = False
+  importShardSizeMB:        float = 64
+  maxImportShardRecords:    int = 250000
+  overlapRemoveWithUpload:  bool = True
+  handOffTypeByType:        bool = True
 
   # Download Specific
   dataTypeExports:          list = field(default_factory=list)
   dataDownloadFolder:       str = ''
   stripMetadataAndDerived:  bool = True
+  streamJsonExtraction:     bool = True
+  extractWhileFetching:     bool = False
+  localDataFormat:          str = 'prettyJson'
   masterDownloadDataSwitch: bool = True
+  maxConcurrentDownloads:   int = 8
+  exportFileSizeMB:         float = 64
+  incrementalDownload:      bool = False
 
 
 
@@ -97,11 +126,11 @@ class APIParameters:
       assert(isinstance(dataTypeConfig, dict))
 
       fieldsToCheck = {
-        'downloadData':      { 'type': bool, 'required': True,  'defaultValue': None     },
-        'refreshCalcFields': { 'type': bool, 'required': True,  'defaultValue': None     },
-        'numRecordsPerFile': { 'type': int,  'required': False, 'defaultValue': 2000     },
-        'filter':            { 'type': str,  'required': False, 'defaultValue': ''       },
-        'include':           { 'type': str,  'required': False, 'defaultValue': 'this'   },
+        'downloadData':      { 'type': bool,              'required': True,  'defaultValue': None   },
+        'refreshCalcFields': { 'type': bool,              'required': True,  'defaultValue': None   },
+        'numRecordsPerFile': { 'type': (int, type(None)), 'required': False, 'defaultValue': None   },
+        'filter':            { 'type': str,               'required': False, 'defaultValue': ''     },
+        'include':           { 'type': str,               'required': False, 'defaultValue': 'this' },
       }
       for fieldToCheck, fieldParams in fieldsToCheck.items():
         assert(self._validateAndAssignFieldInDict(dataTypeConfig, fieldToCheck, fieldParams))
@@ -117,11 +146,17 @@ class APIParameters:
     if (d['errorOutputFolder'] == None):
       d['errorOutputFolder'] = (d['dataDownloadFolder'] + '_Errors')
 
+    if (d['numProcessWorkers'] == None):
+      d['numProcessWorkers'] = os.cpu_count() or 1
+
     if (d['maxColumnPrintLength'] == None):
       if (d['outerAPICall'] == 'uploadAPI'):
         d['maxColumnPrintLength'] = min(max([len(x[0]) for x in d['dataTypeImports']]) + 80, 150)
       elif (d['outerAPICall'] == 'downloadAPI'):
         d['maxColumnPrintLength'] = min(max([len(x[0]) for x in d['dataTypeExports']]) + 80, 150)
 
+    assert(d['localDataFormat'] in c3JsonStream.LOCAL_DATA_FORMATS)
+    assert(d['compressionLevel'] in range(0, 10))
+
     self._validateDataTypeImports()
     self._validateDataTypeExports()
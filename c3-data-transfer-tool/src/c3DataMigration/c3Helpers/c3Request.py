@@ -6,8 +6,12 @@ __email__ = 'jackson.dedobbelaere@c3.ai'
 
 #!/usr/bin/env python3
 import json
+import os
 import requests
+import threading
 import time
+from requests.adapters import HTTPAdapter
+from c3DataMigration.c3Helpers import c3RetryPolicy
 
 
 
@@ -35,39 +39,84 @@ def parseXMLValueFromString (xmlString, label):
 
 
 
+_session = None
+_sessionLock = threading.Lock()
+_sessionPoolSize = 10
+def configureSession (poolSize):
+  global _session, _sessionPoolSize
+  with _sessionLock:
+    if ((_session != None) and (poolSize == _sessionPoolSize)):
+      return
+    if (_session != None):
+      _session.close()
+    _sessionPoolSize = poolSize
+    _session = None
+
+
+
+
+def getSession ():
+  global _session
+  with _sessionLock:
+    if (_session == None):
+      adapter = HTTPAdapter(pool_connections=_sessionPoolSize, pool_maxsize=_sessionPoolSize)
+      session = requests.Session()
+      session.mount('https://', adapter)
+      session.mount('http://', adapter)
+      session.headers.update({
+        'Accept-Encoding': 'gzip, deflate',
+        'Connection':      'keep-alive',
+      })
+      _session = session
+
+  return _session
+
+
+
+
 lastRefreshTime = 0
+_refreshAuthTokenLock = threading.Lock()
 def _refreshAuthToken (r):
   global lastRefreshTime
-  if ((time.time() - lastRefreshTime) > (5 * 60 * 1000)): # 5 minute refresh time
-    url = generateTypeActionURL(r, 'Authenticator', 'generateC3AuthToken')
-    retVal = None
-    if (r.authToken):
-      headers = { 'Content-type': 'application/json', 'Authorization': r.authToken }
-      retVal = requests.post(url=url, headers=headers)
-    elif (r.user and r.password):
-      headers = { 'Content-type': 'application/json', 'Accept': 'application/json' }
-      retVal = requests.post(url=url, headers=headers, auth=(r.user, r.password))
-    r.authToken = parseXMLValueFromString(retVal.text.replace('"', ''), 'generateC3AuthTokenResponse')
-    lastRefreshTime = time.time()
+  with _refreshAuthTokenLock: # Parallel file transfers share one token
+    if ((time.time() - lastRefreshTime) > (5 * 60 * 1000)): # 5 minute refresh time
+      url = generateTypeActionURL(r, 'Authenticator', 'generateC3AuthToken')
+      def sendRequest ():
+        if (r.authToken):
+          headers = { 'Content-type': 'application/json', 'Authorization': r.authToken }
+          return getSession().post(url=url, headers=headers)
+        headers = { 'Content-type': 'application/json', 'Accept': 'application/json' }
+        return getSession().post(url=url, headers=headers, auth=(r.user, r.password))
+
+      retVal = c3RetryPolicy.executeWithRetries(sendRequest, c3RetryPolicy.getBaseSleepTimeSeconds(), 'Unsuccessful refreshing auth token')
+      r.authToken = parseXMLValueFromString(retVal.text.replace('"', ''), 'generateC3AuthTokenResponse')
+      lastRefreshTime = time.time()
+
+
+
+
+def _forceAuthTokenRefresh ():
+  global lastRefreshTime
+  lastRefreshTime = 0
 
 
 
 
 def _makeRequestHelper (r, url, payload):
+  _refreshAuthToken(r) # Before every attempt, so the retry after a 401/419 goes out with a freshly generated token
   retVal = None
   if (r.authToken):
     headers = { 'Content-type': 'application/json', 'Authorization': r.authToken }
     if (payload == None):
-      retVal = requests.post(url=url, headers=headers)
+      retVal = getSession().post(url=url, headers=headers)
     else:
-      retVal = requests.post(url=url, data=json.dumps(payload), headers=headers)
+      retVal = getSession().post(url=url, data=json.dumps(payload), headers=headers)
   elif (r.user and r.password):
     headers = { 'Content-type': 'application/json', 'Accept': 'application/json' }
     if (payload == None):
-      retVal = requests.post(url=url, headers=headers, auth=(r.user, r.password))
+      retVal = getSession().post(url=url, headers=headers, auth=(r.user, r.password))
     else:
-      retVal = requests.post(url=url, json=payload, headers=headers, auth=(r.user, r.password))
-  _refreshAuthToken(r)
+      retVal = getSession().post(url=url, json=payload, headers=headers, auth=(r.user, r.password))
 
   return retVal
 
@@ -75,102 +124,144 @@ def _makeRequestHelper (r, url, payload):
 
 
 def makeRequest (r, errorSleepTimeSeconds, url, payload, errorCodePrefix):
-  request = _makeRequestHelper(r, url, payload)
-  while (request.status_code != 200):
-    print(errorCodePrefix + ' w/ status code: ' + str(request.status_code))
-    print('Error Message: ' + request.text)
-    print('Sleeping ' + str(errorSleepTimeSeconds) + ' seconds, and retrying. Use Control-C to kill program.')
-    time.sleep(errorSleepTimeSeconds)
-    request = _makeRequestHelper(r, url, payload)
+  def sendRequest ():
+    return _makeRequestHelper(r, url, payload)
 
-  return request
+  return c3RetryPolicy.executeWithRetries(sendRequest, errorSleepTimeSeconds, errorCodePrefix, None, _forceAuthTokenRefresh)
 
 
 
 
-def downloadFileFromURL (r, errorSleepTimeSeconds, fullFileURL, downloadFilePath, okayToSkip404Error, errorCodePrefix):
-  def createFileRequest ():
+def streamFileFromURL (r, errorSleepTimeSeconds, fullFileURL, consumeChunks, okayToSkip404Error, errorCodePrefix, chunkSize=8192):
+  # consumeChunks gets the body as an iterator of bytes & returns what this returns, None when a 404 was skipped
+  result = [None]
+  def streamFile ():
     _refreshAuthToken(r)
     cookies = {
       'c3auth': r.authToken
     }
-    return requests.get(fullFileURL, stream=True, cookies=cookies)
-
-  shouldStreamFile = True
-  fileRequest = createFileRequest()
-  while (fileRequest.status_code != 200):
-    if ((fileRequest.status_code == 404) and (okayToSkip404Error == True)):
-      shouldStreamFile = False
-      break
-    print(errorCodePrefix + ' w/ status code: ' + str(fileRequest.status_code))
-    print('Error Message: ' + fileRequest.text)
-    print('Sleeping ' + str(errorSleepTimeSeconds) + ' seconds, and retrying. Use Control-C to kill program.')
-    time.sleep(errorSleepTimeSeconds)
-    fileRequest = createFileRequest()
-
-  if (shouldStreamFile == True):
+    fileRequest = getSession().get(fullFileURL, stream=True, cookies=cookies)
+    if (fileRequest.status_code == 200): # Streamed inside the retry so a dropped connection mid-body is retried too
+      result[0] = consumeChunks(fileRequest.iter_content(chunk_size=chunkSize))
+    return fileRequest
+
+  acceptedStatusCodes = [404] if (okayToSkip404Error == True) else None
+  fileRequest = c3RetryPolicy.executeWithRetries(streamFile, errorSleepTimeSeconds, errorCodePrefix, acceptedStatusCodes, _forceAuthTokenRefresh)
+  fileRequest.close() # Hand the pooled connection back to the session
+
+  return result[0]
+
+
+
+
+def downloadFileFromURL (r, errorSleepTimeSeconds, fullFileURL, downloadFilePath, okayToSkip404Error, errorCodePrefix):
+  def writeFile (chunks):
     with open(downloadFilePath, 'wb') as f:
-      for chunk in fileRequest.iter_content(chunk_size=8192):
+      for chunk in chunks:
         f.write(chunk)
 
+  streamFileFromURL(r, errorSleepTimeSeconds, fullFileURL, writeFile, okayToSkip404Error, errorCodePrefix)
+
   return downloadFilePath
 
 
 
 
-def uploadFileToURL (r, errorSleepTimeSeconds, fullFileURL, uploadFilePath, errorCodePrefix):
-  def createFileRequest (file):
+_chunkedUploadsIgnored = { 'ignored': False } # Set once the env shows it treats every post as the whole file
+
+
+
+
+def resetChunkedUploads ():
+  # Each upload run gives the env it posts to another chance to acknowledge chunks
+  _chunkedUploadsIgnored['ignored'] = False
+
+
+
+
+def _getAcknowledgedOffset (fileRequest):
+  # Only an explicit Range acknowledges bytes, a bare 2xx may just mean the chunk got written as the whole file
+  rangeHeader = fileRequest.headers.get('Range')
+  if ((rangeHeader != None) and ('-' in rangeHeader)):
+    try:
+      return int(rangeHeader.split('-')[-1]) + 1
+    except ValueError:
+      pass
+
+  return None
+
+
+
+
+def _uploadFileToURLInChunks (r, errorSleepTimeSeconds, fullFileURL, uploadFilePath, chunkSizeBytes, errorCodePrefix):
+  # Returns False when the env does not acknowledge chunks with Range, the file then has to be posted whole
+  fileSize = os.path.getsize(uploadFilePath)
+  acknowledgedOffset = 0
+
+  with open(uploadFilePath, 'rb') as file:
+    while (acknowledgedOffset < fileSize):
+      def sendChunk ():
+        # A failed chunk is re-sent from the last acknowledged offset, never from the start of the file
+        _refreshAuthToken(r)
+        cookies = {
+          'c3auth': r.authToken
+        }
+        file.seek(acknowledgedOffset)
+        chunk = file.read(chunkSizeBytes)
+        headers = {
+          'Content-Range': 'bytes {}-{}/{}'.format(acknowledgedOffset, acknowledgedOffset + len(chunk) - 1, fileSize)
+        }
+        return getSession().post(fullFileURL, data=chunk, headers=headers, cookies=cookies)
+
+      chunkErrorCodePrefix = errorCodePrefix + ' (bytes ' + str(acknowledgedOffset) + '/' + str(fileSize) + ')'
+      fileRequest = c3RetryPolicy.executeWithRetries(sendChunk, errorSleepTimeSeconds, chunkErrorCodePrefix, [201, 308], _forceAuthTokenRefresh)
+      fileRequest.close()
+      newAcknowledgedOffset = _getAcknowledgedOffset(fileRequest)
+      if ((newAcknowledgedOffset == None) and (fileRequest.status_code != 308)):
+        isLastChunk = (acknowledgedOffset + chunkSizeBytes >= fileSize)
+        if ((not isLastChunk) or (acknowledgedOffset == 0)):
+          return False
+        newAcknowledgedOffset = fileSize # The final chunk of an upload whose earlier chunks were all acknowledged
+      if ((newAcknowledgedOffset == None) or (newAcknowledgedOffset <= acknowledgedOffset)):
+        raise c3RetryPolicy.C3RequestError(chunkErrorCodePrefix + ' w/ no bytes acknowledged by the server')
+      acknowledgedOffset = newAcknowledgedOffset
+
+  return True
+
+
+
+
+def uploadStreamToURL (r, errorSleepTimeSeconds, fullFileURL, createBody, errorCodePrefix):
+  def createStreamRequest ():
     _refreshAuthToken(r)
     cookies = {
       'c3auth': r.authToken
     }
-    return requests.post(fullFileURL, data=file, stream=True, cookies=cookies)
-
-  file = open(uploadFilePath, 'rb')
-  fileRequest = createFileRequest(file)
-  while (fileRequest.status_code != 200):
-    print(errorCodePrefix + ' w/ status code: ' + str(fileRequest.status_code))
-    print('Error Message: ' + fileRequest.text)
-    print('Sleeping ' + str(errorSleepTimeSeconds) + ' seconds, and retrying. Use Control-C to kill program.')
-    time.sleep(errorSleepTimeSeconds)
-    fileRequest = createFileRequest(file)
-
-  return uploadFilePath
+    return getSession().post(fullFileURL, data=createBody(), cookies=cookies) # Fresh generator per attempt, sent chunked
 
+  fileRequest = c3RetryPolicy.executeWithRetries(createStreamRequest, errorSleepTimeSeconds, errorCodePrefix, None, _forceAuthTokenRefresh)
+  fileRequest.close()
 
+  return fullFileURL
 
 
-# TODO: Upload streaming file in case of large files (below code should replace uploadFileToURL)
-# import os
 
-# def _readInChunks(file_object, chunkSize):
-#   while True:
-#     data = file_object.read(chunkSize)
-#     if not data:
-#       break
-#     yield data
 
+def uploadFileToURL (r, errorSleepTimeSeconds, fullFileURL, uploadFilePath, errorCodePrefix, chunkSizeBytes=0):
+  if ((chunkSizeBytes > 0) and (os.path.getsize(uploadFilePath) > chunkSizeBytes) and (_chunkedUploadsIgnored['ignored'] == False)):
+    if (_uploadFileToURLInChunks(r, errorSleepTimeSeconds, fullFileURL, uploadFilePath, chunkSizeBytes, errorCodePrefix)):
+      return uploadFilePath
+    _chunkedUploadsIgnored['ignored'] = True # The first chunk got stored as the whole file, so it is overwritten by a whole post below
 
-# def upload (file, url):
-#   content_name = str(file)
-#   content_path = os.path.abspath(file)
-#   content_size = os.stat(content_path).st_size
-#   print(content_name, content_path, content_size)
+  def createFileRequest ():
+    _refreshAuthToken(r)
+    cookies = {
+      'c3auth': r.authToken
+    }
+    with open(uploadFilePath, 'rb') as file: # Reopened per attempt so a retry re-sends the whole file
+      return getSession().post(fullFileURL, data=file, stream=True, cookies=cookies)
 
-#   file_object = open(content_path, 'rb')
-#   index = 0
-#   offset = 0
-#   headers = {}
+  fileRequest = c3RetryPolicy.executeWithRetries(createFileRequest, errorSleepTimeSeconds, errorCodePrefix, None, _forceAuthTokenRefresh)
+  fileRequest.close() # Hand the pooled connection back to the session
 
-#   for chunk in _readInChunks(file_object, 8192):
-#     offset = index + len(chunk)
-#     headers['Content-Range'] = 'bytes %s-%s/%s' % (index, offset - 1, content_size)
-#     headers['Authorization'] = auth_string
-#     index = offset
-#     try:
-#       file = {"file": chunk}
-#       r = requests.post(url, files=file, headers=headers)
-#       print(r.json())
-#       print("r: %s, Content-Range: %s" % (r, headers['Content-Range']))
-#     except Exception as e:
-#       print(e)
+  return uploadFilePath
@@ -0,0 +1,140 @@
+__author__ = 'Jackson DeDobbelaere'
+__credits__ = ['Jackson DeDobbelaere']
+__maintainer__ = 'Jackson DeDobbealere'
+__email__ = 'jackson.dedobbelaere@c3.ai'
+
+
+#!/usr/bin/env python3
+import random
+import requests
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+
+
+
+class C3RequestError(Exception):
+  pass
+
+
+
+
+_retryPolicy = {
+  'baseSleepTimeSeconds':     15,
+  'maxSleepTimeSeconds':      300,
+  'maxAttempts':              10,
+  'retriesRemainingInBudget': 1000,
+}
+_retryPolicyLock = threading.Lock()
+
+
+
+
+def configureRetryPolicy (baseSleepTimeSeconds, maxSleepTimeSeconds, maxAttempts, retryBudget):
+  with _retryPolicyLock:
+    _retryPolicy['baseSleepTimeSeconds'] = baseSleepTimeSeconds
+    _retryPolicy['maxSleepTimeSeconds'] = maxSleepTimeSeconds
+    _retryPolicy['maxAttempts'] = maxAttempts
+    _retryPolicy['retriesRemainingInBudget'] = retryBudget
+
+
+
+
+def getBaseSleepTimeSeconds ():
+  return _retryPolicy['baseSleepTimeSeconds']
+
+
+
+
+def _consumeRetryFromBudget ():
+  with _retryPolicyLock:
+    if (_retryPolicy['retriesRemainingInBudget'] <= 0):
+      return False
+    _retryPolicy['retriesRemainingInBudget'] -= 1
+    return True
+
+
+
+
+def _classifyFailure (response):
+  if (response == None):
+    return 'network'
+  if (response.status_code in [429, 503]):
+    return 'throttled'
+  if (response.status_code in [401, 419]):
+    return 'auth'
+  if ((response.status_code >= 500) or (response.status_code == 408)):
+    return 'server'
+  return 'client'
+
+
+
+
+def _parseRetryAfterSeconds (response):
+  retryAfter = response.headers.get('Retry-After') if (response != None) else None
+  if (retryAfter == None):
+    return None
+
+  try:
+    return max(float(retryAfter), 0)
+  except ValueError:
+    try:
+      return max((parsedate_to_datetime(retryAfter) - datetime.now(timezone.utc)).total_seconds(), 0)
+    except (TypeError, ValueError):
+      return None
+
+
+
+
+def _computeSleepSeconds (attempt, baseSleepTimeSeconds, failureClass, response):
+  maxSleepTimeSeconds = _retryPolicy['maxSleepTimeSeconds']
+  retryAfterSeconds = _parseRetryAfterSeconds(response)
+  if (retryAfterSeconds != None):
+    return min(retryAfterSeconds, maxSleepTimeSeconds)
+
+  # Jitter keeps many parallel clients from retrying in lockstep, throttling backs off twice as hard
+  multiplier = 2 if (failureClass == 'throttled') else 1
+  backoffCeiling = min(baseSleepTimeSeconds * multiplier * (2 ** (attempt - 1)), maxSleepTimeSeconds)
+  return random.uniform(backoffCeiling / 2, backoffCeiling)
+
+
+
+
+def executeWithRetries (sendRequest, baseSleepTimeSeconds, errorCodePrefix, acceptedStatusCodes=None, onAuthFailure=None):
+  acceptedStatusCodes = [200] + (acceptedStatusCodes or [])
+  maxAttempts = _retryPolicy['maxAttempts']
+
+  attempt = 0
+  authRetried = False
+  while True:
+    attempt += 1
+    response = None
+    errorMessage = None
+    try:
+      response = sendRequest()
+      if (response.status_code in acceptedStatusCodes):
+        return response
+      errorMessage = errorCodePrefix + ' w/ status code: ' + str(response.status_code)
+      print(errorMessage)
+      print('Error Message: ' + response.text)
+    except requests.exceptions.RequestException as e:
+      errorMessage = errorCodePrefix + ' w/ exception: ' + repr(e)
+      print(errorMessage)
+
+    failureClass = _classifyFailure(response)
+    if ((failureClass == 'client') or ((failureClass == 'auth') and authRetried)):
+      raise C3RequestError(errorMessage + ' (not retryable)')
+    if (attempt >= maxAttempts):
+      raise C3RequestError(errorMessage + ' (gave up after ' + str(attempt) + ' attempts)')
+    if (not _consumeRetryFromBudget()):
+      raise C3RequestError(errorMessage + ' (retry budget for this run is exhausted)')
+
+    if (failureClass == 'auth'):
+      authRetried = True
+      if (onAuthFailure != None):
+        onAuthFailure()
+    sleepSeconds = _computeSleepSeconds(attempt, baseSleepTimeSeconds, failureClass, response)
+    print('Sleeping ' + '{:.1f}'.format(sleepSeconds) + ' seconds, and retrying (attempt ' + str(attempt + 1) + '/' + str(maxAttempts) + '). Use Control-C to kill program.')
+    time.sleep(sleepSeconds)
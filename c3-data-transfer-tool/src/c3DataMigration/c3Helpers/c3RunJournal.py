@@ -0,0 +1,274 @@
+__author__ = 'Jackson DeDobbelaere'
+__credits__ = ['Jackson DeDobbelaere']
+__maintainer__ = 'Jackson DeDobbealere'
+__email__ = 'jackson.dedobbelaere@c3.ai'
+
+
+#!/usr/bin/env python3
+import copy
+import hashlib
+import json
+import os
+import threading
+from datetime import datetime
+from pathlib import Path
+from c3DataMigration.c3Helpers import c3UtilityMethods
+
+
+
+
+journalFileName = '.c3RunJournal.jsonl'
+_runJournal = {
+  'filePath':        None,
+  'runKey':          None,
+  'isNewRun':        True,
+  'isResumedRun':    False,
+  'completedPhases': {}, # phase -> data saved when the phase finished
+  'batchJobs':       {}, # phase -> c3TypeToBatchJobMapping saved when the jobs were kicked off
+  'startedBatchJobs': {}, # phase -> c3Type -> batch job saved the moment it was kicked off
+  'completedFiles':  {}, # phase -> set of files already transferred
+}
+_runJournalLock = threading.Lock()
+
+
+
+
+def _generateRunKey (r, p):
+  # A journal only gets resumed by a run against the same env with the same data types & switches
+  dataTypes = p.dataTypeImports if (p.outerAPICall == 'uploadAPI') else p.dataTypeExports
+  switches = [p.masterRemoveDataSwitch, p.masterUploadDataSwitch, p.masterRefreshDataSwitch, p.masterDownloadDataSwitch]
+  runDefinition = json.dumps([r.env, r.tenant, r.tag, p.outerAPICall, dataTypes, switches], sort_keys=True, default=str)
+  return hashlib.sha1(runDefinition.encode('utf-8')).hexdigest()
+
+
+
+
+def _serializeBatchJobMapping (c3TypeToBatchJobMapping):
+  serializedMapping = copy.deepcopy(c3TypeToBatchJobMapping)
+  for c3TypeToBatchJob in serializedMapping:
+    for field in ['launchTime', 'completionTime']:
+      if (isinstance(c3TypeToBatchJob[1].get(field), datetime)):
+        c3TypeToBatchJob[1][field] = c3TypeToBatchJob[1][field].isoformat()
+
+  return serializedMapping
+
+
+
+
+def _deserializeBatchJobMapping (serializedMapping):
+  c3TypeToBatchJobMapping = copy.deepcopy(serializedMapping)
+  for c3TypeToBatchJob in c3TypeToBatchJobMapping:
+    for field in ['launchTime', 'completionTime']:
+      if (isinstance(c3TypeToBatchJob[1].get(field), str)):
+        c3TypeToBatchJob[1][field] = datetime.fromisoformat(c3TypeToBatchJob[1][field])
+
+  return c3TypeToBatchJobMapping
+
+
+
+
+def _appendEntry (entry):
+  with _runJournalLock:
+    if (_runJournal['filePath'] == None):
+      return
+
+    mode = 'a'
+    if (_runJournal['isNewRun'] == True):
+      # The first entry of a new run replaces whatever journal was left behind
+      Path(_runJournal['filePath']).parent.mkdir(parents=True, exist_ok=True)
+      mode = 'w'
+      entry = [{ 'event': 'begin', 'runKey': _runJournal['runKey'], 'time': datetime.now().isoformat() }, entry]
+      _runJournal['isNewRun'] = False
+
+    with open(_runJournal['filePath'], mode) as f:
+      for x in (entry if isinstance(entry, list) else [entry]):
+        f.write(json.dumps(x, default=str) + '\n')
+      f.flush()
+      os.fsync(f.fileno())
+
+
+
+
+def _replayEntries (journalFilePath, runKey):
+  entries = []
+  try:
+    with open(journalFilePath, 'r') as f:
+      for line in f:
+        try:
+          entries.append(json.loads(line))
+        except ValueError:
+          break # Torn last line from a crash mid-write
+  except OSError:
+    return False
+
+  if ((len(entries) == 0) or (entries[0].get('event') != 'begin') or (entries[0].get('runKey') != runKey)):
+    return False
+  if (entries[-1].get('event') == 'finish'):
+    return False
+
+  for entry in entries[1:]:
+    if (entry['event'] == 'phase'):
+      _runJournal['completedPhases'][entry['phase']] = entry.get('data')
+    elif (entry['event'] == 'batchJobs'):
+      _runJournal['batchJobs'][entry['phase']] = entry['mapping']
+    elif (entry['event'] == 'batchJob'):
+      _runJournal['startedBatchJobs'].setdefault(entry['phase'], {})[entry['c3Type']] = entry['batchJob']
+    elif (entry['event'] == 'file'):
+      _runJournal['completedFiles'].setdefault(entry['phase'], set()).add(entry['file'])
+    elif (entry['event'] == 'resetFiles'):
+      _runJournal['completedFiles'].pop(entry['phase'], None)
+
+  return True
+
+
+
+
+def openRunJournal (r, p, directory, resumeFromJournal):
+  # Returns True when an unfinished journal of this same run was found & will be resumed from
+  _runJournal['filePath'] = '/'.join([directory, journalFileName])
+  _runJournal['runKey'] = _generateRunKey(r, p)
+  _runJournal['isNewRun'] = True
+  _runJournal['isResumedRun'] = False
+  _runJournal['completedPhases'] = {}
+  _runJournal['batchJobs'] = {}
+  _runJournal['startedBatchJobs'] = {}
+  _runJournal['completedFiles'] = {}
+
+  if ((resumeFromJournal == True) and _replayEntries(_runJournal['filePath'], _runJournal['runKey'])):
+    _runJournal['isNewRun'] = False
+    _runJournal['isResumedRun'] = True
+    c3UtilityMethods.printFormatExtraPeriods('Resuming from run journal', _runJournal['filePath'], p.maxColumnPrintLength, True)
+    return True
+
+  return False
+
+
+
+
+def isResumingRun ():
+  return (_runJournal['isResumedRun'] == True)
+
+
+
+
+def isPhaseComplete (phase):
+  return (phase in _runJournal['completedPhases'])
+
+
+
+
+def getCompletedPhaseData (phase):
+  return _runJournal['completedPhases'].get(phase)
+
+
+
+
+def completePhase (phase, data=None):
+  _runJournal['completedPhases'][phase] = data
+  _appendEntry({ 'event': 'phase', 'phase': phase, 'data': data })
+
+
+
+
+def getCompletedBatchJobMapping (phase):
+  return _deserializeBatchJobMapping(getCompletedPhaseData(phase) or [])
+
+
+
+
+def completeBatchJobPhase (phase, c3TypeToBatchJobMapping):
+  completePhase(phase, _serializeBatchJobMapping(c3TypeToBatchJobMapping))
+
+
+
+
+def startOrReattachBatchJobs (p, phase, startBatchJobs):
+  # Jobs kicked off by an interrupted run are still going on the server, so they get monitored instead of relaunched
+  serializedMapping = _runJournal['batchJobs'].get(phase)
+  if (serializedMapping != None):
+    c3TypeToBatchJobMapping = _deserializeBatchJobMapping(serializedMapping)
+    for c3TypeToBatchJob in c3TypeToBatchJobMapping:
+      if (c3TypeToBatchJob[1]['id'] != None):
+        c3TypeToBatchJob[1]['status'] = 'running'
+      c3UtilityMethods.printFormatExtraPeriods('Reattaching ' + c3TypeToBatchJob[0], 'id=' + str(c3TypeToBatchJob[1]['id']), p.maxColumnPrintLength, True)
+    return c3TypeToBatchJobMapping
+
+  c3TypeToBatchJobMapping = startBatchJobs()
+  _runJournal['batchJobs'][phase] = _serializeBatchJobMapping(c3TypeToBatchJobMapping)
+  _appendEntry({ 'event': 'batchJobs', 'phase': phase, 'mapping': _runJournal['batchJobs'][phase] })
+  return c3TypeToBatchJobMapping
+
+
+
+
+def hasStartedBatchJob (phase, c3Type):
+  return (c3Type in _runJournal['startedBatchJobs'].get(phase, {}))
+
+
+
+
+def startOrReattachBatchJob (phase, c3Type, c3TypeToBatchJobMapping, startBatchJob):
+  # Journals a single job the moment startBatchJob appends it to the mapping, for phases that kick off their jobs over a
+  # long stretch of time. Returns True when the job of an interrupted run got appended & reattached to instead.
+  with _runJournalLock:
+    serializedBatchJob = _runJournal['startedBatchJobs'].get(phase, {}).get(c3Type)
+  if (serializedBatchJob != None):
+    c3TypeToBatchJob = _deserializeBatchJobMapping([serializedBatchJob])[0]
+    if (c3TypeToBatchJob[1]['id'] != None):
+      c3TypeToBatchJob[1]['status'] = 'running'
+    c3TypeToBatchJobMapping.append(c3TypeToBatchJob)
+    return True
+
+  startBatchJob()
+  serializedBatchJob = _serializeBatchJobMapping([c3TypeToBatchJobMapping[-1]])[0]
+  with _runJournalLock:
+    _runJournal['startedBatchJobs'].setdefault(phase, {})[c3Type] = serializedBatchJob
+  _appendEntry({ 'event': 'batchJob', 'phase': phase, 'c3Type': c3Type, 'batchJob': serializedBatchJob })
+  return False
+
+
+
+
+def hasBatchJobs (phase):
+  return (_runJournal['batchJobs'].get(phase) != None)
+
+
+
+
+def hasCompletedFiles (phase):
+  return (len(_runJournal['completedFiles'].get(phase, set())) > 0)
+
+
+
+
+def isFileComplete (phase, fileKey):
+  return (fileKey in _runJournal['completedFiles'].get(phase, set()))
+
+
+
+
+def completeFile (phase, fileKey):
+  with _runJournalLock:
+    _runJournal['completedFiles'].setdefault(phase, set()).add(fileKey)
+  _appendEntry({ 'event': 'file', 'phase': phase, 'file': fileKey })
+
+
+
+
+def resetFiles (phase):
+  if (hasCompletedFiles(phase)):
+    with _runJournalLock:
+      _runJournal['completedFiles'].pop(phase, None)
+    _appendEntry({ 'event': 'resetFiles', 'phase': phase })
+
+
+
+
+def printPhaseAlreadyComplete (p, phase):
+  c3UtilityMethods.printFormatExtraPeriods('Resuming ' + phase, 'ALREADY COMPLETED', p.maxColumnPrintLength, True)
+
+
+
+
+def finishRunJournal ():
+  _appendEntry({ 'event': 'finish', 'time': datetime.now().isoformat() })
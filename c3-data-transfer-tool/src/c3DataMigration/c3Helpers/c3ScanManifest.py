@@ -0,0 +1,329 @@
+__author__ = 'Jackson DeDobbelaere'
+__credits__ = ['Jackson DeDobbelaere']
+__maintainer__ = 'Jackson DeDobbealere'
+__email__ = 'jackson.dedobbelaere@c3.ai'
+
+
+#!/usr/bin/env python3
+import codecs
+import hashlib
+import heapq
+import json
+import os
+import tempfile
+from array import array
+from pathlib import Path
+from c3DataMigration.c3Helpers import c3JsonStream
+try:
+  import resource
+except ImportError:
+  resource = None # Windows
+
+
+
+
+manifestFolderName = '.c3ScanManifest'
+ID_BUFFER_BYTES = 64 * 1024 * 1024
+_idHashSizeBytes = 8
+_bufferedIdHashBytes = 8 + 36 + 8 # List slot, int object & array copy of every id hash held in a sort buffer
+_minMergeBufferBytes = 64 * 1024
+_maxMergeFanIn = 256
+
+
+
+
+def hashId (recordId):
+  return int.from_bytes(hashlib.blake2b(recordId.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+
+
+def _getManifestPaths (directory, c3Type):
+  manifestFolder = '/'.join([directory, manifestFolderName])
+  return '/'.join([manifestFolder, c3Type + '.json']), '/'.join([manifestFolder, c3Type])
+
+
+
+
+def loadManifest (directory, c3Type):
+  manifestFilePath, _ = _getManifestPaths(directory, c3Type)
+  try:
+    with open(manifestFilePath, 'r') as f:
+      return json.load(f)
+  except:
+    return {} # Missing or corrupt manifest means every file gets rescanned
+
+
+
+
+def saveManifest (directory, c3Type, manifest):
+  manifestFilePath, idDigestFolder = _getManifestPaths(directory, c3Type)
+  Path(idDigestFolder).mkdir(parents=True, exist_ok=True)
+
+  # Drop digests of files that are no longer in the folder
+  keptIdDigestFiles = set(x['idDigestFile'] for x in manifest.values())
+  for fileName in os.listdir(idDigestFolder):
+    if (fileName not in keptIdDigestFiles):
+      os.remove('/'.join([idDigestFolder, fileName]))
+
+  tempFilePath = manifestFilePath + '.tmp'
+  with open(tempFilePath, 'w') as f:
+    json.dump(manifest, f)
+  os.replace(tempFilePath, manifestFilePath)
+
+
+
+
+def getIdDigestPath (directory, c3Type, manifestEntry):
+  _, idDigestFolder = _getManifestPaths(directory, c3Type)
+  return '/'.join([idDigestFolder, manifestEntry['idDigestFile']])
+
+
+
+
+def iterateIdDigest (idDigestPath, bufferBytes):
+  bufferEntries = max(bufferBytes // _idHashSizeBytes, 1)
+  with open(idDigestPath, 'rb') as f:
+    for chunk in iter(lambda: f.read(bufferEntries * _idHashSizeBytes), b''):
+      idHashes = array('Q')
+      idHashes.frombytes(chunk)
+      yield from idHashes
+
+
+
+
+def _writeMergedRun (runFile, idDigestPaths, bufferBytes):
+  idHashes = array('Q')
+  bufferEntries = max(bufferBytes // _idHashSizeBytes, 1)
+  for idHash in heapq.merge(*[iterateIdDigest(x, bufferBytes) for x in idDigestPaths]):
+    idHashes.append(idHash)
+    if (len(idHashes) >= bufferEntries):
+      idHashes.tofile(runFile)
+      idHashes = array('Q')
+  idHashes.tofile(runFile)
+
+
+
+
+def _getMaxMergeFanIn (memoryCeilingBytes):
+  # Runs merged at once are all open at once, so a quarter of the open file limit is left to them at most
+  maxOpenFiles = _maxMergeFanIn * 4
+  if (resource != None):
+    softLimit = resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+    if (softLimit != resource.RLIM_INFINITY):
+      maxOpenFiles = softLimit
+
+  return max(min(memoryCeilingBytes // _minMergeBufferBytes, _maxMergeFanIn, maxOpenFiles // 4), 2)
+
+
+
+
+def _mergeRunsDownToFanIn (runPaths, runDirectory, maxFanIn, memoryCeilingBytes):
+  # Merges groups of runs into longer runs until few enough are left to open at once
+  passIdx = 0
+  while (len(runPaths) > maxFanIn):
+    mergedRunPaths = []
+    for idx in range(0, len(runPaths), maxFanIn):
+      runGroup = runPaths[idx:idx + maxFanIn]
+      mergedRunPaths.append('/'.join([runDirectory, 'merge_' + str(passIdx) + '_' + str(idx) + '.ids']))
+      with open(mergedRunPaths[-1], 'wb') as runFile:
+        _writeMergedRun(runFile, runGroup, memoryCeilingBytes // (len(runGroup) + 1))
+    runPaths = mergedRunPaths
+    passIdx += 1
+
+  return runPaths
+
+
+
+
+def findDuplicateIdHashes (idDigestPaths, memoryCeilingBytes):
+  # External k-way merge over the already sorted digests, so memory stays under the ceiling however many ids there are
+  maxFanIn = _getMaxMergeFanIn(memoryCeilingBytes)
+  duplicateIdHashes = set()
+
+  with tempfile.TemporaryDirectory() as runDirectory:
+    runPaths = _mergeRunsDownToFanIn(list(idDigestPaths), runDirectory, maxFanIn, memoryCeilingBytes)
+
+    previousIdHash = None
+    bufferBytes = memoryCeilingBytes // max(len(runPaths), 1)
+    for idHash in heapq.merge(*[iterateIdDigest(x, bufferBytes) for x in runPaths]):
+      if (idHash == previousIdHash):
+        duplicateIdHashes.add(idHash)
+      previousIdHash = idHash
+
+  return duplicateIdHashes
+
+
+
+
+class IdDigestWriter:
+  # Collects the id hashes of one file as sorted runs spilled to disk whenever the buffer fills up, then writes the
+  # digest by merging the runs, so a file of any size is hashed within bufferBytes
+  def __init__ (self, bufferBytes=ID_BUFFER_BYTES):
+    self.bufferBytes = max(bufferBytes, _minMergeBufferBytes)
+    self.bufferEntries = max(self.bufferBytes // _bufferedIdHashBytes, 1)
+    self.idHashes = []
+    self.runDirectory = None
+    self.runPaths = []
+    self.numIdHashes = 0
+
+  def __len__ (self):
+    return self.numIdHashes
+
+  def _spillRun (self):
+    if (self.runDirectory == None):
+      self.runDirectory = tempfile.TemporaryDirectory()
+    self.idHashes.sort()
+    self.runPaths.append('/'.join([self.runDirectory.name, str(len(self.runPaths)) + '.ids']))
+    with open(self.runPaths[-1], 'wb') as runFile:
+      array('Q', self.idHashes).tofile(runFile)
+    self.idHashes = []
+
+  def append (self, idHash):
+    self.idHashes.append(idHash)
+    self.numIdHashes += 1
+    if (len(self.idHashes) >= self.bufferEntries):
+      self._spillRun()
+
+  def extend (self, idHashes):
+    for idHash in idHashes:
+      self.append(idHash)
+
+  def write (self, idDigestPath):
+    Path(idDigestPath).parent.mkdir(parents=True, exist_ok=True)
+    if (len(self.runPaths) == 0):
+      self.idHashes.sort()
+      with open(idDigestPath, 'wb') as f:
+        array('Q', self.idHashes).tofile(f)
+      self.idHashes = []
+      return
+
+    try:
+      if (len(self.idHashes) > 0):
+        self._spillRun()
+      maxFanIn = _getMaxMergeFanIn(self.bufferBytes)
+      runPaths = _mergeRunsDownToFanIn(self.runPaths, self.runDirectory.name, maxFanIn, self.bufferBytes)
+      with open(idDigestPath, 'wb') as f:
+        _writeMergedRun(f, runPaths, self.bufferBytes // (len(runPaths) + 1))
+    finally:
+      self.runDirectory.cleanup()
+
+
+
+
+def idDigestContainsAny (idDigestPath, idHashes, bufferBytes):
+  return any((x in idHashes) for x in iterateIdDigest(idDigestPath, bufferBytes))
+
+
+
+
+def _iterateTextChunksAndHash (filePath, contentHash):
+  decoder = codecs.getincrementaldecoder('utf-8')()
+  with open(filePath, 'rb') as f:
+    for chunk in iter(lambda: f.read(c3JsonStream.CHUNK_SIZE), b''):
+      contentHash.update(chunk)
+      yield decoder.decode(chunk)
+  yield decoder.decode(b'', final=True)
+
+
+
+
+def _hashFileContents (filePath):
+  contentHash = hashlib.sha1()
+  for _ in _iterateTextChunksAndHash(filePath, contentHash):
+    pass
+
+  return contentHash.hexdigest()
+
+
+
+
+def iterateRecordIds (filePath):
+  with c3JsonStream.openTextFile(filePath) as textFile:
+    for record in c3JsonStream.iterateLocalRecords(c3JsonStream.readTextChunks(textFile)):
+      yield record['id']
+
+
+
+
+class HashingTextWriter:
+  # Hashes text on its way into a file, so a freshly written file gets a manifest entry without being read back
+  def __init__ (self, textFile, contentHash):
+    self.textFile = textFile
+    self.contentHash = contentHash
+
+  def write (self, text):
+    self.contentHash.update(text.encode('utf-8'))
+    return self.textFile.write(text)
+
+
+
+
+def createManifestEntry (directory, c3Type, filePath, fileStat, contentHash, idDigestWriter):
+  manifestEntry = {
+    'size':         fileStat.st_size,
+    'mtimeNs':      fileStat.st_mtime_ns,
+    'contentHash':  contentHash.hexdigest(),
+    'recordCount':  len(idDigestWriter),
+    'idDigestFile': os.path.basename(filePath) + '.ids',
+  }
+  idDigestWriter.write(getIdDigestPath(directory, c3Type, manifestEntry))
+
+  return manifestEntry
+
+
+
+
+def scanFile (directory, c3Type, filePath, onRecord=None, idBufferBytes=ID_BUFFER_BYTES):
+  # onRecord sees every record as it streams by, so callers can do more work in the same read of the file
+  fileStat = os.stat(filePath)
+  contentHash = hashlib.sha1()
+  idDigestWriter = IdDigestWriter(idBufferBytes)
+  for record in c3JsonStream.iterateLocalRecords(_iterateTextChunksAndHash(filePath, contentHash)):
+    idDigestWriter.append(hashId(record['id']))
+    if (onRecord != None):
+      onRecord(record)
+
+  return createManifestEntry(directory, c3Type, filePath, fileStat, contentHash, idDigestWriter)
+
+
+
+
+def isManifestEntryCurrent (manifestEntry, fileStat):
+  return ((manifestEntry['size'] == fileStat.st_size) and (manifestEntry['mtimeNs'] == fileStat.st_mtime_ns))
+
+
+
+
+def getIdBufferBytes (memoryCeilingMB, numConcurrentScans):
+  # Every file scanned at the same time gets an equal share of the ceiling for its id hashes
+  return int(memoryCeilingMB * 1024 * 1024) // max(numConcurrentScans, 1)
+
+
+
+
+def getCurrentManifestEntry (directory, c3Type, manifest, filePath):
+  # The cached entry of the file, or None when the file changed since it was last scanned
+  fileName = os.path.basename(filePath)
+  fileStat = os.stat(filePath)
+  manifestEntry = manifest.get(fileName)
+
+  if ((manifestEntry != None) and os.path.exists(getIdDigestPath(directory, c3Type, manifestEntry))):
+    if (isManifestEntryCurrent(manifestEntry, fileStat)):
+      return manifestEntry
+    if ((manifestEntry['size'] == fileStat.st_size) and (manifestEntry['contentHash'] == _hashFileContents(filePath))):
+      manifestEntry['mtimeNs'] = fileStat.st_mtime_ns # Touched but unchanged
+      return manifestEntry
+
+  return None
+
+
+
+
+def getScanManifestEntry (directory, c3Type, manifest, filePath, idBufferBytes=ID_BUFFER_BYTES):
+  # Reuses the cached record count & id digest unless the file changed since it was last scanned
+  manifestEntry = getCurrentManifestEntry(directory, c3Type, manifest, filePath)
+  if (manifestEntry != None):
+    return manifestEntry
+
+  return scanFile(directory, c3Type, filePath, None, idBufferBytes)
@@ -0,0 +1,79 @@
+__author__ = 'Jackson DeDobbelaere'
+__credits__ = ['Jackson DeDobbelaere']
+__maintainer__ = 'Jackson DeDobbealere'
+__email__ = 'jackson.dedobbelaere@c3.ai'
+
+
+#!/usr/bin/env python3
+import json
+import os
+import time
+from pathlib import Path
+
+
+
+
+schemaCacheFilePath = os.path.join(str(Path.home()), '.c3DataTransferTool', 'fieldLabelCache.json')
+_schemaCache = None
+
+
+
+
+def _generateCacheKey (r, c3Type):
+  return '|'.join([r.env, r.tenant, r.tag, c3Type])
+
+
+
+
+def _loadSchemaCache ():
+  global _schemaCache
+  if (_schemaCache == None):
+    _schemaCache = {}
+    try:
+      with open(schemaCacheFilePath, 'r') as f:
+        _schemaCache = json.load(f)
+    except:
+      pass # Missing or corrupt cache is treated as empty
+
+  return _schemaCache
+
+
+
+
+def _saveSchemaCache ():
+  try:
+    Path(schemaCacheFilePath).parent.mkdir(parents=True, exist_ok=True)
+    tempFilePath = schemaCacheFilePath + '.' + str(os.getpid()) + '.tmp'
+    with open(tempFilePath, 'w') as f:
+      json.dump(_schemaCache, f)
+    os.replace(tempFilePath, schemaCacheFilePath)
+  except:
+    pass # Cache is an optimization only, never fail the run over it
+
+
+
+
+def getCachedFieldLabelMap (r, c3Type, cacheTTLSeconds):
+  if (cacheTTLSeconds <= 0):
+    return None
+
+  entry = _loadSchemaCache().get(_generateCacheKey(r, c3Type))
+  if ((entry == None) or ((time.time() - entry['cachedAt']) > cacheTTLSeconds)):
+    return None
+
+  return entry['fieldLabelMap']
+
+
+
+
+def putCachedFieldLabelMaps (r, fieldLabelMaps, cacheTTLSeconds):
+  if ((cacheTTLSeconds <= 0) or (len(fieldLabelMaps) == 0)):
+    return
+
+  schemaCache = _loadSchemaCache()
+  for c3Type, fieldLabelMap in fieldLabelMaps.items():
+    schemaCache[_generateCacheKey(r, c3Type)] = {
+      'cachedAt':      time.time(),
+      'fieldLabelMap': fieldLabelMap,
+    }
+  _saveSchemaCache()
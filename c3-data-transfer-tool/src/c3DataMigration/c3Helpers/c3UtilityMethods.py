@@ -9,12 +9,15 @@ import json
 import math
 import os
 import requests
-import time
 import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from datetime import datetime
 from reprint import output
+from c3DataMigration.c3Helpers import c3EnvMetadata
 from c3DataMigration.c3Helpers import c3FileSystem
+from c3DataMigration.c3Helpers import c3JobMonitor
 from c3DataMigration.c3Helpers import c3Request
+from c3DataMigration.c3Helpers import c3SchemaCache
 
 
 
@@ -41,6 +44,56 @@ def stripMetaAndDerivedFieldsFromRecords (records, fieldLabelMap):
 
 
 
+def runInThreadPool (maxWorkers, func, listOfArgs, progressBar=None, onResult=None):
+  results = [None] * len(listOfArgs)
+  with ThreadPoolExecutor(max_workers=max(1, maxWorkers)) as executor:
+    futureToIdx = { executor.submit(func, *args): idx for idx, args in enumerate(listOfArgs) }
+    for future in as_completed(futureToIdx):
+      results[futureToIdx[future]] = future.result()
+      if (onResult != None):
+        onResult(results[futureToIdx[future]])
+      if (progressBar != None):
+        progressBar.next()
+
+  return results # Same order as listOfArgs, regardless of completion order
+
+
+
+
+def runInProcessPool (maxWorkers, func, listOfArgs, progressBar=None, initializer=None, initargs=()):
+  results = [None] * len(listOfArgs)
+  if ((maxWorkers <= 1) or (len(listOfArgs) <= 1)):
+    if (initializer != None):
+      initializer(*initargs)
+    for idx, args in enumerate(listOfArgs):
+      results[idx] = func(*args)
+      if (progressBar != None):
+        progressBar.next()
+    return results
+
+  with ProcessPoolExecutor(max_workers=min(maxWorkers, len(listOfArgs)), initializer=initializer, initargs=initargs) as executor:
+    futureToIdx = { executor.submit(func, *args): idx for idx, args in enumerate(listOfArgs) }
+    for future in as_completed(futureToIdx):
+      results[futureToIdx[future]] = future.result()
+      if (progressBar != None):
+        progressBar.next()
+
+  return results # Same order as listOfArgs, regardless of completion order
+
+
+
+
+def formatBytes (numBytes):
+  for unit in ['B', 'KB', 'MB', 'GB']:
+    if (abs(numBytes) < 1024):
+      return '{:,.1f}'.format(numBytes) + unit
+    numBytes /= 1024
+
+  return '{:,.1f}'.format(numBytes) + 'TB'
+
+
+
+
 def printFormatWrapMaxColumnLength (string, maxColumnPrintLength, printToConsole):
   chunks = [string[i:i+maxColumnPrintLength] for i in range(0, len(string), maxColumnPrintLength)]
   if (printToConsole):
@@ -99,47 +152,61 @@ def getLatestVersionC3DataTransferTool ():
 
 
 
-def getc3Context (r, errorSleepTimeSeconds):
+def executeJSOnEnv (r, errorSleepTimeSeconds, jsExecCode, errorCodePrefix):
   url = c3Request.generateTypeActionURL(r, 'JS', 'exec')
   payload = {
-    'js': 'c3Context()'
+    'js': jsExecCode
   }
-  errorCodePrefix = 'Unsuccessful getting c3Context'
   request = c3Request.makeRequest(r, errorSleepTimeSeconds, url, payload, errorCodePrefix)
 
-  c3Context = None
+  retVal = None
   try:
-    c3Context = json.loads(ET.ElementTree(ET.fromstring(request.text)).getroot())
+    retVal = json.loads(ET.ElementTree(ET.fromstring(request.text)).getroot())
   except:
     try:
-      c3Context = json.loads(json.loads(request.text))
+      retVal = json.loads(json.loads(request.text))
     except:
-      retVal = c3Request.parseXMLValueFromString(request.text, 'execResponse')
-      c3Context = json.loads(retVal)
+      retVal = json.loads(c3Request.parseXMLValueFromString(request.text, 'execResponse'))
+
+  return retVal
+
+
+
+
+def getc3Context (r, errorSleepTimeSeconds):
+  c3Context = c3EnvMetadata.getRunMetadata('c3Context')
+  if (c3Context == None):
+    c3Context = executeJSOnEnv(r, errorSleepTimeSeconds, 'c3Context()', 'Unsuccessful getting c3Context')
+    c3EnvMetadata.setRunMetadata('c3Context', c3Context)
 
   return c3Context
 
 
 
 
+queueNamesToEnableByDefault = [
+  'ActionQueue',
+  'BatchQueue',
+  'CalcFieldsQueue',
+  'MapReduceQueue',
+  'ChangeLogQueue',
+  'NormalizationQueue',
+]
 def enableQueues (r, p, promptUser=True, listOfQueueNamesToEnable=None):
   if (listOfQueueNamesToEnable == None):
-    listOfQueueNamesToEnable = [
-      'ActionQueue',
-      'BatchQueue',
-      'CalcFieldsQueue',
-      'MapReduceQueue',
-      'ChangeLogQueue',
-      'NormalizationQueue',
-    ]
+    listOfQueueNamesToEnable = queueNamesToEnableByDefault
 
+  queuesPaused = c3EnvMetadata.getRunMetadata('queuesPaused', {})
   queueNamesToEnable = []
   for queueName in listOfQueueNamesToEnable:
-    url = c3Request.generateTypeActionURL(r, queueName, 'isPaused')
-    errorCodePrefix = 'Unsuccessful checking status of queue: ' + queueName
-    request = c3Request.makeRequest(r, p.errorSleepTimeSeconds, url, None, errorCodePrefix)
-    retVal = c3Request.parseXMLValueFromString(request.text.replace('"', ''), 'isPausedResponse')
-    if (retVal == 'true'):
+    if (queueName in queuesPaused):
+      isPaused = queuesPaused[queueName]
+    else:
+      url = c3Request.generateTypeActionURL(r, queueName, 'isPaused')
+      errorCodePrefix = 'Unsuccessful checking status of queue: ' + queueName
+      request = c3Request.makeRequest(r, p.errorSleepTimeSeconds, url, None, errorCodePrefix)
+      isPaused = (c3Request.parseXMLValueFromString(request.text.replace('"', ''), 'isPausedResponse') == 'true')
+    if (isPaused == True):
       queueNamesToEnable.append(queueName)
 
   if ((promptUser == True) and (len(queueNamesToEnable) > 0)):
@@ -153,12 +220,18 @@ def enableQueues (r, p, promptUser=True, listOfQueueNamesToEnable=None):
     url = c3Request.generateTypeActionURL(r, queueName, 'resume')
     errorCodePrefix = 'Unsuccessful resuming queue: ' + queueName
     request = c3Request.makeRequest(r, p.errorSleepTimeSeconds, url, None, errorCodePrefix)
+    queuesPaused[queueName] = False
     print('Resumed Queue: ' + queueName)
 
 
 
 
-def fetchCountOnType (r, errorSleepTimeSeconds, c3Type, filterString):
+def fetchCountOnType (r, errorSleepTimeSeconds, c3Type, filterString, usePreflightCount=False):
+  if (usePreflightCount == True):
+    preflightCount = c3EnvMetadata.popPreflightTypeCount(c3Type, filterString)
+    if (preflightCount != None):
+      return preflightCount
+
   url = c3Request.generateTypeActionURL(r, c3Type, 'fetchCount')
   payload = {
     'spec': {
@@ -174,47 +247,63 @@ def fetchCountOnType (r, errorSleepTimeSeconds, c3Type, filterString):
 
 
 
-def retrieveLabeledFields (r, c3Type, errorSleepTimeSeconds):
+def retrieveLabeledFieldsForTypes (r, c3Types, errorSleepTimeSeconds, cacheTTLSeconds=0):
+  runFieldLabelMaps = c3EnvMetadata.getRunMetadata('fieldLabelMaps')
+  if (runFieldLabelMaps == None):
+    runFieldLabelMaps = {}
+    c3EnvMetadata.setRunMetadata('fieldLabelMaps', runFieldLabelMaps)
+
+  fieldLabelMaps = {}
+  for c3Type in c3Types:
+    fieldLabelMap = runFieldLabelMaps.get(c3Type) or c3SchemaCache.getCachedFieldLabelMap(r, c3Type, cacheTTLSeconds)
+    if (fieldLabelMap != None):
+      fieldLabelMaps[c3Type] = fieldLabelMap
+
+  c3TypesToFetch = [x for x in dict.fromkeys(c3Types) if (x not in fieldLabelMaps)]
+  if (len(c3TypesToFetch) == 0):
+    return fieldLabelMaps
+
   jsExecCode = """
-    var fieldLabelMap = {
-      calcFieldArr: [],
-      foreignKeyFieldArr: [],
-      timedValueHistoryFieldArr: [],
-    };
-    INSERT_HERE_FOR_FORMAT.fieldTypes().forEach(function(fieldType) {
-      var fieldExtensions = fieldType.extensions().db || {};
-      var fieldName = fieldType._init.name;
-      if (fieldExtensions.calculated != null) {
-        fieldLabelMap.calcFieldArr.push(fieldName);
-      }
-      if (fieldExtensions.fkey != null) {
-        fieldLabelMap.foreignKeyFieldArr.push(fieldName);
-      }
-      if (fieldExtensions.timedValueHistoryField != null) {
-        fieldLabelMap.timedValueHistoryFieldArr.push(fieldName);
-      }
-    });
-    fieldLabelMap
-  """.replace('INSERT_HERE_FOR_FORMAT', c3Type)
+    function labelFields (c3TypeToLabel) {
+      var fieldLabelMap = {
+        calcFieldArr: [],
+        foreignKeyFieldArr: [],
+        timedValueHistoryFieldArr: [],
+      };
+      c3TypeToLabel.fieldTypes().forEach(function(fieldType) {
+        var fieldExtensions = fieldType.extensions().db || {};
+        var fieldName = fieldType._init.name;
+        if (fieldExtensions.calculated != null) {
+          fieldLabelMap.calcFieldArr.push(fieldName);
+        }
+        if (fieldExtensions.fkey != null) {
+          fieldLabelMap.foreignKeyFieldArr.push(fieldName);
+        }
+        if (fieldExtensions.timedValueHistoryField != null) {
+          fieldLabelMap.timedValueHistoryFieldArr.push(fieldName);
+        }
+      });
+      return fieldLabelMap;
+    }
+    var fieldLabelMaps = {};
+  """
+  for c3Type in c3TypesToFetch:
+    jsExecCode += 'fieldLabelMaps.{0} = labelFields({0});\n'.format(c3Type)
+  jsExecCode += 'fieldLabelMaps'
 
-  url = c3Request.generateTypeActionURL(r, 'JS', 'exec')
-  payload = {
-    'js': jsExecCode
-  }
-  errorCodePrefix = 'Unsuccessful getting fieldTypes for: ' + c3Type
-  request = c3Request.makeRequest(r, errorSleepTimeSeconds, url, payload, errorCodePrefix)
+  errorCodePrefix = 'Unsuccessful getting fieldTypes for: ' + ', '.join(c3TypesToFetch)
+  fetchedFieldLabelMaps = executeJSOnEnv(r, errorSleepTimeSeconds, jsExecCode, errorCodePrefix)
+  c3SchemaCache.putCachedFieldLabelMaps(r, fetchedFieldLabelMaps, cacheTTLSeconds)
+  runFieldLabelMaps.update(fetchedFieldLabelMaps)
+  fieldLabelMaps.update(fetchedFieldLabelMaps)
 
-  fieldTypes = None
-  try:
-    fieldTypes = json.loads(ET.ElementTree(ET.fromstring(request.text)).getroot())
-  except:
-    try:
-      fieldTypes = json.loads(json.loads(request.text))
-    except:
-      retVal = c3Request.parseXMLValueFromString(request.text, 'execResponse')
-      fieldTypes = json.loads(retVal)
+  return fieldLabelMaps
 
-  return fieldTypes
+
+
+
+def retrieveLabeledFields (r, c3Type, errorSleepTimeSeconds, cacheTTLSeconds=0):
+  return retrieveLabeledFieldsForTypes(r, [c3Type], errorSleepTimeSeconds, cacheTTLSeconds)[c3Type]
 
 
 
@@ -285,33 +374,63 @@ def createInitialBatchJobStatusEntry (request, c3Type, c3TypeToBatchJobMapping,
 
 
 
-def waitForBatchJobsToComplete (r, p, c3TypeToBatchJobMapping, jobType, typeOfBatchJob=None):
-  jobsStillRunning = [x for x in c3TypeToBatchJobMapping if ((x[1]['id'] != None) and (x[1]['status'] in ['submitted', 'running']))]
-  with output(output_type='list', initial_len=len(c3TypeToBatchJobMapping), interval=0) as outputLines:
-    while (len(jobsStillRunning) > 0):
-      time.sleep(p.refreshPollTimeSeconds)
-      for c3TypeToBatchJob in jobsStillRunning:
-        url = c3Request.generateTypeActionURL(r, jobType, 'get')
-        payload = {
-          'this': {
-            'id':  c3TypeToBatchJob[1]['id']
-          },
-          'include': 'run',
-        }
+def fetchBatchJobStatusesAndCounts (r, errorSleepTimeSeconds, jobType, batchJobIds, c3TypesToCount):
+  # One JS.exec per poll cycle instead of one <jobType>.get (and fetchCount) per job
+  include = 'id, run'
+  statusExpression = '(job.run && job.run.status) ? job.run.status.status : null'
+  if (jobType == 'AsyncAction'):
+    include = 'id, completed'
+    statusExpression = "job.completed ? 'completed' : 'running'"
+
+  jsExecCode = """
+    var pollResult = { statuses: {}, typeCounts: {} };
+    var jobs = INSERT_JOB_TYPE_HERE.fetch({ filter: INSERT_FILTER_HERE, include: INSERT_INCLUDE_HERE, limit: -1 });
+    (jobs.objs || []).forEach(function(job) {
+      pollResult.statuses[job.id] = INSERT_STATUS_HERE;
+    });
+  """
+  jsExecCode = jsExecCode.replace('INSERT_JOB_TYPE_HERE', jobType)
+  jsExecCode = jsExecCode.replace('INSERT_FILTER_HERE', json.dumps('intersects(id, [' + ','.join(json.dumps(x) for x in batchJobIds) + '])'))
+  jsExecCode = jsExecCode.replace('INSERT_INCLUDE_HERE', json.dumps(include))
+  jsExecCode = jsExecCode.replace('INSERT_STATUS_HERE', statusExpression)
+  for c3Type in dict.fromkeys(c3TypesToCount):
+    jsExecCode += 'pollResult.typeCounts.{0} = {0}.fetchCount({{ filter: "1 == 1" }});\n'.format(c3Type)
+  jsExecCode += 'pollResult'
+
+  errorCodePrefix = 'Unsuccessful grabbing statuses of ' + jobType + ' for types ' + ', '.join(dict.fromkeys(c3TypesToCount))
+  pollResult = executeJSOnEnv(r, errorSleepTimeSeconds, jsExecCode, errorCodePrefix)
+
+  return pollResult['statuses'], { x: int(y) for x, y in pollResult['typeCounts'].items() }
+
 
-        errorCodePrefix = 'Unsuccessful grabbing status of ' + jobType + ' for type ' + c3TypeToBatchJob[0]
-        request = c3Request.makeRequest(r, p.errorSleepTimeSeconds, url, payload, errorCodePrefix)
 
-        runStatus = ET.ElementTree(ET.fromstring(request.text)).getroot().find('./run/status/status').text
-        c3TypeToBatchJob[1]['status'] = runStatus
-        if (runStatus == 'completed'):
-          c3TypeToBatchJob[1]['completionTime'] = datetime.now()
 
-        if (typeOfBatchJob == 'importAction'):
-          c3TypeToBatchJob[1]['currentFetchCount'] = fetchCountOnType(r, p.errorSleepTimeSeconds, c3TypeToBatchJob[0], '1 == 1')
+def pollBatchJobs (r, p, jobsToPoll, jobType, typeOfBatchJob=None):
+  batchJobIds = [x[1]['id'] for x in jobsToPoll]
+  c3TypesToCount = [x[0] for x in jobsToPoll] if (typeOfBatchJob in ['importAction', 'removeAllAsyncAction']) else []
+  statuses, typeCounts = fetchBatchJobStatusesAndCounts(r, p.errorSleepTimeSeconds, jobType, batchJobIds, c3TypesToCount)
 
+  for c3TypeToBatchJob in jobsToPoll:
+    runStatus = statuses.get(c3TypeToBatchJob[1]['id'])
+    if (runStatus != None):
+      c3TypeToBatchJob[1]['status'] = runStatus
+      if (runStatus == 'completed'):
+        c3TypeToBatchJob[1]['completionTime'] = datetime.now()
+
+    if (c3TypeToBatchJob[0] in typeCounts):
+      c3TypeToBatchJob[1]['currentFetchCount'] = typeCounts[c3TypeToBatchJob[0]]
+
+
+
+
+def waitForBatchJobsToComplete (r, p, c3TypeToBatchJobMapping, jobType, typeOfBatchJob=None):
+  def pollJobs (jobsToPoll):
+    pollBatchJobs(r, p, jobsToPoll, jobType, typeOfBatchJob)
+
+  with output(output_type='list', initial_len=len(c3TypeToBatchJobMapping), interval=0) as outputLines:
+    def renderStatuses ():
       printBatchJobStatuses(c3TypeToBatchJobMapping, outputLines, p.maxColumnPrintLength, typeOfBatchJob)
-      jobsStillRunning = [x for x in c3TypeToBatchJobMapping if ((x[1]['id'] != None) and (x[1]['status'] in ['submitted', 'running']))]
+    c3JobMonitor.monitorBatchJobs(p, c3TypeToBatchJobMapping, pollJobs, renderStatuses)
 
 
 
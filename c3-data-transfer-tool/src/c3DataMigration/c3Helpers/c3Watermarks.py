@@ -0,0 +1,92 @@
+__author__ = 'Jackson DeDobbelaere'
+__credits__ = ['Jackson DeDobbelaere']
+__maintainer__ = 'Jackson DeDobbealere'
+__email__ = 'jackson.dedobbelaere@c3.ai'
+
+
+#!/usr/bin/env python3
+import json
+import os
+from c3DataMigration.c3Helpers import c3FileSystem
+
+
+
+
+watermarksFileName = '.c3Watermarks.json'
+deltaFolderName = '.c3Delta'
+watermarkField = 'meta.updated'
+
+
+
+
+def _getWatermarksFilePath (p):
+  return '/'.join([p.dataDownloadFolder, watermarksFileName])
+
+
+
+
+def _generateWatermarkKey (r, c3Type, filterString):
+  # A different filter covers a different population, so it starts over from a full export
+  return '|'.join([r.env, r.tenant, r.tag, c3Type, filterString])
+
+
+
+
+def _loadWatermarks (p):
+  try:
+    with open(_getWatermarksFilePath(p), 'r') as f:
+      return json.load(f)
+  except:
+    return {} # Missing or corrupt watermarks mean full exports
+
+
+
+
+def getDeltaDownloadFolder (p):
+  return '/'.join([p.dataDownloadFolder, deltaFolderName])
+
+
+
+
+def getExportFilesFolder (p):
+  return getDeltaDownloadFolder(p) if (p.incrementalDownload == True) else p.dataDownloadFolder
+
+
+
+
+def getWatermark (r, p, c3Type, filterString):
+  watermark = _loadWatermarks(p).get(_generateWatermarkKey(r, c3Type, filterString))
+  localFilePaths = c3FileSystem.getLocalFilePathsWithinDirectory('/'.join([p.dataDownloadFolder, c3Type]), '.json')
+  return watermark if (len(localFilePaths) > 0) else None # Nothing to merge a delta into without the local data
+
+
+
+
+def assignExportFilters (r, p):
+  # exportFilter is the filter actually exported with, the user's filter AND'd with the type's watermark
+  for dataTypeExport in p.dataTypeExports:
+    c3Type = dataTypeExport[0]
+    filterString = dataTypeExport[1]['filter']
+    dataTypeExport[1]['exportFilter'] = filterString
+    dataTypeExport[1]['watermark'] = None
+
+    if (p.incrementalDownload == True):
+      watermark = getWatermark(r, p, c3Type, filterString)
+      if (watermark != None):
+        watermarkFilter = watermarkField + ' >= dateTime(' + json.dumps(watermark) + ')'
+        dataTypeExport[1]['exportFilter'] = watermarkFilter if (filterString.strip() == '') else '(' + filterString + ') && ' + watermarkFilter
+        dataTypeExport[1]['watermark'] = watermark
+
+
+
+
+def saveWatermarks (r, p, c3TypeToWatermark):
+  watermarks = _loadWatermarks(p)
+  for dataTypeExport in p.dataTypeExports:
+    if (c3TypeToWatermark.get(dataTypeExport[0]) != None):
+      watermarks[_generateWatermarkKey(r, dataTypeExport[0], dataTypeExport[1]['filter'])] = c3TypeToWatermark[dataTypeExport[0]]
+
+  tempFilePath = _getWatermarksFilePath(p) + '.tmp'
+  with open(tempFilePath, 'w') as f:
+    json.dump(watermarks, f, indent=2, sort_keys=True)
+  os.replace(tempFilePath, _getWatermarksFilePath(p))
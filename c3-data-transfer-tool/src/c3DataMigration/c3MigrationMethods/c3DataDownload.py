@@ -5,12 +5,20 @@ __email__ = 'jackson.dedobbelaere@c3.ai'
 
 
 #!/usr/bin/env python3
+import os
+import time
 import xml.etree.ElementTree as ET
 from progress.bar import IncrementalBar
 from functools import reduce
+from c3DataMigration.c3Helpers import c3EnvMetadata
+from c3DataMigration.c3Helpers import c3ExportSharding
 from c3DataMigration.c3Helpers import c3FileSystem
+from c3DataMigration.c3Helpers import c3JsonStream
+from c3DataMigration.c3Helpers import c3RunJournal
+from c3DataMigration.c3Helpers import c3ScanManifest
 from c3DataMigration.c3Helpers import c3UsageStats
 from c3DataMigration.c3Helpers import c3UtilityMethods
+from c3DataMigration.c3Helpers import c3Watermarks
 from c3DataMigration.c3Helpers import c3Request
 
 
@@ -29,8 +37,8 @@ def _startDataDownloadFromEnv(r, p):
       c3UtilityMethods.printFormatExtraPeriods('Kicking off ' + c3Type, 'DOWNLOAD FLAG IS FALSE', p.maxColumnPrintLength, True)
       continue
 
-    recordCount = c3UtilityMethods.fetchCountOnType(r, p.errorSleepTimeSeconds, c3Type, dataTypeExport[1]['filter'])
-    dataTypeExport[1]['numFiles'] = round(recordCount / dataTypeExport[1]['numRecordsPerFile'])
+    recordCount = c3UtilityMethods.fetchCountOnType(r, p.errorSleepTimeSeconds, c3Type, dataTypeExport[1]['exportFilter'], True)
+    dataTypeExport[1]['numFiles'] = c3ExportSharding.planNumFiles(p, dataTypeExport, recordCount)
 
     url = c3Request.generateTypeActionURL(r, 'Export', 'startExport')
     payload = {
@@ -38,7 +46,7 @@ def _startDataDownloadFromEnv(r, p):
         'targetType':                 c3Type,
         'contentType':                'json',
         'jsonInclude':                dataTypeExport[1]['include'],
-        'filter':                     dataTypeExport[1]['filter'],
+        'filter':                     dataTypeExport[1]['exportFilter'],
         'fileUrlOrEncodedPathPrefix': '/'.join(['c3-cp/exports', scriptRunnerUsername, c3Type]),
         'failIfUrlNotEmpty':          False,
         'contentEncoding':            'gzip',
@@ -48,8 +56,11 @@ def _startDataDownloadFromEnv(r, p):
     errorCodePrefix = 'Unsuccessful kicking off export of type ' + c3Type
     request = c3Request.makeRequest(r, p.errorSleepTimeSeconds, url, payload, errorCodePrefix)
 
-    batchJobId = c3UtilityMethods.createInitialBatchJobStatusEntry(request, c3Type, c3TypeToBatchJobMapping, dataTypeExport[1]['filter'])
-    c3UtilityMethods.printFormatExtraPeriods('Kicking off ' + c3Type, 'id=' + str(batchJobId), p.maxColumnPrintLength, True)
+    batchJobId = c3UtilityMethods.createInitialBatchJobStatusEntry(request, c3Type, c3TypeToBatchJobMapping, dataTypeExport[1]['exportFilter'])
+    c3TypeToBatchJobMapping[-1][1]['exportStartTime'] = c3EnvMetadata.getRunMetadata('serverTime') # Journaled along with the job
+    kickedOffString = 'id=' + str(batchJobId) if (dataTypeExport[1]['watermark'] == None) else 'DELTA SINCE ' + dataTypeExport[1]['watermark'] + ' id=' + str(batchJobId)
+    kickedOffString += ' files=' + str(dataTypeExport[1]['numFiles'])
+    c3UtilityMethods.printFormatExtraPeriods('Kicking off ' + c3Type, kickedOffString, p.maxColumnPrintLength, True)
 
   return c3TypeToBatchJobMapping
 
@@ -77,13 +88,77 @@ def _finishDataDownloadFromEnv(r, p, c3TypeToBatchJobMapping):
 
 
 
+def _fetchAndExtractGeneratedExportFile (r, p, c3Type, fullFileURL, downloadFilePath, fieldLabelMap, okayToSkip404Error, errorCodePrefix):
+  # The response goes through the gzip decoder & record stripper straight into the final .json, no .gz ever hits the disk
+  numBytes = [0]
+  def countBytes (chunks):
+    for chunk in chunks:
+      numBytes[0] += len(chunk)
+      yield chunk
+
+  def extractFile (chunks):
+    numBytes[0] = 0 # Counted again by every retry
+    idBufferBytes = c3ScanManifest.getIdBufferBytes(p.duplicateScanMemoryMB, p.maxConcurrentDownloads)
+    return c3FileSystem.extractC3JsonTypeStream(c3Watermarks.getExportFilesFolder(p), c3Type, countBytes(chunks), downloadFilePath[:-len('.gz')], p.stripMetadataAndDerived, fieldLabelMap, p.localDataFormat, idBufferBytes)
+
+  manifestEntry = c3Request.streamFileFromURL(r, p.errorSleepTimeSeconds, fullFileURL, extractFile, okayToSkip404Error, errorCodePrefix, c3JsonStream.CHUNK_SIZE)
+  c3RunJournal.completeFile('fetch', downloadFilePath)
+
+  return numBytes[0], manifestEntry
+
+
+
+
+def _fetchGeneratedExportFile (r, p, c3Type, fullFileURL, downloadFilePath, fieldLabelMap, okayToSkip404Error, errorCodePrefix):
+  if (p.extractWhileFetching == True):
+    return _fetchAndExtractGeneratedExportFile(r, p, c3Type, fullFileURL, downloadFilePath, fieldLabelMap, okayToSkip404Error, errorCodePrefix)
+
+  c3Request.downloadFileFromURL(r, p.errorSleepTimeSeconds, fullFileURL, downloadFilePath, okayToSkip404Error, errorCodePrefix)
+  c3RunJournal.completeFile('fetch', downloadFilePath)
+
+  return (os.path.getsize(downloadFilePath) if (os.path.exists(downloadFilePath)) else 0), None
+
+
+
+
+def _saveExtractedFileManifestEntries (p, listOfArgs, results):
+  manifestEntriesByType = {}
+  for args, result in zip(listOfArgs, results):
+    if (result[1] != None):
+      manifestEntriesByType.setdefault(args[2], {})[os.path.basename(args[4][:-len('.gz')])] = result[1]
+
+  for c3Type, manifestEntries in manifestEntriesByType.items():
+    manifest = c3ScanManifest.loadManifest(c3Watermarks.getExportFilesFolder(p), c3Type)
+    manifest.update(manifestEntries)
+    c3ScanManifest.saveManifest(c3Watermarks.getExportFilesFolder(p), c3Type, manifest)
+
+
+
+
+def _isExportFileAlreadyFetched (downloadFilePath):
+  # Once extracted, the .gz is gone & the .json it turned into is what is left of it
+  if (not c3RunJournal.isFileComplete('fetch', downloadFilePath)):
+    return False
+  return (os.path.exists(downloadFilePath) or os.path.exists(downloadFilePath[:-len('.gz')]))
+
+
+
+
 def _fetchGeneratedExportFiles (r, p, c3TypeToBatchJobMapping):
-  c3FileSystem.wipeLocalDirectory(p, p.dataDownloadFolder, False)
+  resumingFetch = c3RunJournal.hasCompletedFiles('fetch')
+
+  completedC3Types = [x[0] for x in c3TypeToBatchJobMapping if (x[1]['status'] in ['completed'])]
+  if ((p.extractWhileFetching == True) and (p.stripMetadataAndDerived == True)):
+    c3UtilityMethods.retrieveLabeledFieldsForTypes(r, completedC3Types, p.errorSleepTimeSeconds, p.schemaCacheTTLSeconds)
+
+  listOfArgs = []
+  numFilesAlreadyFetched = 0
   for c3TypeToBatchJob in c3TypeToBatchJobMapping:
     c3Type = c3TypeToBatchJob[0]
     fileUrls = c3TypeToBatchJob[1]['fileUrls']
-    dataTypeFilesFolderPath = '/'.join([p.dataDownloadFolder, c3Type])
-    c3FileSystem.wipeLocalDirectory(p, dataTypeFilesFolderPath, False)
+    dataTypeFilesFolderPath = '/'.join([c3Watermarks.getExportFilesFolder(p), c3Type])
+    if (not resumingFetch):
+      c3FileSystem.wipeLocalDirectory(p, dataTypeFilesFolderPath, False)
 
     if (c3TypeToBatchJob[1]['status'] in ['completed']):
       if (len(fileUrls) == 0):
@@ -92,25 +167,72 @@ def _fetchGeneratedExportFiles (r, p, c3TypeToBatchJobMapping):
 
       typeFetchCountWithFilter = c3UtilityMethods.fetchCountOnType(r, p.errorSleepTimeSeconds, c3Type, c3TypeToBatchJob[1]['filter'])
       okayToSkip404Error = (typeFetchCountWithFilter == 0)
+      fieldLabelMap = None
+      if ((p.extractWhileFetching == True) and (p.stripMetadataAndDerived == True)):
+        fieldLabelMap = c3UtilityMethods.retrieveLabeledFields(r, c3Type, p.errorSleepTimeSeconds, p.schemaCacheTTLSeconds)
 
-      result = c3UtilityMethods.printFormatExtraPeriods('Fetching ' + c3Type, ' |████████████████████████████████|', p.maxColumnPrintLength, False)
-      progressBar = IncrementalBar(''.join(result[:2]), max=len(fileUrls))
       for idx, fileUrl in enumerate(fileUrls):
         downloadFilePath = '/'.join([dataTypeFilesFolderPath, str(idx) + '.json.gz'])
+        if (_isExportFileAlreadyFetched(downloadFilePath)):
+          numFilesAlreadyFetched += 1
+          continue
         fullFileURL = c3Request.generateFileURL(r, fileUrl)
         errorCodePrefix = 'Unsuccessful pulling ' + c3Type + ': ' + fullFileURL
-        c3Request.downloadFileFromURL(r, p.errorSleepTimeSeconds, fullFileURL, downloadFilePath, okayToSkip404Error, errorCodePrefix)
-        [progressBar.next() for _ in range(1)]
-      progressBar.finish()
+        listOfArgs.append((r, p, c3Type, fullFileURL, downloadFilePath, fieldLabelMap, okayToSkip404Error, errorCodePrefix))
+      c3UtilityMethods.printFormatExtraPeriods('Queueing ' + c3Type, '{:,}'.format(len(fileUrls)) + ' FILES', p.maxColumnPrintLength, True)
     else:
       c3UtilityMethods.printFormatExtraPeriods('Fetching ' + c3Type, 'EXPORT JOB FAILED', p.maxColumnPrintLength, True)
 
+  if (numFilesAlreadyFetched > 0):
+    c3UtilityMethods.printFormatExtraPeriods('Skipping Already Fetched', '{:,}'.format(numFilesAlreadyFetched) + ' FILES', p.maxColumnPrintLength, True)
+
+  if (len(listOfArgs) == 0):
+    return
+
+  startTime = time.time()
+  totalBytes = [0]
+  def onFileFetched (result):
+    totalBytes[0] += result[0]
+    bytesPerSecond = totalBytes[0] / max(time.time() - startTime, 0.001)
+    progressBar.suffix = c3UtilityMethods.formatBytes(bytesPerSecond) + '/s'
+
+  result = c3UtilityMethods.printFormatExtraPeriods('Fetching All Types', ' |████████████████████████████████| ' + ('_' * 12), p.maxColumnPrintLength, False)
+  progressBar = IncrementalBar(''.join(result[:2]), max=len(listOfArgs), suffix='')
+  results = c3UtilityMethods.runInThreadPool(p.maxConcurrentDownloads, _fetchGeneratedExportFile, listOfArgs, progressBar, onFileFetched)
+  progressBar.finish()
+  _saveExtractedFileManifestEntries(p, listOfArgs, results)
+
+  elapsedSeconds = max(time.time() - startTime, 0.001)
+  suffix = ' '.join([c3UtilityMethods.formatBytes(totalBytes[0]), 'in', '{:,.1f}s'.format(elapsedSeconds), '@', c3UtilityMethods.formatBytes(totalBytes[0] / elapsedSeconds) + '/s'])
+  c3UtilityMethods.printFormatExtraPeriods('Fetched ' + '{:,}'.format(len(listOfArgs)) + ' Files', suffix, p.maxColumnPrintLength, True)
+
 
 
 
 def _extractGeneratedExportFiles (r, p, c3TypeToBatchJobMapping):
   c3Types = [x[0] for x in c3TypeToBatchJobMapping]
-  c3FileSystem.unzipFilesInDirectory(r, p, p.dataDownloadFolder, c3Types)
+  c3FileSystem.unzipFilesInDirectory(r, p, c3Watermarks.getExportFilesFolder(p), c3Types)
+
+
+
+
+def _mergeDeltaExportFiles (r, p, c3TypeToBatchJobMapping):
+  deltaDownloadFolder = c3Watermarks.getDeltaDownloadFolder(p)
+  newWatermarks = {}
+  for c3TypeToBatchJob in c3TypeToBatchJobMapping:
+    c3Type = c3TypeToBatchJob[0]
+    if (c3TypeToBatchJob[1]['status'] not in ['completed']):
+      c3UtilityMethods.printFormatExtraPeriods('Merging ' + c3Type, 'EXPORT JOB FAILED', p.maxColumnPrintLength, True)
+      continue
+
+    numDeltaRecords, numReplaced = c3FileSystem.mergeDeltaFilesIntoDirectory(deltaDownloadFolder, p.dataDownloadFolder, c3Type, p.localDataFormat)
+    newWatermarks[c3Type] = c3TypeToBatchJob[1]['exportStartTime']
+    suffix = '{:,}'.format(numDeltaRecords) + ' RECORDS (' + '{:,}'.format(numReplaced) + ' REPLACED)'
+    c3UtilityMethods.printFormatExtraPeriods('Merging ' + c3Type, suffix, p.maxColumnPrintLength, True)
+
+  # Env time from before the exports were kicked off, so nothing updated while they ran can fall between two deltas
+  c3Watermarks.saveWatermarks(r, p, newWatermarks)
+  c3FileSystem.wipeLocalDirectory(p, deltaDownloadFolder, False)
 
 
 
@@ -128,18 +250,36 @@ def downloadDataFromEnv (r, p):
     return
 
   c3UtilityMethods.printFormatExtraDashes('DOWNLOADING DATA FROM THE ENV', p.maxColumnPrintLength, True)
-  c3TypeToBatchJobMapping = _startDataDownloadFromEnv(r, p)
-  _finishDataDownloadFromEnv(r, p, c3TypeToBatchJobMapping)
-  c3UsageStats.DownloadAPI.logBatchJob(r, p, c3TypeToBatchJobMapping)
+  if (c3RunJournal.isPhaseComplete('export')):
+    c3RunJournal.printPhaseAlreadyComplete(p, 'export')
+    c3TypeToBatchJobMapping = c3RunJournal.getCompletedBatchJobMapping('export')
+  else:
+    c3TypeToBatchJobMapping = c3RunJournal.startOrReattachBatchJobs(p, 'export', lambda: _startDataDownloadFromEnv(r, p))
+    _finishDataDownloadFromEnv(r, p, c3TypeToBatchJobMapping)
+    c3RunJournal.completeBatchJobPhase('export', c3TypeToBatchJobMapping)
+    c3UsageStats.DownloadAPI.logBatchJob(r, p, c3TypeToBatchJobMapping)
 
   c3UtilityMethods.printFormatExtraDashes('CURLING DOWN GENERATED EXPORT FILES', p.maxColumnPrintLength, True)
-  _fetchGeneratedExportFiles(r, p, c3TypeToBatchJobMapping)
-  c3UsageStats.DownloadAPI.logCurlFiles(r, p)
+  if (c3RunJournal.isPhaseComplete('extract')):
+    c3RunJournal.printPhaseAlreadyComplete(p, 'fetch')
+  else:
+    _fetchGeneratedExportFiles(r, p, c3TypeToBatchJobMapping)
+    c3UsageStats.DownloadAPI.logCurlFiles(r, p)
 
   c3UtilityMethods.printFormatExtraDashes('EXTRACTING GENERATED EXPORT FILES', p.maxColumnPrintLength, True)
-  _extractGeneratedExportFiles(r, p, c3TypeToBatchJobMapping)
-  _cleanUpGeneratedExportFiles(r, p, c3TypeToBatchJobMapping)
-  c3UsageStats.DownloadAPI.logExtractFiles(r, p)
+  if (c3RunJournal.isPhaseComplete('extract')):
+    c3RunJournal.printPhaseAlreadyComplete(p, 'extract')
+  else:
+    # Files extracted before an interrupt have no .gz left, so only the rest get extracted
+    if (p.extractWhileFetching != True):
+      _extractGeneratedExportFiles(r, p, c3TypeToBatchJobMapping)
+    else:
+      c3UtilityMethods.printFormatExtraPeriods('Extracting All Types', 'DONE WHILE FETCHING', p.maxColumnPrintLength, True)
+    if (p.incrementalDownload == True):
+      _mergeDeltaExportFiles(r, p, c3TypeToBatchJobMapping)
+    _cleanUpGeneratedExportFiles(r, p, c3TypeToBatchJobMapping)
+    c3RunJournal.completePhase('extract')
+    c3UsageStats.DownloadAPI.logExtractFiles(r, p)
 
   c3UtilityMethods.printFormatExtraDashes('SCANNING DOWNLOAD FOLDER INFO', p.maxColumnPrintLength, True)
   c3FileSystem.scanFilesInDirectory(p, p.dataTypeExports, p.dataDownloadFolder, True)
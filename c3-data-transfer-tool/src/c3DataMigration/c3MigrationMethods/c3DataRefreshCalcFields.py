@@ -6,6 +6,7 @@ __email__ = 'jackson.dedobbelaere@c3.ai'
 
 #!/usr/bin/env python3
 from c3DataMigration.c3Helpers import c3Request
+from c3DataMigration.c3Helpers import c3RunJournal
 from c3DataMigration.c3Helpers import c3UsageStats
 from c3DataMigration.c3Helpers import c3UtilityMethods
 
@@ -13,6 +14,22 @@ from c3DataMigration.c3Helpers import c3UtilityMethods
 
 
 
+def startRefreshCalcFieldsOfType (r, p, dataType, c3TypeToBatchJobMapping):
+  c3Type = dataType[0]
+  url = c3Request.generateTypeActionURL(r, c3Type, 'refreshCalcFields')
+  errorCodePrefix = 'Unsuccessful kicking off refreshCalcFields of type ' + c3Type
+  payload = {
+    'spec': {
+      'filter': dataType[1]['filter'] if ('filter' in dataType[1]) else '1 == 1'
+    }
+  }
+  request = c3Request.makeRequest(r, p.errorSleepTimeSeconds, url, payload, errorCodePrefix)
+
+  return c3UtilityMethods.createInitialBatchJobStatusEntry(request, c3Type, c3TypeToBatchJobMapping, None)
+
+
+
+
 def _startRefreshCalcFieldsOnEnv (r, p, dataTypes):
   c3TypeToBatchJobMapping = []
   for dataType in dataTypes:
@@ -21,17 +38,7 @@ def _startRefreshCalcFieldsOnEnv (r, p, dataTypes):
       c3UtilityMethods.printFormatExtraPeriods('Kicking off ' + c3Type, 'REFRESH FLAG IS FALSE', p.maxColumnPrintLength, True)
       continue
 
-    url = c3Request.generateTypeActionURL(r, c3Type, 'refreshCalcFields')
-    errorCodePrefix = 'Unsuccessful kicking off refreshCalcFields of type ' + c3Type
-    payload = {
-      'spec': {
-        'filter': dataType[1]['filter'] if ('filter' in dataType[1]) else '1 == 1'
-      }
-    }
-    errorCodePrefix = 'Unsuccessful getting c3Context'
-    request = c3Request.makeRequest(r, p.errorSleepTimeSeconds, url, payload, errorCodePrefix)
-
-    batchJobId = c3UtilityMethods.createInitialBatchJobStatusEntry(request, c3Type, c3TypeToBatchJobMapping, None)
+    batchJobId = startRefreshCalcFieldsOfType(r, p, dataType, c3TypeToBatchJobMapping)
     c3UtilityMethods.printFormatExtraPeriods('Kicking off ' + c3Type, 'id=' + str(batchJobId), p.maxColumnPrintLength, True)
 
   return c3TypeToBatchJobMapping
@@ -46,13 +53,20 @@ def _finishRefreshCalcFieldsOnEnv (r, p, c3TypeToBatchJobMapping):
 
 
 
-def refreshDataOnEnv (r, p, dataTypes):
+def refreshDataOnEnv (r, p, dataTypes, c3TypeToBatchJobMapping=None):
+  # A mapping is passed in when the refreshes already ran type by type alongside the imports
   if (p.masterRefreshDataSwitch != True):
     return
 
-  c3UtilityMethods.printFormatExtraDashes('REFRESHING CALC FIELDS ON ENV', p.maxColumnPrintLength, True)
-  c3TypeToBatchJobMapping = _startRefreshCalcFieldsOnEnv(r, p, dataTypes)
-  _finishRefreshCalcFieldsOnEnv(r, p, c3TypeToBatchJobMapping)
+  if (c3TypeToBatchJobMapping == None):
+    c3UtilityMethods.printFormatExtraDashes('REFRESHING CALC FIELDS ON ENV', p.maxColumnPrintLength, True)
+    if (c3RunJournal.isPhaseComplete('refreshCalcs')):
+      c3RunJournal.printPhaseAlreadyComplete(p, 'refreshCalcs')
+      c3TypeToBatchJobMapping = c3RunJournal.getCompletedBatchJobMapping('refreshCalcs')
+    else:
+      c3TypeToBatchJobMapping = c3RunJournal.startOrReattachBatchJobs(p, 'refreshCalcs', lambda: _startRefreshCalcFieldsOnEnv(r, p, dataTypes))
+      _finishRefreshCalcFieldsOnEnv(r, p, c3TypeToBatchJobMapping)
+      c3RunJournal.completeBatchJobPhase('refreshCalcs', c3TypeToBatchJobMapping)
 
   c3UtilityMethods.printFormatExtraDashes('GENERATING CALC FIELDS QUEUE ERROR FILES', p.maxColumnPrintLength, True)
   jobType = 'RefreshCalcFieldsBatchJob'
@@ -5,17 +5,26 @@ __email__ = 'jackson.dedobbelaere@c3.ai'
 
 
 #!/usr/bin/env python3
-import time
-import xml.etree.ElementTree as ET
-from datetime import datetime
-from reprint import output
+import threading
+from c3DataMigration.c3Helpers import c3JobMonitor
 from c3DataMigration.c3Helpers import c3Request
+from c3DataMigration.c3Helpers import c3RunJournal
 from c3DataMigration.c3Helpers import c3UsageStats
 from c3DataMigration.c3Helpers import c3UtilityMethods
 
 
 
 
+_backgroundRemove = {
+  'mapping':        None,
+  'thread':         None,
+  'exception':      None,
+  'pendingC3Types': set(), # Types whose removeAll is still running on the env
+}
+_backgroundRemoveCondition = threading.Condition()
+
+
+
 
 def _startDataRemoveFromEnv (r, p):
   c3TypeToBatchJobMapping = []
@@ -25,7 +34,7 @@ def _startDataRemoveFromEnv (r, p):
       c3UtilityMethods.printFormatExtraPeriods('Kicking off ' + c3Type, 'REMOVE FLAG IS FALSE', p.maxColumnPrintLength, True)
       continue
 
-    totalRecordsOnEnv = c3UtilityMethods.fetchCountOnType(r, p.errorSleepTimeSeconds, c3Type, '1 == 1')
+    totalRecordsOnEnv = c3UtilityMethods.fetchCountOnType(r, p.errorSleepTimeSeconds, c3Type, '1 == 1', True)
 
     url = c3Request.generateTypeActionURL(r, 'AsyncAction', 'submit')
     payload = {
@@ -52,34 +61,8 @@ def _startDataRemoveFromEnv (r, p):
 
 
 def _finishRemoveDataFromEnv (r, p, c3TypeToBatchJobMapping):
-  jobsStillRunning = [x for x in c3TypeToBatchJobMapping if ((x[1]['id'] != None) and (x[1]['completionTime'] == None))]
-  with output(output_type='list', initial_len=len(c3TypeToBatchJobMapping), interval=0) as outputLines:
-    while (len(jobsStillRunning) > 0):
-      time.sleep(p.refreshPollTimeSeconds)
-
-      for c3TypeToBatchJob in jobsStillRunning:
-        c3Type = c3TypeToBatchJob[0]
-
-        url = c3Request.generateTypeActionURL(r, 'AsyncAction', 'get')
-        payload = {
-          'this': {
-            'id': c3TypeToBatchJob[1]['id'],
-            'actionName': 'null',
-          }
-        }
-        errorCodePrefix = 'Unsuccessful async removeAll status for type ' + c3Type
-        request = c3Request.makeRequest(r, p.errorSleepTimeSeconds, url, payload, errorCodePrefix)
-
-        completed = ET.ElementTree(ET.fromstring(request.text)).getroot().find('./completed').text
-        currentFetchCount = c3UtilityMethods.fetchCountOnType(r, p.errorSleepTimeSeconds, c3Type, '1 == 1')
-
-        if (completed == 'true'):
-          c3TypeToBatchJob[1]['completionTime'] = datetime.now()
-          c3TypeToBatchJob[1]['status'] = 'completed'
-        c3TypeToBatchJob[1]['currentFetchCount'] = currentFetchCount
-
-      c3UtilityMethods.printBatchJobStatuses(c3TypeToBatchJobMapping, outputLines, p.maxColumnPrintLength, 'removeAllAsyncAction')
-      jobsStillRunning = [x for x in c3TypeToBatchJobMapping if ((x[1]['id'] != None) and (x[1]['completionTime'] == None))]
+  jobType = 'AsyncAction'
+  c3UtilityMethods.waitForBatchJobsToComplete(r, p, c3TypeToBatchJobMapping, jobType, 'removeAllAsyncAction')
 
 
 
@@ -96,12 +79,111 @@ def _cleanUpAsyncRemoveActions (r, p, c3TypeToBatchJobMapping):
 
 
 
+def _completeRemoveDataFromEnv (r, p, c3TypeToBatchJobMapping):
+  _cleanUpAsyncRemoveActions(r, p, c3TypeToBatchJobMapping)
+  c3RunJournal.completeBatchJobPhase('remove', c3TypeToBatchJobMapping)
+  c3UsageStats.UploadAPI.logAPIRemove(r, p, c3TypeToBatchJobMapping)
+
+
+
+
+def _monitorRemoveInBackground (r, p, c3TypeToBatchJobMapping):
+  def pollJobs (jobsToPoll):
+    c3UtilityMethods.pollBatchJobs(r, p, jobsToPoll, 'AsyncAction', 'removeAllAsyncAction')
+
+  def onJobComplete (c3TypeToBatchJob):
+    with _backgroundRemoveCondition:
+      _backgroundRemove['pendingC3Types'].discard(c3TypeToBatchJob[0])
+      _backgroundRemoveCondition.notify_all()
+
+  try:
+    # Nothing is rendered from here, the local stages own the terminal until the remove gets printed in finishRemoveDataFromEnv
+    c3JobMonitor.monitorBatchJobs(p, c3TypeToBatchJobMapping, pollJobs, lambda: None, onJobComplete)
+  except BaseException as e:
+    _backgroundRemove['exception'] = e
+  finally:
+    with _backgroundRemoveCondition:
+      _backgroundRemove['pendingC3Types'].clear()
+      _backgroundRemoveCondition.notify_all()
+
+
+
+
+def startRemoveDataFromEnv (r, p):
+  # Kicks the removeAll actions off & keeps polling them on a background thread, so the local stages of the upload run meanwhile
+  if (p.masterRemoveDataSwitch != True):
+    return
+
+  c3UtilityMethods.printFormatExtraDashes('REMOVING PREVIOUS DATA FROM THE ENV', p.maxColumnPrintLength, True)
+  if (c3RunJournal.isPhaseComplete('remove')):
+    c3RunJournal.printPhaseAlreadyComplete(p, 'remove')
+    return
+
+  c3TypeToBatchJobMapping = c3RunJournal.startOrReattachBatchJobs(p, 'remove', lambda: _startDataRemoveFromEnv(r, p))
+  with _backgroundRemoveCondition:
+    _backgroundRemove['mapping'] = c3TypeToBatchJobMapping
+    _backgroundRemove['exception'] = None
+    _backgroundRemove['pendingC3Types'] = set(x[0] for x in c3TypeToBatchJobMapping if c3JobMonitor.isBatchJobRunning(x))
+  _backgroundRemove['thread'] = threading.Thread(target=_monitorRemoveInBackground, args=(r, p, c3TypeToBatchJobMapping), daemon=True)
+  _backgroundRemove['thread'].start()
+
+
+
+
+def waitForRemovesToFinish (c3Types):
+  # Blocks until the remove of at least one of c3Types is done (or was never started) & returns all such types
+  with _backgroundRemoveCondition:
+    while True:
+      if (_backgroundRemove['exception'] != None):
+        raise _backgroundRemove['exception']
+      removedC3Types = [x for x in c3Types if (x not in _backgroundRemove['pendingC3Types'])]
+      if ((len(removedC3Types) > 0) or (len(c3Types) == 0)):
+        return removedC3Types
+      _backgroundRemoveCondition.wait()
+
+
+
+
+def isRemoveFinished (c3Type):
+  with _backgroundRemoveCondition:
+    if (_backgroundRemove['exception'] != None):
+      raise _backgroundRemove['exception']
+    return (c3Type not in _backgroundRemove['pendingC3Types'])
+
+
+
+
+def finishRemoveDataFromEnv (r, p):
+  # Safe to call more than once, only the first call after startRemoveDataFromEnv does anything
+  c3TypeToBatchJobMapping = _backgroundRemove['mapping']
+  if (c3TypeToBatchJobMapping == None):
+    return
+
+  _backgroundRemove['thread'].join()
+  _backgroundRemove['mapping'] = None
+  _backgroundRemove['thread'] = None
+  if (_backgroundRemove['exception'] != None):
+    raise _backgroundRemove['exception']
+
+  c3UtilityMethods.printFormatExtraDashes('FINISHED REMOVING PREVIOUS DATA FROM THE ENV', p.maxColumnPrintLength, True)
+  outputLines = [''] * len(c3TypeToBatchJobMapping)
+  c3UtilityMethods.printBatchJobStatuses(c3TypeToBatchJobMapping, outputLines, p.maxColumnPrintLength, 'removeAllAsyncAction')
+  for outputLine in outputLines:
+    print(outputLine)
+  _completeRemoveDataFromEnv(r, p, c3TypeToBatchJobMapping)
+
+
+
+
 def removeDataFromEnv (r, p):
   if (p.masterRemoveDataSwitch != True):
     return
 
   c3UtilityMethods.printFormatExtraDashes('REMOVING PREVIOUS DATA FROM THE ENV', p.maxColumnPrintLength, True)
-  c3TypeToBatchJobMapping = _startDataRemoveFromEnv(r, p)
+  if (c3RunJournal.isPhaseComplete('remove')):
+    c3RunJournal.printPhaseAlreadyComplete(p, 'remove')
+    return
+
+  c3TypeToBatchJobMapping = c3RunJournal.startOrReattachBatchJobs(p, 'remove', lambda: _startDataRemoveFromEnv(r, p))
   _finishRemoveDataFromEnv(r, p, c3TypeToBatchJobMapping)
-  _cleanUpAsyncRemoveActions(r, p, c3TypeToBatchJobMapping)
-  c3UsageStats.UploadAPI.logAPIRemove(r, p, c3TypeToBatchJobMapping)
+  _completeRemoveDataFromEnv(r, p, c3TypeToBatchJobMapping)
@@ -5,94 +5,209 @@ __email__ = 'jackson.dedobbelaere@c3.ai'
 
 
 #!/usr/bin/env python3
+import os
+import threading
 from functools import reduce
 from progress.bar import IncrementalBar
+from reprint import output
 from c3DataMigration.c3Helpers import c3FileSystem
+from c3DataMigration.c3Helpers import c3JobMonitor
+from c3DataMigration.c3Helpers import c3JsonStream
+from c3DataMigration.c3Helpers import c3ParallelGzip
+from c3DataMigration.c3Helpers import c3RunJournal
 from c3DataMigration.c3Helpers import c3UsageStats
 from c3DataMigration.c3Helpers import c3UtilityMethods
 from c3DataMigration.c3Helpers import c3Request
+from c3DataMigration.c3MigrationMethods import c3DataRefreshCalcFields
+from c3DataMigration.c3MigrationMethods import c3DataRemove
 
 
 
 
-def _zipImportFiles (r, p):
-  existingGZipFilePaths = []
+def _getJournaledFileStats (filePaths):
+  return { x: [os.stat(x).st_size, os.stat(x).st_mtime_ns] for x in filePaths }
+
+
+
+
+def _restoreScanAndZipFromJournal (p):
+  # Only trusted while every file it points at is still on disk & untouched since it was zipped
+  scannedDataTypes = c3RunJournal.getCompletedPhaseData('scanAndZip')
+  if (scannedDataTypes == None):
+    return False
   for dataType in p.dataTypeImports:
-    c3Type = dataType[0]
-    dataTypeUploadFolder = '/'.join([p.dataUploadFolder, c3Type])
-    existingGZipFilePaths.extend(c3FileSystem.getLocalFilePathsWithinDirectory(dataTypeUploadFolder, '.gz'))
-  c3FileSystem.deleteLocalFiles(existingGZipFilePaths)
+    scannedDataType = scannedDataTypes.get(dataType[0], {})
+    filePaths = scannedDataType.get('gzipFiles', []) + scannedDataType.get('files', [])
+    if (not all(os.path.exists(x) for x in filePaths)):
+      return False
+    if (_getJournaledFileStats(filePaths) != scannedDataType.get('fileStats')):
+      return False
 
-  c3FileSystem.zipFilesInDirectory(r, p, p.dataUploadFolder, p.dataTypeImports)
   for dataType in p.dataTypeImports:
-    c3Type = dataType[0]
-    dataTypeUploadFolder = '/'.join([p.dataUploadFolder, c3Type])
-    dataType[1]['gzipFiles'] = c3FileSystem.getLocalFilePathsWithinDirectory(dataTypeUploadFolder, '.gz')
+    dataType[1].update({ x: y for x, y in scannedDataTypes.get(dataType[0], {}).items() if (x != 'fileStats') })
+  c3RunJournal.printPhaseAlreadyComplete(p, 'scanAndZip')
+  return True
 
 
 
 
-def _postImportFiles (r, p):
+def _scanAndZipImportFiles (r, p):
+  if (_restoreScanAndZipFromJournal(p)):
+    return
+  c3RunJournal.resetFiles('post') # Freshly zipped files may differ from anything an interrupted run posted
+
+  # scanAndZipFilesInDirectory keeps the .gz files of unchanged .json files, the other modes start from a clean folder
+  if ((p.compressOnTheFly == True) or (p.reshardImportFiles == True)):
+    existingGZipFilePaths = []
+    for dataType in p.dataTypeImports:
+      c3Type = dataType[0]
+      dataTypeUploadFolder = '/'.join([p.dataUploadFolder, c3Type])
+      existingGZipFilePaths.extend(c3FileSystem.getLocalFilePathsWithinDirectory(dataTypeUploadFolder, '.gz'))
+    c3FileSystem.deleteLocalFiles(existingGZipFilePaths)
+
+  if (p.compressOnTheFly == True):
+    c3FileSystem.scanFilesInDirectory(p, p.dataTypeImports, p.dataUploadFolder, True)
+    for dataType in p.dataTypeImports:
+      dataType[1]['gzipFiles'] = [] # Compressed while posting instead
+  elif (p.reshardImportFiles == True):
+    c3FileSystem.scanFilesInDirectory(p, p.dataTypeImports, p.dataUploadFolder, True)
+    c3FileSystem.reshardFilesInDirectory(r, p, p.dataUploadFolder, p.dataTypeImports)
+  else:
+    c3FileSystem.scanAndZipFilesInDirectory(r, p, p.dataUploadFolder, p.dataTypeImports, True)
+  scannedDataTypes = { x[0]: { y: x[1][y] for y in ['files', 'gzipFiles', 'recordCount'] if (y in x[1]) } for x in p.dataTypeImports }
+  for scannedDataType in scannedDataTypes.values():
+    scannedDataType['fileStats'] = _getJournaledFileStats(scannedDataType.get('gzipFiles', []) + scannedDataType.get('files', []))
+  c3RunJournal.completePhase('scanAndZip', scannedDataTypes)
+
+
+
+
+def _getFilePathsToPost (p, dataTypeImport):
+  return dataTypeImport[1].get('files', []) if (p.compressOnTheFly == True) else dataTypeImport[1]['gzipFiles']
+
+
+
+
+def _postImportFile (r, p, fullFileURL, filePath, fieldLabelMap, errorCodePrefix, remoteUploadFilePath):
+  if (p.compressOnTheFly == True):
+    createBody = lambda: c3FileSystem.iterateGzippedC3JsonTypeFile(filePath, p.stripMetadataAndDerived, fieldLabelMap, c3JsonStream.CHUNK_SIZE, p.compressionLevel, c3ParallelGzip.resolveCompressionThreads(p.compressionThreads, p.maxConcurrentUploads))
+    c3Request.uploadStreamToURL(r, p.errorSleepTimeSeconds, fullFileURL, createBody, errorCodePrefix)
+  else:
+    c3Request.uploadFileToURL(r, p.errorSleepTimeSeconds, fullFileURL, filePath, errorCodePrefix, int(p.uploadChunkSizeMB * 1024 * 1024))
+  c3RunJournal.completeFile('post', remoteUploadFilePath)
+
+
+
+
+def _getPostImportFileArgs (r, p, directoryOnEnv, dataTypeImport):
+  # Returns the remote url of every file of the type, & the args of the ones not yet posted
+  c3Type = dataTypeImport[0]
+  filePaths = _getFilePathsToPost(p, dataTypeImport)
+  dataTypeFilesRemoteFolderPath = '/'.join([directoryOnEnv, c3Type])
+
+  fieldLabelMap = None
+  if ((p.compressOnTheFly == True) and (p.stripMetadataAndDerived == True)):
+    fieldLabelMap = c3UtilityMethods.retrieveLabeledFields(r, c3Type, p.errorSleepTimeSeconds, p.schemaCacheTTLSeconds)
+
+  remoteFileUrls = ['/'.join([dataTypeFilesRemoteFolderPath, str(idx) + '.json.gz']) for idx in range(len(filePaths))]
+  listOfArgs = []
+  for filePath, remoteUploadFilePath in zip(filePaths, remoteFileUrls):
+    if (c3RunJournal.isFileComplete('post', remoteUploadFilePath)):
+      continue
+    fullFileURL = c3Request.generateFileURL(r, remoteUploadFilePath)
+    errorCodePrefix = 'Unsuccessful pushing ' + c3Type + ': ' + fullFileURL
+    listOfArgs.append((r, p, fullFileURL, filePath, fieldLabelMap, errorCodePrefix, remoteUploadFilePath))
+
+  return remoteFileUrls, listOfArgs
+
+
+
+
+def _prepareRemoteImportDirectory (r, p):
   directoryOnEnv = c3FileSystem.getRemoteImportDirectory(r, p)
-  c3FileSystem.deleteRemoteDirectory(r, p, directoryOnEnv)
+  if (not c3RunJournal.hasCompletedFiles('post')):
+    c3FileSystem.deleteRemoteDirectory(r, p, directoryOnEnv) # A resumed run keeps the files it already posted
+
+  return directoryOnEnv
+
+
+
+
+def _postImportFiles (r, p):
+  directoryOnEnv = _prepareRemoteImportDirectory(r, p)
 
   for dataTypeImport in p.dataTypeImports:
     c3Type = dataTypeImport[0]
-    gzipFilePaths = dataTypeImport[1]['gzipFiles']
-    dataTypeFilesRemoteFolderPath = '/'.join([directoryOnEnv, c3Type])
+    filePaths = _getFilePathsToPost(p, dataTypeImport)
 
     if (dataTypeImport[1]['uploadData'] != True):
       c3UtilityMethods.printFormatExtraPeriods('Posting ' + c3Type, 'UPLOAD FLAG IS FALSE', p.maxColumnPrintLength, True)
       continue
 
-    if (len(gzipFilePaths) == 0):
+    if (len(filePaths) == 0):
       c3UtilityMethods.printFormatExtraPeriods('Posting ' + c3Type, 'NO IMPORT FILES', p.maxColumnPrintLength, True)
       continue
 
-    remoteFileUrls = []
+    remoteFileUrls, listOfArgs = _getPostImportFileArgs(r, p, directoryOnEnv, dataTypeImport)
     result = c3UtilityMethods.printFormatExtraPeriods('Posting ' + c3Type, ' |████████████████████████████████|', p.maxColumnPrintLength, False)
-    progressBar = IncrementalBar(''.join(result[:2]), max=len(gzipFilePaths))
-    for idx, gzipFilePath in enumerate(gzipFilePaths):
-      remoteUploadFilePath = '/'.join([dataTypeFilesRemoteFolderPath, str(idx) + '.json.gz'])
-      fullFileURL = c3Request.generateFileURL(r, remoteUploadFilePath)
-      errorCodePrefix = 'Unsuccessful pushing ' + c3Type + ': ' + fullFileURL
-      c3Request.uploadFileToURL(r, p.errorSleepTimeSeconds, fullFileURL, gzipFilePath, errorCodePrefix)
-      remoteFileUrls.append(remoteUploadFilePath)
-      [progressBar.next() for _ in range(1)]
+    progressBar = IncrementalBar(''.join(result[:2]), max=len(filePaths))
+    progressBar.next(len(filePaths) - len(listOfArgs))
+    c3UtilityMethods.runInThreadPool(p.maxConcurrentUploads, _postImportFile, listOfArgs, progressBar)
     progressBar.finish()
     dataTypeImport[1]['remoteFileUrls'] = remoteFileUrls
 
 
 
 
+def _startDataUploadOfType (r, p, dataTypeImport, c3TypeToBatchJobMapping):
+  c3Type = dataTypeImport[0]
+  url = c3Request.generateTypeActionURL(r, 'Import', 'startImport')
+  payload = {
+    'spec': {
+      'targetType': c3Type,
+      'fileList': {
+        'urls': dataTypeImport[1]['remoteFileUrls']
+      }
+    }
+  }
+  errorCodePrefix = 'Unsuccessful kicking off import of type ' + c3Type
+  request = c3Request.makeRequest(r, p.errorSleepTimeSeconds, url, payload, errorCodePrefix)
+  batchJobId = c3UtilityMethods.createInitialBatchJobStatusEntry(request, c3Type, c3TypeToBatchJobMapping, None)
+  c3TypeToBatchJobMapping[-1][1]['initialFetchCount'] = dataTypeImport[1]['recordCount']
+
+  return batchJobId
+
+
+
+
 def _startDataUploadToEnv (r, p):
   c3TypeToBatchJobMapping = []
+  dataTypeImportsToStart = []
   for dataTypeImport in p.dataTypeImports:
     c3Type = dataTypeImport[0]
-    gzipFilePaths = dataTypeImport[1]['gzipFiles']
+    filePaths = _getFilePathsToPost(p, dataTypeImport)
 
     if (dataTypeImport[1]['uploadData'] != True):
       c3UtilityMethods.printFormatExtraPeriods('Kicking off ' + c3Type, 'UPLOAD FLAG IS FALSE', p.maxColumnPrintLength, True)
       continue
 
-    if (len(gzipFilePaths) == 0):
+    if (len(filePaths) == 0):
       c3UtilityMethods.printFormatExtraPeriods('Kicking off ' + c3Type, 'NO IMPORT FILES', p.maxColumnPrintLength, True)
       continue
 
-    url = c3Request.generateTypeActionURL(r, 'Import', 'startImport')
-    payload = {
-      'spec': {
-        'targetType': c3Type,
-        'fileList': {
-          'urls': dataTypeImport[1]['remoteFileUrls']
-        }
-      }
-    }
-    errorCodePrefix = 'Unsuccessful kicking off import of type ' + c3Type
-    request = c3Request.makeRequest(r, p.errorSleepTimeSeconds, url, payload, errorCodePrefix)
-    batchJobId = c3UtilityMethods.createInitialBatchJobStatusEntry(request, c3Type, c3TypeToBatchJobMapping, None)
-    c3TypeToBatchJobMapping[-1][1]['initialFetchCount'] = dataTypeImport[1]['recordCount']
-    c3UtilityMethods.printFormatExtraPeriods('Kicking off ' + c3Type, 'id=' + str(batchJobId), p.maxColumnPrintLength, True)
+    dataTypeImportsToStart.append(dataTypeImport)
+
+  # Each type's import waits only on its own remove, & types get kicked off in whichever order their removes finish.
+  # Every import is journaled as it is kicked off, so one started before an interrupt is reattached to, not relaunched.
+  while (len(dataTypeImportsToStart) > 0):
+    reattachableC3Types = [x[0] for x in dataTypeImportsToStart if c3RunJournal.hasStartedBatchJob('import', x[0])]
+    removedC3Types = reattachableC3Types or c3DataRemove.waitForRemovesToFinish([x[0] for x in dataTypeImportsToStart])
+    for dataTypeImport in [x for x in dataTypeImportsToStart if (x[0] in removedC3Types)]:
+      startImport = lambda: _startDataUploadOfType(r, p, dataTypeImport, c3TypeToBatchJobMapping)
+      wasReattached = c3RunJournal.startOrReattachBatchJob('import', dataTypeImport[0], c3TypeToBatchJobMapping, startImport)
+      prefix = ('Reattaching ' if wasReattached else 'Kicking off ') + dataTypeImport[0]
+      c3UtilityMethods.printFormatExtraPeriods(prefix, 'id=' + str(c3TypeToBatchJobMapping[-1][1]['id']), p.maxColumnPrintLength, True)
+      dataTypeImportsToStart.remove(dataTypeImport)
 
   return c3TypeToBatchJobMapping
 
@@ -114,34 +229,226 @@ def _cleanUpZippedImportFiles (r, p):
   remoteImportDir = c3FileSystem.getRemoteImportDirectory(r, p)
   c3FileSystem.deleteRemoteDirectory(r, p, remoteImportDir)
 
-  listOfListOfGZipPaths = [x[1]['gzipFiles'] for x in p.dataTypeImports]
-  flattenedListGZipPaths = reduce(lambda z, y : z + y, listOfListOfGZipPaths)
-  c3FileSystem.deleteLocalFiles(flattenedListGZipPaths)
+  if ((p.keepZippedImportFiles != True) or (p.reshardImportFiles == True)): # Kept .gz files are reused by the next upload
+    listOfListOfGZipPaths = [x[1]['gzipFiles'] for x in p.dataTypeImports]
+    flattenedListGZipPaths = reduce(lambda z, y : z + y, listOfListOfGZipPaths)
+    c3FileSystem.deleteLocalFiles(flattenedListGZipPaths)
 
 
 
 
-def uploadDataToEnv (r, p):
-  if (p.masterUploadDataSwitch != True):
-    return
+def _postImportFilesInBackground (r, p, typeStates, handOffState):
+  try:
+    directoryOnEnv = _prepareRemoteImportDirectory(r, p)
+    for typeState in typeStates.values():
+      if (typeState['needsImport'] != True):
+        continue
+      dataTypeImport = typeState['dataTypeImport']
+      remoteFileUrls, listOfArgs = _getPostImportFileArgs(r, p, directoryOnEnv, dataTypeImport)
+      if (typeState['importJob'] != None):
+        listOfArgs = [] # Reattached to an import kicked off by an interrupted run, so its files are already on the env
+      typeState['numFiles'] = len(remoteFileUrls)
+      typeState['numFilesPosted'] = len(remoteFileUrls) - len(listOfArgs)
+      def onFilePosted (_, typeState=typeState):
+        typeState['numFilesPosted'] += 1
+      c3UtilityMethods.runInThreadPool(p.maxConcurrentUploads, _postImportFile, listOfArgs, None, onFilePosted)
+      dataTypeImport[1]['remoteFileUrls'] = remoteFileUrls
+      typeState['posted'] = True
+  except BaseException as e:
+    handOffState['exception'] = e
 
-  c3UtilityMethods.printFormatExtraDashes('SCANNING DOWNLOAD FOLDER INFO', p.maxColumnPrintLength, True)
-  c3FileSystem.scanFilesInDirectory(p, p.dataTypeImports, p.dataUploadFolder, True)
 
-  c3UtilityMethods.printFormatExtraDashes('ZIPPING IMPORT FILES', p.maxColumnPrintLength, True)
-  _zipImportFiles(r, p)
-  c3UsageStats.UploadAPI.logZipFiles(r, p)
 
-  c3UtilityMethods.printFormatExtraDashes('CURLING UP IMPORT FILES', p.maxColumnPrintLength, True)
-  _postImportFiles(r, p)
-  c3UsageStats.UploadAPI.logCurlFiles(r, p)
 
-  c3UtilityMethods.printFormatExtraDashes('UPLOADING DATA TO THE ENV', p.maxColumnPrintLength, True)
-  c3TypeToBatchJobMapping = _startDataUploadToEnv(r, p)
-  _finishDataUploadToEnv(r, p, c3TypeToBatchJobMapping)
+_handOffJobKinds = {
+  'import':       { 'jobKey': 'importJob',  'mappingKey': 'importMapping',  'jobType': 'Import',                    'typeOfBatchJob': 'importAction' },
+  'refreshCalcs': { 'jobKey': 'refreshJob', 'mappingKey': 'refreshMapping', 'jobType': 'RefreshCalcFieldsBatchJob', 'typeOfBatchJob': 'refreshCalcs' },
+}
+
+
+
+
+def _startOrReattachHandOffJob (typeState, handOffState, phase, startBatchJob):
+  # Journaled the moment it is kicked off, so an interrupted run reattaches to it instead of launching it again
+  jobKind = _handOffJobKinds[phase]
+  c3TypeToBatchJobMapping = handOffState[jobKind['mappingKey']]
+  c3RunJournal.startOrReattachBatchJob(phase, typeState['dataTypeImport'][0], c3TypeToBatchJobMapping, startBatchJob)
+
+  c3TypeToBatchJob = c3TypeToBatchJobMapping[-1]
+  c3TypeToBatchJob[1]['jobType'] = jobKind['jobType']
+  c3TypeToBatchJob[1]['typeOfBatchJob'] = jobKind['typeOfBatchJob']
+  if ((phase == 'import') and (c3TypeToBatchJob[1]['currentFetchCount'] == None)):
+    c3TypeToBatchJob[1]['currentFetchCount'] = 0 # Shown before its first poll comes back
+  typeState[jobKind['jobKey']] = c3TypeToBatchJob
+  handOffState['monitoredMapping'].append(c3TypeToBatchJob)
+
+
+
+
+def _reattachHandOffJobs (typeStates, handOffState):
+  for c3Type, typeState in typeStates.items():
+    if ((typeState['needsImport'] == True) and c3RunJournal.hasStartedBatchJob('import', c3Type)):
+      _startOrReattachHandOffJob(typeState, handOffState, 'import', None)
+      typeState['posted'] = True
+    if ((typeState['needsRefresh'] == True) and c3RunJournal.hasStartedBatchJob('refreshCalcs', c3Type)):
+      _startOrReattachHandOffJob(typeState, handOffState, 'refreshCalcs', None)
+
+
+
+
+def _isTypeHandedOff (typeState):
+  # Done once every job the type needs is kicked off, the monitor keeps polling the ones still running
+  return (c3DataRemove.isRemoveFinished(typeState['dataTypeImport'][0])
+    and ((typeState['needsImport'] != True) or (typeState['importJob'] != None))
+    and ((typeState['needsRefresh'] != True) or (typeState['refreshJob'] != None)))
+
+
+
+
+def _scheduleHandOffJobs (r, p, typeStates, handOffState):
+  if (handOffState['exception'] != None):
+    raise handOffState['exception']
+
+  for typeState in typeStates.values():
+    dataTypeImport = typeState['dataTypeImport']
+    if (not c3DataRemove.isRemoveFinished(dataTypeImport[0])):
+      continue
+
+    if ((typeState['needsImport'] == True) and (typeState['importJob'] == None) and (typeState['posted'] == True)):
+      startImport = lambda: _startDataUploadOfType(r, p, dataTypeImport, handOffState['importMapping'])
+      _startOrReattachHandOffJob(typeState, handOffState, 'import', startImport)
+
+    importFinished = (typeState['needsImport'] != True) or ((typeState['importJob'] != None) and (not c3JobMonitor.isBatchJobRunning(typeState['importJob'])))
+    if ((typeState['needsRefresh'] == True) and (typeState['refreshJob'] == None) and importFinished):
+      startRefresh = lambda: c3DataRefreshCalcFields.startRefreshCalcFieldsOfType(r, p, dataTypeImport, handOffState['refreshMapping'])
+      _startOrReattachHandOffJob(typeState, handOffState, 'refreshCalcs', startRefresh)
+
+  return not all(_isTypeHandedOff(x) for x in typeStates.values())
+
+
+
+
+def _formatHandOffLine (p, typeState):
+  c3Type = typeState['dataTypeImport'][0]
+  for batchJob in [typeState['refreshJob'], typeState['importJob']]:
+    if (batchJob != None):
+      outputLines = ['']
+      c3UtilityMethods.printBatchJobStatuses([batchJob], outputLines, p.maxColumnPrintLength, batchJob[1]['typeOfBatchJob'])
+      return outputLines[0]
+
+  if ((typeState['needsImport'] == True) and (typeState['posted'] != True)):
+    result = c3UtilityMethods.printFormatExtraPeriods('Posting ' + c3Type, '{:,}'.format(typeState['numFilesPosted']) + '/' + '{:,}'.format(typeState['numFiles']) + ' FILES', p.maxColumnPrintLength, False)
+  elif (not c3DataRemove.isRemoveFinished(c3Type)):
+    result = c3UtilityMethods.printFormatExtraPeriods('Waiting on ' + c3Type, 'REMOVE STILL RUNNING', p.maxColumnPrintLength, False)
+  elif ((typeState['needsImport'] != True) and (typeState['needsRefresh'] != True)):
+    result = c3UtilityMethods.printFormatExtraPeriods('Handing off ' + c3Type, 'NOTHING TO IMPORT OR REFRESH', p.maxColumnPrintLength, False)
+  else:
+    result = c3UtilityMethods.printFormatExtraPeriods('Handing off ' + c3Type, 'QUEUED', p.maxColumnPrintLength, False)
+
+  return ''.join(result)
+
+
+
+
+def _uploadAndRefreshTypeByType (r, p):
+  # Each type's import starts as soon as its files are posted (and its remove is done), & its refresh as soon as its import is
+  typeStates = {}
+  for dataTypeImport in p.dataTypeImports:
+    typeStates[dataTypeImport[0]] = {
+      'dataTypeImport': dataTypeImport,
+      'needsImport':    (dataTypeImport[1]['uploadData'] == True) and (len(_getFilePathsToPost(p, dataTypeImport)) > 0),
+      'needsRefresh':   (p.masterRefreshDataSwitch == True) and (dataTypeImport[1]['refreshCalcFields'] == True),
+      'numFiles':       len(_getFilePathsToPost(p, dataTypeImport)),
+      'numFilesPosted': 0,
+      'posted':         False,
+      'importJob':      None,
+      'refreshJob':     None,
+    }
+  handOffState = {
+    'exception':        None,
+    'importMapping':    [],
+    'refreshMapping':   [],
+    'monitoredMapping': [],
+  }
+
+  c3UtilityMethods.printFormatExtraDashes('CURLING UP, UPLOADING & REFRESHING TYPE BY TYPE', p.maxColumnPrintLength, True)
+  _reattachHandOffJobs(typeStates, handOffState)
+  postingThread = threading.Thread(target=_postImportFilesInBackground, args=(r, p, typeStates, handOffState), daemon=True)
+  postingThread.start()
+
+  def pollJobs (jobsToPoll):
+    for jobType in dict.fromkeys(x[1]['jobType'] for x in jobsToPoll):
+      jobsOfType = [x for x in jobsToPoll if (x[1]['jobType'] == jobType)]
+      c3UtilityMethods.pollBatchJobs(r, p, jobsOfType, jobType, jobsOfType[0][1]['typeOfBatchJob'])
+
+  with output(output_type='list', initial_len=len(typeStates), interval=0) as outputLines:
+    def renderStatuses ():
+      for idx, typeState in enumerate(typeStates.values()):
+        outputLines[idx] = _formatHandOffLine(p, typeState)
+    scheduleJobs = lambda: _scheduleHandOffJobs(r, p, typeStates, handOffState)
+    c3JobMonitor.monitorBatchJobs(p, handOffState['monitoredMapping'], pollJobs, renderStatuses, None, scheduleJobs)
+    renderStatuses()
+  postingThread.join()
+
+  c3DataRemove.finishRemoveDataFromEnv(r, p)
+  c3UsageStats.UploadAPI.logCurlFiles(r, p)
   _cleanUpZippedImportFiles(r, p)
-  c3UsageStats.UploadAPI.logBatchJob(r, p, c3TypeToBatchJobMapping)
+  c3RunJournal.completeBatchJobPhase('import', handOffState['importMapping'])
+  c3UsageStats.UploadAPI.logBatchJob(r, p, handOffState['importMapping'])
+  if (p.masterRefreshDataSwitch == True):
+    c3RunJournal.completeBatchJobPhase('refreshCalcs', handOffState['refreshMapping'])
+
+  return handOffState['importMapping'], handOffState['refreshMapping']
+
+
+
+
+def _canHandOffTypeByType (p):
+  # Imports & refreshes kicked off type by type get reattached to from their own journal entries, only a run that kicked off
+  # all its imports in one go (with handOffTypeByType off) reattaches to them one stage at a time
+  return ((p.handOffTypeByType == True) and (not c3RunJournal.isPhaseComplete('import')) and (not c3RunJournal.hasBatchJobs('import')))
+
+
+
+
+def uploadDataToEnv (r, p):
+  # Returns the refreshCalcFields jobs when they already ran type by type alongside the imports
+  if (p.masterUploadDataSwitch != True):
+    return None
+  c3Request.resetChunkedUploads()
+
+  c3UtilityMethods.printFormatExtraDashes('SCANNING & ZIPPING IMPORT FILES', p.maxColumnPrintLength, True)
+  if (c3RunJournal.isPhaseComplete('import')):
+    c3RunJournal.printPhaseAlreadyComplete(p, 'scanAndZip')
+  else:
+    _scanAndZipImportFiles(r, p)
+    c3UsageStats.UploadAPI.logZipFiles(r, p)
+
+  refreshMapping = None
+  if (_canHandOffTypeByType(p)):
+    c3TypeToBatchJobMapping, refreshMapping = _uploadAndRefreshTypeByType(r, p)
+  else:
+    c3UtilityMethods.printFormatExtraDashes('CURLING UP IMPORT FILES', p.maxColumnPrintLength, True)
+    if (c3RunJournal.isPhaseComplete('import')):
+      c3RunJournal.printPhaseAlreadyComplete(p, 'post')
+    else:
+      _postImportFiles(r, p)
+      c3UsageStats.UploadAPI.logCurlFiles(r, p)
+
+    c3UtilityMethods.printFormatExtraDashes('UPLOADING DATA TO THE ENV', p.maxColumnPrintLength, True)
+    if (c3RunJournal.isPhaseComplete('import')):
+      c3RunJournal.printPhaseAlreadyComplete(p, 'import')
+      c3TypeToBatchJobMapping = c3RunJournal.getCompletedBatchJobMapping('import')
+    else:
+      c3TypeToBatchJobMapping = c3RunJournal.startOrReattachBatchJobs(p, 'import', lambda: _startDataUploadToEnv(r, p))
+      c3DataRemove.finishRemoveDataFromEnv(r, p) # Every remove is done by the time the last import got kicked off
+      _finishDataUploadToEnv(r, p, c3TypeToBatchJobMapping)
+      _cleanUpZippedImportFiles(r, p)
+      c3RunJournal.completeBatchJobPhase('import', c3TypeToBatchJobMapping)
+      c3UsageStats.UploadAPI.logBatchJob(r, p, c3TypeToBatchJobMapping)
 
   c3UtilityMethods.printFormatExtraDashes('GENERATING IMPORT QUEUE ERROR FILES', p.maxColumnPrintLength, True)
   c3UtilityMethods.outputAllQueueErrorsFromMapping(r, p, c3TypeToBatchJobMapping, 'Import')
   c3UsageStats.UploadAPI.logImportErrors(r, p, c3TypeToBatchJobMapping)
+
+  return refreshMapping
@@ -0,0 +1,25 @@
+import types
+
+from c3DataMigration.c3Helpers import c3RunJournal
+from c3DataMigration.c3MigrationMethods import c3DataUpload
+
+
+def test_restoreScanAndZipFromJournal_rezips_json_files_edited_since(tmp_path, monkeypatch):
+  jsonFilePath = str(tmp_path / 'a.json')
+  with open(jsonFilePath, 'w') as f:
+    f.write('[{"id": "a"}]')
+  with open(jsonFilePath + '.gz', 'wb') as f:
+    f.write(b'zipped')
+  scannedDataTypes = { 'A': { 'files': [jsonFilePath], 'gzipFiles': [jsonFilePath + '.gz'], 'recordCount': 1 } }
+  scannedDataTypes['A']['fileStats'] = c3DataUpload._getJournaledFileStats([jsonFilePath + '.gz', jsonFilePath])
+  monkeypatch.setattr(c3RunJournal, 'getCompletedPhaseData', lambda phase: scannedDataTypes)
+  monkeypatch.setattr(c3RunJournal, 'printPhaseAlreadyComplete', lambda p, phase: None)
+
+  p = types.SimpleNamespace(dataTypeImports=[['A', {}]])
+  assert (c3DataUpload._restoreScanAndZipFromJournal(p) == True)
+  assert (p.dataTypeImports[0][1] == { 'files': [jsonFilePath], 'gzipFiles': [jsonFilePath + '.gz'], 'recordCount': 1 })
+
+  with open(jsonFilePath, 'w') as f:
+    f.write('[{"id": "a"}, {"id": "b"}]')
+  p = types.SimpleNamespace(dataTypeImports=[['A', {}]])
+  assert (c3DataUpload._restoreScanAndZipFromJournal(p) == False)
@@ -0,0 +1,20 @@
+import gzip
+import os
+
+from c3DataMigration.c3Helpers import c3ParallelGzip
+
+
+def test_ParallelGzipCompressor_bounds_queued_blocks_of_one_big_write():
+  data = os.urandom(64 * 1024) * 40
+  compressor = c3ParallelGzip.ParallelGzipCompressor(6, 2, 16 * 1024)
+  maxQueued = { 'count': 0 }
+  queueBlock = compressor._queueBlock
+  def countingQueueBlock(block, isLastBlock):
+    queueBlock(block, isLastBlock)
+    maxQueued['count'] = max(maxQueued['count'], len(compressor.queuedBlocks))
+  compressor._queueBlock = countingQueueBlock
+
+  compressedBytes = compressor.compress(data) + compressor.flush()
+
+  assert (maxQueued['count'] <= compressor.maxQueuedBlocks + 1)
+  assert (gzip.decompress(compressedBytes) == data)
@@ -0,0 +1,49 @@
+import time
+from types import SimpleNamespace
+from unittest import mock
+
+from c3DataMigration.c3Helpers import c3Request
+
+
+def _response(statusCode, text=''):
+  return SimpleNamespace(status_code=statusCode, text=text, headers={})
+
+
+def test_makeRequest_retries_401_with_a_fresh_token():
+  r = SimpleNamespace(env='https://env', tenant='t', tag='g', authToken='OLD', user=None, password=None)
+  sentTokens = []
+
+  def post(url=None, headers=None, data=None, **kwargs):
+    if ('generateC3AuthToken' in url):
+      return _response(200, '<generateC3AuthTokenResponse version="2.0">NEW</generateC3AuthTokenResponse>')
+    sentTokens.append(headers['Authorization'])
+    return _response(401 if (headers['Authorization'] == 'OLD') else 200, 'ok')
+
+  with mock.patch.object(c3Request, 'getSession', return_value=SimpleNamespace(post=post)), \
+       mock.patch.object(c3Request, 'lastRefreshTime', time.time()), \
+       mock.patch('time.sleep'):
+    response = c3Request.makeRequest(r, 0, c3Request.generateTypeActionURL(r, 'A', 'fetch'), {}, 'Failed')
+
+  assert (response.status_code == 200)
+  assert (sentTokens == ['OLD', 'NEW'])
+  assert (r.authToken == 'NEW')
+
+
+def test_resetChunkedUploads_lets_the_next_run_post_in_chunks_again(tmp_path):
+  uploadFilePath = str(tmp_path / 'a.json.gz')
+  with open(uploadFilePath, 'wb') as f:
+    f.write(b'x' * 100)
+  r = SimpleNamespace(env='https://env', tenant='t', tag='g', authToken='T', user=None, password=None)
+
+  with mock.patch.object(c3Request, '_uploadFileToURLInChunks', return_value=False) as uploadFileToURLInChunks, \
+       mock.patch.object(c3Request, 'getSession', return_value=SimpleNamespace(post=lambda *args, **kwargs: SimpleNamespace(status_code=200, text='', headers={}, close=lambda: None))), \
+       mock.patch.object(c3Request, '_refreshAuthToken'):
+    c3Request.uploadFileToURL(r, 0, 'https://env/file', uploadFilePath, 'Failed', 10)
+    c3Request.uploadFileToURL(r, 0, 'https://env/file', uploadFilePath, 'Failed', 10)
+    assert (uploadFileToURLInChunks.call_count == 1)
+
+    c3Request.resetChunkedUploads()
+    c3Request.uploadFileToURL(r, 0, 'https://env/file', uploadFilePath, 'Failed', 10)
+    assert (uploadFileToURLInChunks.call_count == 2)
+
+  c3Request.resetChunkedUploads()
@@ -0,0 +1,36 @@
+import resource
+
+from c3DataMigration.c3Helpers import c3ScanManifest
+
+
+def _writeDigest(idDigestPath, idHashes):
+  idDigestWriter = c3ScanManifest.IdDigestWriter()
+  idDigestWriter.extend(idHashes)
+  idDigestWriter.write(idDigestPath)
+
+
+def test_findDuplicateIdHashes_merges_more_digests_than_files_can_be_open(tmp_path):
+  softLimit, hardLimit = resource.getrlimit(resource.RLIMIT_NOFILE)
+  resource.setrlimit(resource.RLIMIT_NOFILE, (128, hardLimit))
+  try:
+    idDigestPaths = []
+    for idx in range(600):
+      idDigestPaths.append(str(tmp_path / (str(idx) + '.ids')))
+      _writeDigest(idDigestPaths[-1], [idx * 10, idx * 10 + 1] + ([7] if (idx % 100 == 0) else []))
+
+    duplicateIdHashes = c3ScanManifest.findDuplicateIdHashes(idDigestPaths, 256 * 1024 * 1024)
+  finally:
+    resource.setrlimit(resource.RLIMIT_NOFILE, (softLimit, hardLimit))
+
+  assert (duplicateIdHashes == {7})
+
+
+def test_IdDigestWriter_spills_sorted_runs_and_merges_them(tmp_path):
+  idHashes = [(x * 7919) % 100003 for x in range(50000)]
+  idDigestWriter = c3ScanManifest.IdDigestWriter(64 * 1024)
+  idDigestWriter.extend(idHashes)
+  assert (len(idDigestWriter.runPaths) > 1)
+
+  idDigestWriter.write(str(tmp_path / 'a.ids'))
+
+  assert (list(c3ScanManifest.iterateIdDigest(str(tmp_path / 'a.ids'), 64 * 1024)) == sorted(idHashes))